@@ -0,0 +1,215 @@
+"""
+📈 SLA-аналитика по заявкам на NumPy
+
+Время создания, назначения и завершения забирается из базы одной
+колоночной выборкой, все показатели (перцентили времени реакции и
+выполнения, разбивка по администраторам, дням недели и часам, динамика
+очереди) считаются векторно. Отчет кэшируется по версии данных заявок
+(таблица cache_versions, ее обновляют триггеры), поэтому повторные
+просмотры не трогают таблицу заявок.
+"""
+import html
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+SECONDS_PER_DAY = 86400.0
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+PERCENTILES = (50, 90, 95)
+# 1 января 1970 года - четверг (понедельник = 0)
+EPOCH_WEEKDAY = 3
+
+# Время в секундах Unix; строки, до которых еще не дошло заполнение колонок *_ts, пропускаются
+# (по его окончании версия данных меняется и отчеты пересчитываются)
+SLA_ROWS_SQL = '''
+    SELECT created_ts, assigned_ts, completed_ts, status, COALESCE(assigned_admin, '—'), COALESCE(user_rating, 0)
+    FROM requests WHERE created_ts IS NOT NULL
+    UNION ALL
+    SELECT created_ts, assigned_ts, completed_ts, status, COALESCE(assigned_admin, '—'), COALESCE(user_rating, 0)
+    FROM requests_archive WHERE created_ts IS NOT NULL
+'''
+
+def _percentiles(values: np.ndarray) -> Dict[str, float]:
+    """📊 Перцентили в минутах (пустой массив - пустой результат)"""
+    if values.size == 0:
+        return {}
+    result = np.percentile(values / 60.0, PERCENTILES)
+    return {f"p{p}": float(v) for p, v in zip(PERCENTILES, result)}
+
+def utc_offset() -> float:
+    """🌍 Смещение локального времени от UTC в секундах (дни и часы считаются по местному времени)"""
+    return datetime.now().astimezone().utcoffset().total_seconds()
+
+def to_columns(rows: List[Tuple]) -> Dict[str, np.ndarray]:
+    """🧱 Строки (created, assigned, completed в секундах Unix, status, admin, rating) -> колонки"""
+    if not rows:
+        empty = np.empty(0)
+        return {'created': empty, 'assigned': empty, 'completed': empty,
+                'status': np.empty(0, dtype=object), 'admin': np.empty(0, dtype=object), 'rating': empty}
+    # Двумерный массив объектов режется на колонки быстрее, чем zip(*rows); None становится NaN
+    table = np.array(rows, dtype=object)
+    return {
+        'created': table[:, 0].astype(float),
+        'assigned': table[:, 1].astype(float),
+        'completed': table[:, 2].astype(float),
+        'status': table[:, 3],
+        'admin': table[:, 4],
+        'rating': table[:, 5].astype(float),
+    }
+
+def backlog_series(created: np.ndarray, completed: np.ndarray, moments: np.ndarray) -> np.ndarray:
+    """📉 Открытые заявки на каждый момент: создано к моменту минус закрыто"""
+    created_sorted = np.sort(created)
+    completed_sorted = np.sort(completed[~np.isnan(completed)])
+    return (np.searchsorted(created_sorted, moments, side='right')
+            - np.searchsorted(completed_sorted, moments, side='right'))
+
+def _backlog(created: np.ndarray, completed: np.ndarray, now: float, days: int, offset: float) -> List[int]:
+    """📉 Открытые заявки на конец каждого из последних days дней"""
+    day_ends = (np.floor((now + offset) / SECONDS_PER_DAY) - np.arange(days)[::-1]) * SECONDS_PER_DAY - offset
+    return backlog_series(created, completed, day_ends).tolist()
+
+def compute_sla(columns: Dict[str, np.ndarray], now: float, days: Optional[int] = None,
+                backlog_days: int = 14, offset: float = 0.0) -> Dict[str, Any]:
+    """🧮 Все показатели SLA по колонкам (время в секундах Unix, offset - смещение местного времени)
+
+    Период days ограничивает заявки по дате создания, динамика очереди
+    всегда считается по всем заявкам, иначе старые открытые потерялись бы.
+    """
+    backlog = _backlog(columns['created'], columns['completed'], now, backlog_days, offset)
+    if days:
+        period = columns['created'] >= now - days * SECONDS_PER_DAY
+        columns = {name: values[period] for name, values in columns.items()}
+    created, assigned, completed = columns['created'], columns['assigned'], columns['completed']
+    status, admin, rating = columns['status'], columns['admin'], columns['rating']
+
+    time_to_assign = assigned - created
+    time_to_complete = completed - created
+    assigned_mask = ~np.isnan(time_to_assign)
+    completed_mask = ~np.isnan(time_to_complete)
+
+    report: Dict[str, Any] = {
+        'total': int(created.size),
+        'new': int(np.count_nonzero(status == 'new')),
+        'in_progress': int(np.count_nonzero(status == 'in_progress')),
+        'completed': int(np.count_nonzero(status == 'completed')),
+        'time_to_assign': _percentiles(time_to_assign[assigned_mask]),
+        'time_to_complete': _percentiles(time_to_complete[completed_mask]),
+    }
+
+    # Разбивка по администраторам
+    admins, admin_index = np.unique(admin[assigned_mask], return_inverse=True)
+    admin_assign = time_to_assign[assigned_mask]
+    admin_complete = time_to_complete[assigned_mask]
+    admin_rating = rating[assigned_mask]
+    taken = np.bincount(admin_index, minlength=admins.size)
+    done_mask = ~np.isnan(admin_complete)
+    done = np.bincount(admin_index[done_mask], minlength=admins.size)
+    rated_mask = admin_rating > 0
+    rating_sum = np.bincount(admin_index[rated_mask], weights=admin_rating[rated_mask], minlength=admins.size)
+    rating_count = np.bincount(admin_index[rated_mask], minlength=admins.size)
+    report['admins'] = []
+    for i, name in enumerate(admins):
+        member = admin_index == i
+        completes = admin_complete[member & done_mask]
+        report['admins'].append({
+            'admin': str(name),
+            'taken': int(taken[i]),
+            'completed': int(done[i]),
+            'assign_median': float(np.median(admin_assign[member])) / 60.0,
+            'complete_median': float(np.median(completes)) / 60.0 if completes.size else None,
+            'rating': float(rating_sum[i] / rating_count[i]) if rating_count[i] else None,
+        })
+    report['admins'].sort(key=lambda item: item['taken'], reverse=True)
+
+    # Нагрузка по дням недели и часам местного времени
+    local_days = (created + offset) / SECONDS_PER_DAY
+    weekday = (np.floor(local_days).astype(np.int64) + EPOCH_WEEKDAY) % 7
+    hour = ((local_days % 1.0) * 24).astype(np.int64)
+    heatmap = np.bincount(weekday * 24 + hour, minlength=7 * 24).reshape(7, 24)
+    report['by_weekday'] = heatmap.sum(axis=1).tolist()
+    report['by_hour'] = heatmap.sum(axis=0).tolist()
+    weekday_assign = np.bincount(weekday[assigned_mask], weights=time_to_assign[assigned_mask], minlength=7)
+    weekday_assigned = np.bincount(weekday[assigned_mask], minlength=7)
+    report['weekday_assign_mean'] = [
+        float(total / count) / 60.0 if count else None for total, count in zip(weekday_assign, weekday_assigned)
+    ]
+    report['backlog'] = backlog
+    return report
+
+def format_minutes(minutes: Optional[float]) -> str:
+    """⏱️ Минуты в виде «35 мин» / «4.2 ч» / «1.5 дн»"""
+    if minutes is None:
+        return "—"
+    if minutes < 60:
+        return f"{minutes:.0f} мин"
+    if minutes < 48 * 60:
+        return f"{minutes / 60:.1f} ч"
+    return f"{minutes / 1440:.1f} дн"
+
+def format_report(report: Dict[str, Any]) -> str:
+    """📈 HTML-текст отчета для Telegram"""
+    period = f"за {report['days']} дн." if report['days'] else "за все время"
+    text = (
+        f"📈 <b>SLA {period}</b>\n\n"
+        f"📋 Заявок: {report['total']} (🆕 {report['new']}, 🔄 {report['in_progress']}, ✅ {report['completed']})\n\n"
+    )
+    for key, title in (('time_to_assign', '⏱️ До взятия в работу'), ('time_to_complete', '🏁 До выполнения')):
+        if report[key]:
+            text += f"{title}: " + ", ".join(
+                f"{name} {format_minutes(value)}" for name, value in report[key].items()
+            ) + "\n"
+
+    if report['admins']:
+        text += "\n👨‍💼 <b>ИСПОЛНИТЕЛИ</b> (взято / выполнено, медианы реакции / выполнения, оценка):\n"
+        for item in report['admins'][:10]:
+            rating = f"{item['rating']:.1f}" if item['rating'] else "—"
+            text += (
+                f"• {html.escape(item['admin'])}: {item['taken']} / {item['completed']}, "
+                f"{format_minutes(item['assign_median'])} / {format_minutes(item['complete_median'])}, ⭐ {rating}\n"
+            )
+
+    text += "\n📅 <b>ПО ДНЯМ НЕДЕЛИ</b> (заявок, средняя реакция):\n"
+    for day, (count, mean) in enumerate(zip(report['by_weekday'], report['weekday_assign_mean'])):
+        text += f"• {WEEKDAYS[day]}: {count}, {format_minutes(mean)}\n"
+    busiest = sorted(range(24), key=lambda hour: report['by_hour'][hour], reverse=True)[:3]
+    text += "🕐 Пиковые часы: " + ", ".join(f"{hour:02d}:00 ({report['by_hour'][hour]})" for hour in busiest) + "\n"
+    text += (f"\n📉 <b>ОТКРЫТЫЕ ЗАЯВКИ</b> на конец дня, последние {len(report['backlog'])} дн.:\n"
+             + " ".join(str(value) for value in report['backlog']))
+    return text
+
+class SlaAnalytics:
+    """📈 Кэш SLA-отчетов по версии данных заявок.
+
+    Колонки загружаются один раз на версию и переиспользуются для любых
+    периодов; готовый отчет хранится по ключу (период, день), чтобы
+    динамика очереди сдвигалась с датой даже без новых заявок.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._columns: Dict[str, np.ndarray] = {}
+        self._reports: Dict[Tuple[Optional[int], date], Dict[str, Any]] = {}
+
+    def report(self, days: Optional[int] = None) -> Tuple[Dict[str, Any], bool]:
+        """📈 (отчет за последние days дней или за все время, взят ли из кэша)"""
+        version = self.db.get_data_version('requests')
+        key = (days, date.today())
+        with self._lock:
+            if version == self._version and key in self._reports:
+                return self._reports[key], True
+            if version != self._version:
+                # Версию читаем до выборки: запись между ними лишь вызовет лишний пересчет
+                self._columns = to_columns(self.db.get_sla_rows())
+                self._reports.clear()
+                self._version = version
+
+            report = compute_sla(self._columns, time.time(), days, offset=utc_offset())
+            report['days'] = days
+            self._reports[key] = report
+            return report, False
@@ -0,0 +1,500 @@
+"""
+📈 Нагрузочный бенчмарк конвейера обработчиков бота
+
+Собирает настоящее приложение через build_application() / setup_handlers()
+с заглушкой Bot API, которая только записывает исходящие вызовы, и прогоняет
+через него синтетические потоки обновлений на заранее заполненной базе:
+
+• 📝 создание заявки (полный диалог)
+• 👨‍💼 взятие в работу и завершение заявки администратором
+• 📂 просмотр "Мои заявки"
+• 📊 нажатие "Статистика"
+
+Для каждого сценария выводятся обновлений/с, p50/p95/p99 задержки и время в БД.
+
+Отдельно замеряется холодный старт (--startup N): время импорта main и
+время от запуска python bot/main.py до первого getUpdates.
+
+Запуск:
+    python bot/benchmark.py --sizes 10000 100000 1000000 --iterations 200
+    python bot/benchmark.py --sizes 10000 --json results.json
+    python bot/benchmark.py --startup 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.request import BaseRequest, RequestData
+
+BENCH_TOKEN = "123456:BENCHMARK"
+FIRST_SYNTHETIC_USER_ID = 2_000_000_000
+
+PROBLEMS = [
+    "Не работает интернет в кабинете 305",
+    "Принтер HP LaserJet печатает пустые листы",
+    "Не включается компьютер, при нажатии кнопки питания ничего не происходит",
+    "Требуется установка программы 1С на новый компьютер",
+    "Не приходит почта в Outlook с утра",
+    "Сломалась мышь, нужна замена",
+    "Не открывается общая папка на сервере",
+]
+
+# ==================== ЗАГЛУШКА BOT API ====================
+
+class RecordingRequest(BaseRequest):
+    """📼 Заглушка Bot API: записывает исходящие вызовы и возвращает правдоподобные ответы"""
+
+    def __init__(self, bot_id: int = 123456, record: bool = True):
+        self.bot_id = bot_id
+        self.record = record
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.call_count = 0
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "from": {"id": self.bot_id, "is_bot": True, "first_name": "Bench"},
+            "text": str(params.get("text", "")),
+        }
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args, **kwargs) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.call_count += 1
+        if self.record:
+            self.calls.append((endpoint, params))
+
+        if endpoint == "getMe":
+            result: Any = {"id": self.bot_id, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif endpoint == "getUpdates":
+            result = []
+        elif endpoint == "sendMediaGroup":
+            result = [self._message(params) for _ in params.get("media", [None])]
+        elif endpoint.startswith("send") or endpoint.startswith("edit"):
+            result = self._message(params)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+# ==================== СИНТЕТИЧЕСКИЕ ОБНОВЛЕНИЯ ====================
+
+class UpdateFactory:
+    """🏭 Генерирует JSON обновлений Telegram"""
+
+    def __init__(self):
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Dict[str, Any]:
+        update_id = self._next_id()
+        message = {
+            "message_id": update_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": update_id, "message": message}
+
+    def callback(self, user_id: int, data: str, message_text: str = "🆕 НОВАЯ ЗАЯВКА") -> Dict[str, Any]:
+        update_id = self._next_id()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": "bench",
+                "data": data,
+                "from": self._user(user_id),
+                "message": {
+                    "message_id": update_id,
+                    "date": int(datetime.now().timestamp()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": message_text,
+                },
+            },
+        }
+
+# ==================== ПОДГОТОВКА БАЗЫ ====================
+
+def seed_database(bot, path: str, n_requests: int, seed: int = 42, batch: int = 50_000) -> None:
+    """🌱 Создает базу с n_requests заявками и пропорциональным числом пользователей"""
+    database = bot.EnhancedDatabase(path)  # создает схему
+    rng = random.Random(seed)
+    n_users = max(1, n_requests // 20)
+    now = datetime.now()
+    start = now - timedelta(days=730)
+    span = int((now - start).total_seconds())
+
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, username, full_name, phone, created_at, last_activity, "
+            "last_activity_ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (uid, f"user{uid}", f"User {uid}", f"+7999{uid % 10_000_000:07d}",
+                 start.isoformat(), activity.isoformat(), bot.epoch(activity))
+                for uid, activity in (
+                    (uid, start + timedelta(seconds=rng.randrange(span))) for uid in range(1, n_users + 1)
+                )
+            ),
+        )
+
+        def rows(first: int, count: int):
+            # Даты создания растут вместе с id, как в живой базе
+            for index in range(first, first + count):
+                created = start + timedelta(seconds=span * (index + rng.random()) / n_requests)
+                roll = rng.random()
+                status = 'new' if roll < 0.05 else 'in_progress' if roll < 0.10 else 'completed'
+                assigned = created + timedelta(minutes=rng.randrange(5, 240)) if status != 'new' else None
+                completed = assigned + timedelta(minutes=rng.randrange(10, 2880)) if status == 'completed' else None
+                uid = rng.randrange(1, n_users + 1)
+                yield (
+                    uid, f"user{uid}", f"+7999{uid % 10_000_000:07d}", rng.choice(PROBLEMS), status,
+                    created.isoformat(),
+                    assigned.isoformat() if assigned else None,
+                    "Бенчмарк Админ" if assigned else None,
+                    completed.isoformat() if completed else None,
+                    "Проблема решена" if completed else None,
+                    rng.randrange(1, 6) if completed and rng.random() < 0.5 else 0,
+                    bot.epoch(created),
+                    bot.epoch(assigned) if assigned else None,
+                    bot.epoch(completed) if completed else None,
+                )
+
+        remaining = n_requests
+        while remaining > 0:
+            count = min(batch, remaining)
+            conn.executemany(
+                "INSERT INTO requests (user_id, username, phone, problem, status, created_at, assigned_at, "
+                "assigned_admin, completed_at, admin_comment, user_rating, created_ts, assigned_ts, completed_ts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows(n_requests - remaining, count),
+            )
+            conn.commit()
+            remaining -= count
+    # Индексы и прочие фоновые шаги миграций строятся уже по заполненной базе
+    database.migrator.run_backfills(bot.Config.MIGRATION_BATCH_SIZE)
+
+def prepare_database(bot, db_dir: str, n_requests: int, reseed: bool) -> str:
+    """📦 Возвращает путь к рабочей копии заполненной базы (заполненная база кэшируется)"""
+    os.makedirs(db_dir, exist_ok=True)
+    seed_path = os.path.join(db_dir, f"seed_{n_requests}.db")
+    if reseed or not os.path.exists(seed_path):
+        print(f"🌱 Заполнение базы {n_requests} заявками...")
+        tmp_path = seed_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        started = perf_counter()
+        seed_database(bot, tmp_path, n_requests)
+        os.replace(tmp_path, seed_path)
+        print(f"   готово за {perf_counter() - started:.1f} с")
+
+    run_path = os.path.join(db_dir, f"run_{n_requests}.db")
+    shutil.copyfile(seed_path, run_path)
+    return run_path
+
+# ==================== ПРОГОН ====================
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+class ScenarioStats:
+    """📊 Замеры одного сценария"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.api_calls = 0
+        self.wall_time = 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        values = sorted(self.latencies)
+        count = len(values)
+        return {
+            "scenario": self.name,
+            "updates": count,
+            "updates_per_second": count / self.wall_time if self.wall_time else 0.0,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "db_ms_per_update": self.db_time / count * 1000 if count else 0.0,
+            "db_queries_per_update": self.db_queries / count if count else 0.0,
+            "api_calls_per_update": self.api_calls / count if count else 0.0,
+        }
+
+class PipelineBenchmark:
+    """🏎️ Прогоняет сценарии через настоящее приложение"""
+
+    def __init__(self, bot, application, request: RecordingRequest, rng: random.Random,
+                 n_users: int, new_request_ids: List[int]):
+        self.bot = bot
+        self.application = application
+        self.request = request
+        self.rng = rng
+        self.n_users = n_users
+        self.new_request_ids = new_request_ids
+        self.factory = UpdateFactory()
+        self.admin_id = bot.Config.SUPER_ADMIN_IDS[0]
+        self._next_user = FIRST_SYNTHETIC_USER_ID
+        self.stats: Dict[str, ScenarioStats] = {}
+
+    async def feed(self, scenario: str, updates: List[Dict[str, Any]]) -> None:
+        stats = self.stats.setdefault(scenario, ScenarioStats(scenario))
+        query_stats = self.bot.query_stats
+        for data in updates:
+            update = Update.de_json(data, self.application.bot)
+            db_time, db_count, api_calls = query_stats.total_time, query_stats.total_count, self.request.call_count
+            started = perf_counter()
+            await self.application.process_update(update)
+            elapsed = perf_counter() - started
+            stats.latencies.append(elapsed)
+            stats.wall_time += elapsed
+            stats.db_time += query_stats.total_time - db_time
+            stats.db_queries += query_stats.total_count - db_count
+            stats.api_calls += self.request.call_count - api_calls
+
+    async def create_ticket(self) -> None:
+        user_id = self._next_user
+        self._next_user += 1
+        await self.feed("create_ticket", [
+            self.factory.message(user_id, "📝 Создать заявку"),
+            self.factory.message(user_id, f"+7 (999) {self.rng.randrange(1000000, 9999999)}"),
+            self.factory.message(user_id, self.rng.choice(PROBLEMS)),
+            self.factory.message(user_id, "✅ Завершить без медиа"),
+        ])
+
+    async def admin_take_complete(self) -> None:
+        if not self.new_request_ids:
+            return
+        request_id = self.new_request_ids.pop()
+        await self.feed("admin_take_complete", [
+            self.factory.callback(self.admin_id, f"take_{request_id}"),
+            self.factory.callback(self.admin_id, f"complete_{request_id}"),
+            self.factory.message(self.admin_id, "Переустановил драйвер, проблема решена"),
+        ])
+
+    async def my_requests(self) -> None:
+        user_id = self.rng.randrange(1, self.n_users + 1)
+        await self.feed("my_requests", [self.factory.message(user_id, "📂 Мои заявки")])
+
+    async def statistics(self) -> None:
+        user_id = self.rng.randrange(1, self.n_users + 1)
+        await self.feed("statistics", [self.factory.message(user_id, "📊 Статистика")])
+
+    async def admin_lists(self) -> None:
+        button = self.rng.choice(["📋 Все заявки", "📋 Новые заявки", "🔄 В работе", "✅ Выполненные"])
+        await self.feed("admin_lists", [self.factory.message(self.admin_id, button)])
+
+    async def sla_report(self) -> None:
+        await self.feed("sla_report", [self.factory.message(self.admin_id, "📈 SLA-аналитика")])
+
+    async def run(self, iterations: int) -> List[Dict[str, Any]]:
+        scenarios: List[Callable] = [self.create_ticket, self.admin_take_complete, self.my_requests, self.statistics,
+                                     self.admin_lists, self.sla_report]
+        for _ in range(iterations):
+            for scenario in scenarios:
+                await scenario()
+
+        results = [stats.summary() for stats in self.stats.values()]
+        overall = ScenarioStats("ВСЕГО")
+        for stats in self.stats.values():
+            overall.latencies.extend(stats.latencies)
+            overall.wall_time += stats.wall_time
+            overall.db_time += stats.db_time
+            overall.db_queries += stats.db_queries
+            overall.api_calls += stats.api_calls
+        results.append(overall.summary())
+        return results
+
+async def run_size(bot, db_path: str, n_requests: int, iterations: int, seed: int) -> List[Dict[str, Any]]:
+    """🏁 Один прогон бенчмарка на базе заданного размера"""
+    bot.db = bot.EnhancedDatabase(db_path)
+    # Фоновые шаги миграций (старые заполненные базы) выполняем до замеров, без пауз
+    bot.db.migrator.run_backfills(bot.Config.MIGRATION_BATCH_SIZE)
+    with sqlite3.connect(db_path) as conn:
+        n_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        new_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM requests WHERE status = 'new' ORDER BY id DESC LIMIT ?", (iterations,)
+        )]
+
+    request = RecordingRequest(record=False)
+    application = bot.build_application(BENCH_TOKEN, request=request, get_updates_request=RecordingRequest())
+    await application.initialize()
+    try:
+        bot.rate_limiter.user_requests.clear()
+        benchmark = PipelineBenchmark(bot, application, request, random.Random(seed), max(n_users, 1), new_ids)
+        return await benchmark.run(iterations)
+    finally:
+        await application.shutdown()
+
+def print_results(title: str, results: List[Dict[str, Any]]) -> None:
+    print(f"\n=== {title} ===")
+    header = f"{'Сценарий':<22}{'обновл.':>9}{'обн/с':>10}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}" \
+             f"{'БД мс':>9}{'SQL':>7}{'API':>6}"
+    print(header)
+    print('-' * len(header))
+    for row in results:
+        print(
+            f"{row['scenario']:<22}{row['updates']:>9}{row['updates_per_second']:>10.0f}"
+            f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+            f"{row['db_ms_per_update']:>9.2f}{row['db_queries_per_update']:>7.1f}{row['api_calls_per_update']:>6.1f}"
+        )
+
+# ==================== ХОЛОДНЫЙ СТАРТ ====================
+
+async def _timed_exit(command: List[str], cwd: str, env: Dict[str, str]) -> float:
+    """⏱️ Секунд от запуска процесса до его завершения"""
+    started = perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    if await process.wait() != 0:
+        raise RuntimeError(f"Команда завершилась с ошибкой: {' '.join(command)}")
+    return perf_counter() - started
+
+async def _time_to_poll(api, command: List[str], cwd: str, env: Dict[str, str], timeout: float = 60.0) -> float:
+    """⏱️ Секунд от запуска бота до его первого getUpdates"""
+    polls = api.calls['getUpdates']
+    started = perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        while api.calls['getUpdates'] == polls:
+            if process.returncode is not None:
+                raise RuntimeError("Бот завершился, не начав опрос")
+            if perf_counter() - started > timeout:
+                raise TimeoutError(f"Бот не начал опрос за {timeout:.0f} с")
+            await asyncio.sleep(0.002)
+        return perf_counter() - started
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+        await process.wait()
+
+async def measure_startup(workdir: str, runs: int) -> Dict[str, Any]:
+    """🚀 Холодный старт: голый интерпретатор, импорт main, запуск бота до первого getUpdates
+
+    Бот запускается как в проде (python bot/main.py) против локального
+    fake_bot_api. Первый запуск создает схему базы и в замер не входит,
+    остальные - перезапуски на существующей базе.
+    """
+    from fake_bot_api import FakeBotAPI
+
+    os.makedirs(workdir, exist_ok=True)
+    bot_dir = os.path.dirname(os.path.abspath(__file__))
+    api = FakeBotAPI()
+    server = await api.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    env = dict(
+        os.environ, PYTHONPATH=bot_dir, BOT_TOKEN=BENCH_TOKEN, WORKERS='0', METRICS_PORT='0',
+        BOT_API_BASE_URL=f"http://127.0.0.1:{port}/bot", BOT_API_BASE_FILE_URL=f"http://127.0.0.1:{port}/file/bot",
+    )
+    bot_command = [sys.executable, os.path.join(bot_dir, 'main.py')]
+    timings: Dict[str, List[float]] = {'interpreter': [], 'import': [], 'ready_to_poll': []}
+    try:
+        await _time_to_poll(api, bot_command, workdir, env)
+        for _ in range(runs):
+            timings['interpreter'].append(await _timed_exit([sys.executable, '-c', 'pass'], workdir, env))
+            timings['import'].append(await _timed_exit([sys.executable, '-c', 'import main'], workdir, env))
+            timings['ready_to_poll'].append(await _time_to_poll(api, bot_command, workdir, env))
+    finally:
+        server.close()
+    return {
+        name: {'p50_ms': percentile(sorted(values), 50) * 1000, 'max_ms': max(values) * 1000}
+        for name, values in timings.items()
+    }
+
+def print_startup(results: Dict[str, Any], runs: int) -> None:
+    print(f"\n=== Холодный старт ({runs} запусков) ===")
+    titles = {'interpreter': "python -c pass", 'import': "import main", 'ready_to_poll': "до первого getUpdates"}
+    for name, row in results.items():
+        print(f"{titles[name]:<24}{row['p50_ms']:>9.0f} мс (p50){row['max_ms']:>9.0f} мс (max)")
+
+def load_bot(workdir: str):
+    """📥 Импортирует и инициализирует модуль бота (init_bot создает файлы в текущей директории)"""
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as bot
+    bot.init_bot()
+    logging.getLogger().setLevel(logging.ERROR)
+    # Замеряем обработчики, а не лимиты Telegram: планировщик отправки отключаем
+    bot.Config.SEND_RATE_PER_SECOND = 0
+    return bot
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк обработчиков бота")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help="размеры заполненной базы (число заявок), например 10000 100000 1000000; "
+                             "по умолчанию 10000, с --startup - без замера обработчиков")
+    parser.add_argument('--iterations', type=int, default=200, help="повторов каждого сценария")
+    parser.add_argument('--db-dir', default=os.path.join(tempfile.gettempdir(), 'itsbs_bench'),
+                        help="каталог для заполненных баз (кэшируются между запусками)")
+    parser.add_argument('--reseed', action='store_true', help="пересоздать заполненные базы")
+    parser.add_argument('--seed', type=int, default=1, help="seed генератора сценариев")
+    parser.add_argument('--json', help="сохранить результаты в JSON для сравнения сборок")
+    parser.add_argument('--startup', type=int, default=0, metavar='N',
+                        help="замерить холодный старт бота N раз (импорт и время до первого getUpdates)")
+    args = parser.parse_args()
+
+    db_dir = os.path.abspath(args.db_dir)
+    json_path = os.path.abspath(args.json) if args.json else None
+    sizes = args.sizes if args.sizes is not None else ([] if args.startup else [10_000])
+    report = {"started_at": datetime.now().isoformat(), "iterations": args.iterations, "sizes": {}}
+
+    if args.startup:
+        report["startup"] = asyncio.run(measure_startup(os.path.join(db_dir, 'startup'), args.startup))
+        print_startup(report["startup"], args.startup)
+
+    bot = load_bot(db_dir) if sizes else None
+    for n_requests in sizes:
+        db_path = prepare_database(bot, db_dir, n_requests, args.reseed)
+        results = asyncio.run(run_size(bot, db_path, n_requests, args.iterations, args.seed))
+        print_results(f"База: {n_requests:,} заявок".replace(',', ' '), results)
+        report["sizes"][str(n_requests)] = results
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Результаты сохранены в {json_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+📉 Графики по заявкам: рендер в пуле процессов с кэшем PNG
+
+Рендер matplotlib (Agg) занимает сотни миллисекунд CPU, поэтому он идет
+в отдельном процессе: воркер сам читает базу (только чтение), считает ряды
+на NumPy и возвращает байты PNG. Готовые картинки кэшируются по ключу
+(тип графика, диапазон дат, версия данных заявок), повторный запрос того
+же графика отдается мгновенно, одновременные одинаковые запросы ждут один
+рендер.
+"""
+import asyncio
+import multiprocessing
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from analytics import SECONDS_PER_DAY, SLA_ROWS_SQL, backlog_series, to_columns
+
+CHARTS = {
+    'volume': "📊 Поток заявок",
+    'backlog': "📉 Открытые заявки",
+    'sla': "⏱️ Время реакции и выполнения",
+}
+RANGES = (7, 30, 90)
+
+# ==================== ВОРКЕР (отдельный процесс) ====================
+
+def _init_worker():
+    """🎨 Настройка matplotlib в процессе-воркере"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _load_columns(db_path: str) -> Dict[str, np.ndarray]:
+    uri = Path(db_path).absolute().as_uri() + '?mode=ro'
+    with sqlite3.connect(uri, uri=True) as conn:
+        rows = conn.execute(SLA_ROWS_SQL).fetchall()
+    return to_columns(rows)
+
+def render_chart(db_path: str, chart: str, start: str, end: str) -> bytes:
+    """🖼️ Рисует график за дни [start, end] и возвращает PNG"""
+    import matplotlib.pyplot as plt
+
+    columns = _load_columns(db_path)
+    first = datetime.fromisoformat(start).timestamp()
+    days = (date.fromisoformat(end) - date.fromisoformat(start)).days + 1
+    day_starts = first + np.arange(days) * SECONDS_PER_DAY
+    labels = [(date.fromisoformat(start) + timedelta(days=i)).strftime('%d.%m') for i in range(days)]
+    created, assigned, completed = columns['created'], columns['assigned'], columns['completed']
+
+    fig, ax = plt.subplots(figsize=(10, 5), dpi=100)
+    try:
+        if chart == 'volume':
+            bins = np.append(day_starts, day_starts[-1] + SECONDS_PER_DAY)
+            new_counts, _ = np.histogram(created, bins=bins)
+            done_counts, _ = np.histogram(completed[~np.isnan(completed)], bins=bins)
+            x = np.arange(days)
+            ax.bar(x - 0.2, new_counts, width=0.4, label="Создано", color='#4C72B0')
+            ax.bar(x + 0.2, done_counts, width=0.4, label="Выполнено", color='#55A868')
+            ax.set_ylabel("Заявок за день")
+        elif chart == 'backlog':
+            backlog = backlog_series(created, completed, day_starts + SECONDS_PER_DAY)
+            ax.plot(np.arange(days), backlog, marker='o' if days <= 31 else None, color='#C44E52')
+            ax.fill_between(np.arange(days), backlog, alpha=0.2, color='#C44E52')
+            ax.set_ylabel("Открыто на конец дня")
+        elif chart == 'sla':
+            # Медианы и p90 по дням создания, часы
+            day_index = np.floor((created - first) / SECONDS_PER_DAY).astype(np.int64)
+            in_range = (day_index >= 0) & (day_index < days)
+            for values, title, color in ((assigned - created, "реакция", '#4C72B0'),
+                                         (completed - created, "выполнение", '#55A868')):
+                series = np.full((days, 2), np.nan)
+                valid = in_range & ~np.isnan(values)
+                order = np.argsort(day_index[valid], kind='stable')
+                grouped_days = day_index[valid][order]
+                grouped_values = values[valid][order] / 3600.0
+                bounds = np.searchsorted(grouped_days, np.arange(days + 1))
+                for day in range(days):
+                    chunk = grouped_values[bounds[day]:bounds[day + 1]]
+                    if chunk.size:
+                        series[day] = np.percentile(chunk, (50, 90))
+                ax.plot(np.arange(days), series[:, 0], color=color, label=f"{title}, медиана")
+                ax.plot(np.arange(days), series[:, 1], color=color, linestyle='--', label=f"{title}, p90")
+            ax.set_ylabel("Часы")
+        else:
+            raise ValueError(f"Неизвестный график: {chart}")
+
+        step = max(1, days // 15)
+        ax.set_xticks(np.arange(0, days, step))
+        ax.set_xticklabels(labels[::step], rotation=45, ha='right')
+        # Эмодзи нет в шрифте matplotlib по умолчанию - в заголовке только текст
+        ax.set_title(f"{CHARTS[chart].split(' ', 1)[1]}: {labels[0]} - {labels[-1]}")
+        ax.grid(axis='y', alpha=0.3)
+        if chart != 'backlog':
+            ax.legend()
+        fig.tight_layout()
+
+        buffer = BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+# ==================== СЕРВИС (процесс бота) ====================
+
+class ChartService:
+    """📉 Выдает PNG-графики: кэш, объединение одинаковых запросов, пул процессов"""
+
+    def __init__(self, db, max_workers: int = 1, cache_size: int = 32):
+        self.db = db
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: не копируем в воркер потоки и event loop процесса бота
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return self._pool
+
+    async def render(self, chart: str, days: int) -> Tuple[bytes, bool]:
+        """🖼️ (PNG графика за последние days дней, взят ли из кэша)"""
+        if chart not in CHARTS:
+            raise ValueError(f"Неизвестный график: {chart}")
+        version = await asyncio.to_thread(self.db.get_data_version, 'requests')
+        end = date.today()
+        start = end - timedelta(days=days - 1)
+        key = (chart, start, end, version)
+
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key], True
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key]), True
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._executor(), render_chart, self.db.db_path, chart, start.isoformat(), end.isoformat()
+        )
+        self._inflight[key] = future
+        try:
+            png = await future
+        finally:
+            self._inflight.pop(key, None)
+
+        self._cache[key] = png
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return png, False
+
+    def shutdown(self):
+        """🛑 Останавливает пул процессов"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
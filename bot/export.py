@@ -0,0 +1,168 @@
+"""
+📤 Выгрузка заявок в CSV и XLSX с постоянным расходом памяти
+
+Строки читаются из базы пачками через fetchmany и сразу пишутся в файл:
+CSV - построчно, XLSX - потоком прямо в zip-архив (лист с inline-строками,
+без таблицы общих строк, которую пришлось бы держать в памяти целиком).
+Функции блокирующие, бот вызывает их через asyncio.to_thread.
+"""
+import csv
+import re
+import sqlite3
+import zipfile
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from spreadsheet import column_letter
+
+COLUMNS = (
+    ('r.id', "№"), ('r.created_at', "Создана"), ('r.user_id', "ID пользователя"), ('r.username', "Пользователь"),
+    ('r.phone', "Телефон"), ('r.department', "Отдел"), ('r.problem', "Проблема"), ('r.urgency', "Срочность"),
+    ('r.status', "Статус"), ('r.assigned_admin', "Исполнитель"), ('r.assigned_at', "Взята в работу"),
+    ('r.completed_at', "Выполнена"), ('r.admin_comment', "Комментарий"), ('r.user_rating', "Оценка"),
+    ('r.user_feedback', "Отзыв"), ('r.incident_id', "Инцидент"), ('COALESCE(m.media_count, 0)', "Вложений"),
+)
+DATE_COLUMNS = {1, 10, 11}
+STATUS_TITLES = {'new': "Новая", 'in_progress': "В работе", 'completed': "Выполнена"}
+STATUS_COLUMN = 8
+# Управляющие символы недопустимы в XML листа
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# Начало ячейки, с которого Excel читает формулу (в XLSX строки inline - не формулы)
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def iter_rows(db_path: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              status: Optional[str] = None, chunk_size: int = 500) -> Iterator[Tuple]:
+    """📜 Заявки с числом вложений, пачками по chunk_size строк"""
+    conditions, params = [], []
+    if since:
+        conditions.append('r.created_ts >= ?')
+        params.append(int(since.timestamp()))
+    if until:
+        conditions.append('r.created_ts < ?')
+        params.append(int(until.timestamp()))
+    if status:
+        conditions.append('r.status = ?')
+        params.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        # Сначала архив (старые выполненные заявки), затем рабочая таблица
+        for suffix in ('_archive', ''):
+            cursor = conn.execute(f'''
+                SELECT {', '.join(expression for expression, _ in COLUMNS)}
+                FROM requests{suffix} r
+                LEFT JOIN (
+                    SELECT request_id, COUNT(*) AS media_count FROM request_media{suffix} GROUP BY request_id
+                ) m ON m.request_id = r.id
+                {where}
+                ORDER BY r.id
+            ''', params)
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield from chunk
+    finally:
+        conn.close()
+
+def present(row: Sequence[Any]) -> List[Any]:
+    """🧹 Значения для таблицы: даты без микросекунд, статус по-русски, None - пусто"""
+    values = ['' if value is None else value for value in row]
+    for index in DATE_COLUMNS:
+        if values[index]:
+            values[index] = str(values[index])[:19].replace('T', ' ')
+    values[STATUS_COLUMN] = STATUS_TITLES.get(values[STATUS_COLUMN], values[STATUS_COLUMN])
+    return values
+
+def csv_safe(value: Any) -> Any:
+    """🛡️ Текст, который Excel принял бы за формулу (=, +, -, @, табуляция, CR), экранируется апострофом"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def write_csv(rows: Iterator[Tuple], path: str) -> int:
+    """📄 CSV с BOM и разделителем «;» (открывается в Excel без мастера импорта)"""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow([title for _, title in COLUMNS])
+        for row in rows:
+            # Описания и отзывы пишут пользователи: формула в них выполнилась бы у администратора
+            writer.writerow([csv_safe(value) for value in present(row)])
+            count += 1
+    return count
+
+def _xlsx_row(number: int, values: Sequence[Any]) -> str:
+    cells = []
+    for index, value in enumerate(values, 1):
+        ref = f"{column_letter(index)}{number}"
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        elif value != '':
+            text = escape(_XML_ILLEGAL_RE.sub('', str(value)))
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{number}">{"".join(cells)}</row>'
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Заявки" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+def write_xlsx(rows: Iterator[Tuple], path: str) -> int:
+    """📊 XLSX, лист пишется в архив потоком по мере чтения строк"""
+    count = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_PARTS.items():
+            archive.writestr(name, content)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" state="frozen"/>'
+                b'</sheetView></sheetViews><sheetData>'
+            )
+            sheet.write(_xlsx_row(1, [title for _, title in COLUMNS]).encode('utf-8'))
+            for row in rows:
+                count += 1
+                sheet.write(_xlsx_row(count + 1, present(row)).encode('utf-8'))
+            sheet.write(b'</sheetData></worksheet>')
+    return count
+
+WRITERS = {'csv': write_csv, 'xlsx': write_xlsx}
+
+def export_requests(db_path: str, path: str, fmt: str = 'csv', since: Optional[datetime] = None,
+                    until: Optional[datetime] = None, status: Optional[str] = None) -> int:
+    """📤 Выгружает заявки в файл path, возвращает число строк"""
+    return WRITERS[fmt](iter_rows(db_path, since, until, status), path)
@@ -0,0 +1,389 @@
+"""
+🧪 Локальный заменитель Telegram Bot API для сквозных нагрузочных тестов
+
+В отличие от заглушек внутри процесса, бот работает через настоящий
+HTTP-слой python-telegram-bot: long polling getUpdates, сериализацию
+запросов и обработку ошибок (включая 429 RetryAfter).
+
+Поддерживаются getMe, getUpdates, sendMessage, editMessageText,
+sendPhoto/sendVideo/sendDocument/sendVoice, sendMediaGroup,
+answerCallbackQuery и deleteWebhook. Остальные методы отвечают `true`.
+
+Трафик генерируется виртуальными пользователями: каждый проходит сценарий
+создания заявки, затем листает "Мои заявки" и статистику, дожидаясь ответа
+бота перед следующим шагом. Виртуальный администратор берет новые заявки
+в работу. Вместо сценариев можно подать готовые обновления из JSONL.
+
+Запуск:
+    python bot/fake_bot_api.py --port 8081 --users 50 --duration 60 --latency-ms 30 --error-rate 0.02
+    BOT_TOKEN=123:fake BOT_API_BASE_URL=http://127.0.0.1:8081/bot python bot/main.py
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import urllib.parse
+from collections import Counter, deque
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import HTTP
+from time import monotonic
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from benchmark import PROBLEMS, UpdateFactory, percentile
+
+SEND_METHODS = {
+    'sendMessage', 'editMessageText', 'sendPhoto', 'sendVideo', 'sendDocument',
+    'sendVoice', 'sendMediaGroup', 'editMessageReplyMarkup', 'copyMessage', 'forwardMessage',
+}
+
+def parse_params(content_type: str, body: bytes) -> Dict[str, Any]:
+    """📥 Разбирает параметры запроса Bot API (form, multipart или JSON)"""
+    params: Dict[str, Any] = {}
+    if content_type.startswith('application/json'):
+        params = json.loads(body or b'{}')
+    elif content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                params[name] = {'upload': part.get_filename(), 'size': len(payload)}
+            else:
+                params[name] = payload.decode('utf-8')
+    elif body:
+        params = dict(urllib.parse.parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+
+    for key, value in params.items():
+        if isinstance(value, str) and value[:1] in ('{', '['):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+class FakeBotAPI:
+    """🤖 Заменитель сервера Bot API"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 retry_after: int = 1, global_limit: int = 0, chat_limit: int = 0, seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.rng = random.Random(seed)
+
+        self.factory = UpdateFactory()
+        self.updates: Deque[Dict[str, Any]] = deque()
+        self._updates_changed = asyncio.Event()
+        self._message_id = 0
+        self._sent_global: Deque[float] = deque()
+        self._sent_per_chat: Dict[int, Deque[float]] = {}
+
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.listeners: List[Callable[[str, Dict[str, Any], Dict[str, Any]], None]] = []
+
+    # ---------- очередь входящих обновлений ----------
+
+    def push_update(self, update: Dict[str, Any]) -> None:
+        """📨 Ставит обновление в очередь для getUpdates"""
+        self.updates.append(update)
+        self._updates_changed.set()
+
+    async def get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout > 0:
+            self._updates_changed.clear()
+            try:
+                await asyncio.wait_for(self._updates_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)[:limit]
+
+    # ---------- ограничение частоты ----------
+
+    @staticmethod
+    def _over_limit(window: Deque[float], limit: int, now: float) -> bool:
+        while window and now - window[0] >= 1.0:
+            window.popleft()
+        if len(window) >= limit:
+            return True
+        window.append(now)
+        return False
+
+    def _should_throttle(self, method: str, params: Dict[str, Any]) -> Optional[str]:
+        if method not in SEND_METHODS:
+            return None
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return 'injected'
+        now = monotonic()
+        if self.global_limit and self._over_limit(self._sent_global, self.global_limit, now):
+            return 'global'
+        chat_id = params.get('chat_id')
+        if self.chat_limit and chat_id is not None:
+            window = self._sent_per_chat.setdefault(int(chat_id), deque())
+            if self._over_limit(window, self.chat_limit, now):
+                return 'chat'
+        return None
+
+    # ---------- методы Bot API ----------
+
+    def _message(self, params: Dict[str, Any], **extra) -> Dict[str, Any]:
+        self._message_id += 1
+        message = {
+            "message_id": int(params.get('message_id') or self._message_id),
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": int(params.get('chat_id') or 0), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"},
+        }
+        if 'text' in params:
+            message['text'] = str(params['text'])
+        if 'caption' in params:
+            message['caption'] = str(params['caption'])
+        if isinstance(params.get('reply_markup'), dict) and 'inline_keyboard' in params['reply_markup']:
+            message['reply_markup'] = params['reply_markup']
+        message.update(extra)
+        return message
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """📞 Выполняет метод Bot API и возвращает (HTTP-код, JSON-ответ)"""
+        self.calls[method] += 1
+        if method != 'getUpdates' and (self.latency or self.jitter):
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+
+        reason = self._should_throttle(method, params)
+        if reason is not None:
+            self.throttled[reason] += 1
+            return 429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        if method == 'getMe':
+            result: Any = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+                           "can_join_groups": True, "can_read_all_group_messages": False,
+                           "supports_inline_queries": True}
+        elif method == 'getUpdates':
+            result = await self.get_updates(params)
+        elif method == 'sendMediaGroup':
+            result = [self._message(params) for _ in params.get('media') or [None]]
+        elif method == 'sendPhoto':
+            result = self._message(params, photo=[{"file_id": "fake_photo", "file_unique_id": "fp",
+                                                   "width": 1, "height": 1}])
+        elif method in SEND_METHODS:
+            result = self._message(params)
+        else:
+            result = True
+
+        if method in SEND_METHODS:
+            for listener in self.listeners:
+                listener(method, params, result if isinstance(result, dict) else {})
+        return 200, {"ok": True, "result": result}
+
+    # ---------- HTTP ----------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+                path = urllib.parse.urlsplit(target).path
+                method = path.rsplit('/', 1)[-1]
+                if path.startswith('/bot'):
+                    params = parse_params(headers.get('content-type', ''), body)
+                    params.update(urllib.parse.parse_qsl(urllib.parse.urlsplit(target).query))
+                    status, payload = await self.call(method, params)
+                else:
+                    status, payload = 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                reason = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests'}.get(status, 'Error')
+                writer.write(
+                    f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+# ==================== ВИРТУАЛЬНЫЕ ПОЛЬЗОВАТЕЛИ ====================
+
+class TrafficGenerator:
+    """👥 Виртуальные пользователи и администратор, реагирующие на ответы бота"""
+
+    def __init__(self, api: FakeBotAPI, users: int, admin_id: int, think_ms: float,
+                 reply_timeout: float, first_user_id: int = 3_000_000_000, seed: int = 0):
+        self.api = api
+        self.users = users
+        self.admin_id = admin_id
+        self.think = think_ms / 1000
+        self.reply_timeout = reply_timeout
+        self.first_user_id = first_user_id
+        self.rng = random.Random(seed)
+        self.waiting: Dict[int, Tuple[float, asyncio.Event]] = {}
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.timeouts = 0
+        self.admin_takes = 0
+        api.listeners.append(self.on_bot_message)
+
+    def on_bot_message(self, method: str, params: Dict[str, Any], message: Dict[str, Any]) -> None:
+        chat_id = int(params.get('chat_id') or 0)
+        pending = self.waiting.pop(chat_id, None)
+        if pending is not None:
+            sent_at, event = pending
+            self.latencies.append(monotonic() - sent_at)
+            event.set()
+
+        if chat_id == self.admin_id and method == 'sendMessage':
+            for row in (params.get('reply_markup') or {}).get('inline_keyboard', []):
+                for button in row:
+                    if str(button.get('callback_data', '')).startswith('take_'):
+                        asyncio.get_running_loop().call_later(
+                            self.think, self.api.push_update,
+                            self.api.factory.callback(self.admin_id, button['callback_data'],
+                                                      str(params.get('text', '')))
+                        )
+                        self.admin_takes += 1
+
+    async def step(self, user_id: int, text: str) -> None:
+        event = asyncio.Event()
+        self.waiting[user_id] = (monotonic(), event)
+        self.api.push_update(self.api.factory.message(user_id, text))
+        self.sent += 1
+        try:
+            await asyncio.wait_for(event.wait(), self.reply_timeout)
+        except asyncio.TimeoutError:
+            self.waiting.pop(user_id, None)
+            self.timeouts += 1
+        await asyncio.sleep(self.think * self.rng.uniform(0.5, 1.5))
+
+    async def user(self, user_id: int) -> None:
+        await self.step(user_id, "📝 Создать заявку")
+        await self.step(user_id, f"+7 999 {self.rng.randrange(1000000, 9999999)}")
+        await self.step(user_id, self.rng.choice(PROBLEMS))
+        await self.step(user_id, "✅ Завершить без медиа")
+        while True:
+            await self.step(user_id, self.rng.choice(["📂 Мои заявки", "📊 Статистика"]))
+
+    async def run(self, duration: float) -> None:
+        tasks = [asyncio.ensure_future(self.user(self.first_user_id + i)) for i in range(self.users)]
+        await asyncio.sleep(duration)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def replay_file(api: FakeBotAPI, path: str, rate: float) -> int:
+    """📼 Подает обновления из JSONL-файла (поле update либо сам объект Update)"""
+    count = 0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            update = record.get('update', record)
+            update['update_id'] = api.factory._next_id()
+            api.push_update(update)
+            count += 1
+            if rate:
+                await asyncio.sleep(1 / rate)
+    return count
+
+def print_report(api: FakeBotAPI, traffic: Optional[TrafficGenerator], elapsed: float) -> None:
+    print(f"\n=== Итоги за {elapsed:.1f} с ===")
+    if traffic is not None:
+        values = sorted(traffic.latencies)
+        print(f"Сообщений пользователей: {traffic.sent}, ответов: {len(values)}, без ответа: {traffic.timeouts}")
+        print(f"Пропускная способность: {len(values) / elapsed:.1f} ответов/с")
+        print(f"Время ответа: p50 {percentile(values, 50) * 1000:.1f} мс, "
+              f"p95 {percentile(values, 95) * 1000:.1f} мс, p99 {percentile(values, 99) * 1000:.1f} мс")
+        print(f"Администратор взял в работу: {traffic.admin_takes}")
+    print("Вызовы API: " + ", ".join(f"{method}={count}" for method, count in api.calls.most_common()))
+    throttled = sum(api.throttled.values())
+    print(f"Выдано 429: {throttled}" + (f" ({dict(api.throttled)})" if throttled else ""))
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeBotAPI(args.latency_ms, args.jitter_ms, args.error_rate, args.retry_after,
+                     args.global_limit, args.chat_limit, args.seed)
+    server = await api.start(args.host, args.port)
+    print(f"🧪 Fake Bot API: BOT_API_BASE_URL=http://{args.host}:{args.port}/bot")
+
+    traffic = None
+    if args.wait_for_bot:
+        print("⏳ Ожидание подключения бота...")
+        while api.calls['getUpdates'] == 0:
+            await asyncio.sleep(0.1)
+
+    started = monotonic()
+    try:
+        if args.script:
+            count = await replay_file(api, args.script, args.script_rate)
+            print(f"📼 Подано {count} обновлений из {args.script}")
+            await asyncio.sleep(args.duration)
+        elif args.users:
+            traffic = TrafficGenerator(api, args.users, args.admin_id, args.think_ms, args.reply_timeout, seed=args.seed)
+            await traffic.run(args.duration)
+        else:
+            await asyncio.sleep(args.duration if args.duration else math.inf)
+    finally:
+        print_report(api, traffic, monotonic() - started)
+        server.close()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальный заменитель Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="задержка ответа на каждый вызов")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="разброс задержки")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument('--global-limit', type=int, default=30, help="лимит отправок в секунду (0 - без лимита)")
+    parser.add_argument('--chat-limit', type=int, default=0, help="лимит отправок в секунду в один чат")
+    parser.add_argument('--users', type=int, default=20, help="число виртуальных пользователей")
+    parser.add_argument('--admin-id', type=int, default=5024165375, help="ID администратора бота")
+    parser.add_argument('--think-ms', type=float, default=500.0, help="пауза пользователя между шагами")
+    parser.add_argument('--reply-timeout', type=float, default=10.0, help="сколько ждать ответа бота")
+    parser.add_argument('--duration', type=float, default=60.0, help="длительность прогона, с")
+    parser.add_argument('--script', help="JSONL-файл с обновлениями вместо виртуальных пользователей")
+    parser.add_argument('--script-rate', type=float, default=0.0, help="обновлений в секунду из файла (0 - сразу)")
+    parser.add_argument('--wait-for-bot', action='store_true', help="начать трафик после первого getUpdates")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+🧪 Локальный заменитель Google Sheets API для проверки синхронизации
+
+Поддерживаются POST /v4/spreadsheets/{id}/values:batchUpdate (значения
+пишутся в таблицу в памяти) и GET /v4/spreadsheets/{id}/values/{лист}
+(содержимое листа). Квота запросов в минуту и доля случайных ошибок
+429/503 позволяют проверить пачки и повторы с экспоненциальной паузой.
+
+Запуск:
+    python bot/fake_sheets_api.py --port 8090 --quota 60 --error-rate 0.1 --dump sheet.csv
+    GOOGLE_SHEETS_ID=fake GOOGLE_SHEETS_BASE_URL=http://127.0.0.1:8090 python bot/main.py
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import re
+import sys
+import urllib.parse
+from collections import Counter, deque
+from time import monotonic
+from typing import Any, Deque, Dict, List, Tuple
+
+RANGE_RE = re.compile(r"^(?:'((?:[^']|'')+)'|([^!]+))!([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+def column_number(letters: str) -> int:
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+def parse_range(a1: str) -> Tuple[str, int, int]:
+    """📐 'Лист'!B2:D5 -> (лист, первая строка, первая колонка) с нуля"""
+    match = RANGE_RE.match(a1)
+    if not match:
+        raise ValueError(f"Unable to parse range: {a1}")
+    sheet = match.group(1).replace("''", "'") if match.group(1) else match.group(2)
+    return sheet, int(match.group(4)) - 1, column_number(match.group(3)) - 1
+
+class FakeSheetsAPI:
+    """📑 Заменитель сервера Google Sheets"""
+
+    def __init__(self, quota_per_minute: int = 0, error_rate: float = 0.0, seed: int = 0):
+        self.quota = quota_per_minute
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.sheets: Dict[str, List[List[Any]]] = {}
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.cells_written = 0
+        self._window: Deque[float] = deque()
+
+    def _throttle(self) -> int:
+        now = monotonic()
+        while self._window and now - self._window[0] >= 60:
+            self._window.popleft()
+        if self.quota and len(self._window) >= self.quota:
+            return 429
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self.rng.choice((429, 503))
+        self._window.append(now)
+        return 200
+
+    def batch_update(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self.calls['batchUpdate'] += 1
+        status = self._throttle()
+        if status != 200:
+            self.errors[status] += 1
+            return status, {"error": {"code": status, "message": "Quota exceeded" if status == 429 else "Backend Error"}}
+
+        try:
+            updates = [(parse_range(item['range']), item.get('values', [])) for item in body.get('data', [])]
+        except ValueError as e:
+            self.errors[400] += 1
+            return 400, {"error": {"code": 400, "message": str(e)}}
+
+        for (sheet, first_row, first_column), values in updates:
+            grid = self.sheets.setdefault(sheet, [])
+            for offset, row in enumerate(values):
+                index = first_row + offset
+                while len(grid) <= index:
+                    grid.append([])
+                target = grid[index]
+                if len(target) < first_column + len(row):
+                    target.extend([''] * (first_column + len(row) - len(target)))
+                target[first_column:first_column + len(row)] = row
+                self.cells_written += len(row)
+        return 200, {"totalUpdatedRanges": len(updates)}
+
+    def get_values(self, sheet: str) -> Tuple[int, Dict[str, Any]]:
+        self.calls['get'] += 1
+        return 200, {"range": sheet, "values": self.sheets.get(sheet, [])}
+
+    # ---------- HTTP ----------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                verb, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+
+                path = urllib.parse.unquote(urllib.parse.urlsplit(target).path)
+                parts = path.strip('/').split('/')
+                if verb == 'POST' and len(parts) == 4 and parts[3] == 'values:batchUpdate':
+                    status, payload = self.batch_update(json.loads(body or b'{}'))
+                elif verb == 'GET' and len(parts) == 5 and parts[3] == 'values':
+                    status, payload = self.get_values(parts[4].split('!')[0].strip("'"))
+                else:
+                    status, payload = 404, {"error": {"code": 404, "message": "Not Found"}}
+
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                          429: 'Too Many Requests', 503: 'Service Unavailable'}.get(status, 'Error')
+                writer.write(
+                    f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+def print_report(api: FakeSheetsAPI) -> None:
+    print("\n📊 Итоги:")
+    print("Вызовы API: " + ", ".join(f"{method}={count}" for method, count in api.calls.most_common()))
+    print(f"Ошибки: {dict(api.errors) or 'нет'}")
+    print(f"Записано ячеек: {api.cells_written}")
+    for sheet, grid in api.sheets.items():
+        print(f"Лист «{sheet}»: {len(grid)} строк")
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeSheetsAPI(args.quota, args.error_rate, args.seed)
+    server = await api.start(args.host, args.port)
+    print(f"🧪 Fake Sheets API: GOOGLE_SHEETS_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        await asyncio.sleep(args.duration if args.duration else float('inf'))
+    finally:
+        server.close()
+        print_report(api)
+        if args.dump and api.sheets:
+            sheet = next(iter(api.sheets))
+            with open(args.dump, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(api.sheets[sheet])
+            print(f"💾 Лист «{sheet}» сохранен в {args.dump}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Локальный заменитель Google Sheets API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--quota', type=int, default=60, help="запросов в минуту до ответа 429 (0 - без лимита)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля запросов со случайной 429/503")
+    parser.add_argument('--duration', type=float, default=0.0, help="длительность работы, с (0 - до Ctrl+C)")
+    parser.add_argument('--dump', help="сохранить первый лист в CSV при остановке")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import logging
+import math
 import sqlite3
 import os
 import json
@@ -7,17 +8,29 @@ import time
 import asyncio
 import shutil
 import signal
+import ssl
+import tempfile
 import sys
+import threading
+import tracemalloc
+import contextvars
+import html
+import hashlib
+import hmac
+import logging.handlers
+from abc import ABC, abstractmethod
 from io import BytesIO
 from datetime import datetime, timedelta, time
-from typing import Dict, List, Optional, Tuple, Set, Any
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Set, Any
 from functools import lru_cache
 from enum import Enum
 from dataclasses import dataclass
-from collections import defaultdict
-import phonenumbers
-from phonenumbers import NumberParseException
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from time import perf_counter, time as unix_time
 
+import httpx
 from telegram import (
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
@@ -25,8 +38,13 @@ from telegram import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     InputFile,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
 )
-from telegram.constants import ParseMode
+from telegram.constants import ChatAction, MessageLimit, ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -35,13 +53,20 @@ from telegram.ext import (
     ConversationHandler,
     CallbackContext,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
+    BaseRateLimiter,
     JobQueue,
+    TypeHandler,
 )
 
-# Загружаем переменные окружения из .env файла
+from migrations import Backfill, BatchFunction, Migration, MigrationRunner
+from phones import normalize_phone, renormalized
+from media_store import MediaStore
 from dotenv import load_dotenv
-load_dotenv()
+
+if TYPE_CHECKING:
+    from sharding import LeaderLease
 
 # ==================== УЛУЧШЕННОЕ ЛОГИРОВАНИЕ ====================
 
@@ -81,9 +106,457 @@ def setup_logging():
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+# ==================== МЕТРИКИ ====================
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_REQUEST_TIMEOUT = 5.0   # Секунд на чтение запроса к /metrics и отправку ответа
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...], extra: str = "") -> str:
+    """🏷️ Форматирует метки в формате Prometheus"""
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric(ABC):
+    """📈 Базовый класс метрики с поддержкой меток"""
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *labelvalues):
+        """🏷️ Возвращает дочернюю метрику для набора меток"""
+        key = tuple(str(value) for value in labelvalues)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """🧩 Значение метрики для одного набора меток"""
+
+    def _default(self):
+        return self.labels()
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        # labels() добавляет дочерние метрики из рабочих потоков - обходим копию
+        with self._lock:
+            children = list(self._children.items())
+        for labelvalues, child in sorted(children):
+            lines.extend(child.render(self.name, self.labelnames, labelvalues))
+        return lines
+
+class _CounterValue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, labelvalues):
+        return [f"{name}{_format_labels(labelnames, labelvalues)} {self.value}"]
+
+class _GaugeValue(_CounterValue):
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def render(self, name, labelnames, labelvalues):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            labels = _format_labels(labelnames, labelvalues, f'le="{bound}"')
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, labelvalues, 'le="+Inf"')
+        lines.append(f"{name}_bucket{labels} {self.count}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, labelvalues)} {self.sum}")
+        lines.append(f"{name}_count{_format_labels(labelnames, labelvalues)} {self.count}")
+        return lines
+
+class Counter(_Metric):
+    """➕ Монотонно растущий счетчик"""
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+class Gauge(_Metric):
+    """🌡️ Текущее значение (можно задать функцией, вычисляемой при сборе)"""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def _new_child(self):
+        return _GaugeValue()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def collect(self) -> List[str]:
+        if self.func is not None:
+            try:
+                self.set(self.func())
+            except Exception as e:
+                logger.debug(f"Не удалось вычислить метрику {self.name}: {e}")
+        return super().collect()
+
+class Histogram(_Metric):
+    """⏱️ Гистограмма распределения значений (обычно длительностей)"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+class MetricsRegistry:
+    """📊 Реестр метрик бота в формате Prometheus"""
+
+    def __init__(self, prefix: str = "itsbs"):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), func=None) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", documentation, labelnames, func))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """📄 Выгрузка всех метрик в текстовом формате Prometheus"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+UPDATES_TOTAL = metrics.counter("updates_total", "Обработанные обновления Telegram", ("kind",))
+UPDATE_DURATION = metrics.histogram("update_duration_seconds", "Полное время обработки одного обновления")
+HANDLER_DURATION = metrics.histogram(
+    "handler_duration_seconds", "Время работы обработчиков", ("handler", "outcome")
+)
+DB_QUERY_DURATION = metrics.histogram(
+    "db_method_duration_seconds", "Время выполнения методов EnhancedDatabase", ("method",)
+)
+TELEGRAM_API_DURATION = metrics.histogram(
+    "telegram_api_duration_seconds", "Задержка запросов к Telegram Bot API", ("endpoint",)
+)
+TELEGRAM_API_FAILURES = metrics.counter(
+    "telegram_api_failures_total", "Неудачные запросы к Telegram Bot API", ("endpoint", "reason")
+)
+HANDLER_ERRORS = metrics.counter("handler_errors_total", "Необработанные ошибки обработчиков", ("error",))
+RATE_LIMIT_REJECTIONS = metrics.counter("rate_limit_rejections_total", "Отказы RateLimiter")
+PENDING_UPDATES = metrics.gauge("pending_updates", "Обновления в очереди на обработку")
+MEDIA_STORE_BYTES = metrics.gauge(
+    "media_store_bytes", "Объем локальных копий вложений", func=lambda: media_store.total_bytes if media_store else 0
+)
+
+def db_timed(method):
+    """⏱️ Декоратор: замеряет длительность метода базы данных"""
+    name = method.__name__
+    histogram = DB_QUERY_DURATION.labels(name)
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    wrapper.__wrapped__ = method
+    return wrapper
+
+def instrument_handler(handler):
+    """⏱️ Оборачивает callback обработчика (и вложенных обработчиков диалога) замером времени"""
+    if isinstance(handler, ConversationHandler):
+        nested = list(handler.entry_points) + list(handler.fallbacks)
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for nested_handler in nested:
+            instrument_handler(nested_handler)
+        return handler
+
+    callback = handler.callback
+    if getattr(callback, '__wrapped__', None) is not None:
+        return handler
+    name = getattr(callback, '__name__', type(handler).__name__)
+
+    async def timed_callback(update, context):
+        start = perf_counter()
+        outcome = 'ok'
+        try:
+            return await callback(update, context)
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            HANDLER_DURATION.labels(name, outcome).observe(perf_counter() - start)
+
+    timed_callback.__name__ = name
+    timed_callback.__wrapped__ = callback
+    handler.callback = timed_callback
+    return handler
+
+def _update_kind(update: object) -> str:
+    """🔎 Определяет тип обновления для меток метрик"""
+    for kind in ('message', 'edited_message', 'callback_query', 'inline_query', 'my_chat_member'):
+        if getattr(update, kind, None) is not None:
+            return kind
+    return 'other'
+
+class BotApplication(Application):
+    """🤖 Application с учетом обработанных обновлений"""
+
+    async def process_update(self, update: object) -> None:
+        if update_recorder is not None and isinstance(update, Update):
+            update_recorder.record(update)
+        start = perf_counter()
+        update_queries = defaultdict(int)
+        token = current_update_queries.set(update_queries)
+        try:
+            if shared_state is not None:
+                try:
+                    shared_state.sync()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка синхронизации с другими воркерами: {e}")
+            await super().process_update(update)
+        finally:
+            current_update_queries.reset(token)
+            kind = _update_kind(update)
+            UPDATE_DURATION.observe(perf_counter() - start)
+            UPDATES_TOTAL.labels(kind).inc()
+            query_stats.finish_update(kind, update_queries)
+
+@lru_cache(maxsize=None)
+def tls_context() -> ssl.SSLContext:
+    """🔐 TLS-контекст процесса: загрузка корневых сертификатов занимает ~30 мс на каждый клиент"""
+    return httpx.create_ssl_context()
+
+class SharedTLSRequest(HTTPXRequest):
+    """📡 HTTP-клиент Bot API с общим на процесс TLS-контекстом (быстрее старт)"""
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(verify=tls_context(), **self._client_kwargs)
+
+class InstrumentedRequest(SharedTLSRequest):
+    """📡 HTTP-клиент Bot API с замером задержек и ошибок"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        endpoint = url.rsplit('/', 1)[-1]
+        start = perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception as e:
+            TELEGRAM_API_FAILURES.labels(endpoint, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_API_DURATION.labels(endpoint).observe(perf_counter() - start)
+        if code >= 400:
+            TELEGRAM_API_FAILURES.labels(endpoint, str(code)).inc()
+        return code, payload
+
+async def _read_request_line(reader: asyncio.StreamReader) -> bytes:
+    """📥 Строка запроса; заголовки дочитываются и пропускаются"""
+    request_line = await reader.readline()
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            return request_line
+
+async def _handle_metrics_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """🌐 Отдает /metrics по HTTP"""
+    try:
+        # Молчащий клиент не должен держать соединение бесконечно
+        request_line = await asyncio.wait_for(_read_request_line(reader), METRICS_REQUEST_TIMEOUT)
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', metrics.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            status, body, content_type = '404 Not Found', b'Not Found\n', 'text/plain'
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await asyncio.wait_for(writer.drain(), METRICS_REQUEST_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"Ошибка обработки запроса метрик: {e}")
+    finally:
+        writer.close()
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """📊 Запускает HTTP-эндпоинт /metrics"""
+    server = await asyncio.start_server(_handle_metrics_connection, host, port)
+    logger.info(f"📊 Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+# ==================== ПРОФИЛИРОВАНИЕ ====================
+
+class SamplingProfiler:
+    """🔬 Семплирующий профилировщик CPU + трассировка выделений памяти.
+
+    Пока профилирование выключено, ничего не работает: поток семплирования
+    не запущен, tracemalloc не включен.
+    """
+
+    def __init__(self, interval: float = 0.005, top: int = 30):
+        self.interval = interval
+        self.top = top
+        self.running = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target_ident: Optional[int] = None
+        self._self_counts: Dict[Tuple[str, int, str], int] = defaultdict(int)
+        self._total_counts: Dict[Tuple[str, int, str], int] = defaultdict(int)
+        self._samples = 0
+        self._started_at = 0.0
+        self._started_tracemalloc = False
+
+    def start(self, target_ident: int):
+        """▶️ Начинает семплирование стека потока target_ident (потока event loop)"""
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        self.running = True
+        self._target_ident = target_ident
+        self._self_counts.clear()
+        self._total_counts.clear()
+        self._samples = 0
+        self._stop_event.clear()
+        self._started_tracemalloc = not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start(10)
+        self._started_at = perf_counter()
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._target_ident)
+            if frame is None:
+                continue
+            self._samples += 1
+            seen = set()
+            key = (frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name)
+            self._self_counts[key] += 1
+            while frame is not None:
+                key = (frame.f_code.co_filename, frame.f_code.co_firstlineno, frame.f_code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    self._total_counts[key] += 1
+                frame = frame.f_back
+
+    def stop(self) -> str:
+        """⏹️ Останавливает профилирование и возвращает текстовый отчет"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        duration = perf_counter() - self._started_at
+
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        self.running = False
+        return self._format_report(duration, snapshot)
+
+    def _format_report(self, duration: float, snapshot) -> str:
+        samples = max(self._samples, 1)
+        lines = [
+            f"Профиль {Config.COMPANY_NAME} бота от {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}",
+            f"Длительность: {duration:.1f} с, семплов: {self._samples}, интервал: {self.interval * 1000:.0f} мс",
+            "",
+            f"=== ТОП {self.top} ФУНКЦИЙ ПО СОБСТВЕННОМУ ВРЕМЕНИ ===",
+        ]
+        for (filename, lineno, name), count in sorted(
+            self._self_counts.items(), key=lambda item: item[1], reverse=True
+        )[:self.top]:
+            lines.append(f"{count / samples * 100:6.2f}%  {count:7d}  {name}  {filename}:{lineno}")
+
+        lines += ["", f"=== ТОП {self.top} ФУНКЦИЙ ПО ВКЛЮЧЕННОМУ ВРЕМЕНИ ==="]
+        for (filename, lineno, name), count in sorted(
+            self._total_counts.items(), key=lambda item: item[1], reverse=True
+        )[:self.top]:
+            lines.append(f"{count / samples * 100:6.2f}%  {count:7d}  {name}  {filename}:{lineno}")
+
+        lines += ["", f"=== ТОП {self.top} МЕСТ ВЫДЕЛЕНИЯ ПАМЯТИ ==="]
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ))
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                frame = stat.traceback[0]
+                lines.append(f"{stat.size / 1024:10.1f} КБ  {stat.count:7d} блоков  {frame.filename}:{frame.lineno}")
+        else:
+            lines.append("tracemalloc недоступен")
+
+        return "\n".join(lines) + "\n"
+
+profiler = SamplingProfiler()
+
 # ==================== ОГРАНИЧИТЕЛЬ ЗАПРОСОВ ====================
 
 class RateLimiter:
@@ -102,6 +575,7 @@ class RateLimiter:
                           if now - req_time < timedelta(seconds=period)]
         
         if len(user_requests) >= limit:
+            RATE_LIMIT_REJECTIONS.inc()
             return False
         
         user_requests.append(now)
@@ -124,12 +598,153 @@ class RateLimiter:
 # Инициализация ограничителя
 rate_limiter = RateLimiter()
 
+# ==================== ПРИОРИТЕТНАЯ ОТПРАВКА ====================
+
+class SendLane(Enum):
+    """🚦 Полосы исходящих запросов к Bot API (меньше значение - выше приоритет)"""
+    URGENT = 0        # Уведомления о срочных заявках
+    INTERACTIVE = 1   # Ответы на действия пользователей и администраторов
+    BACKGROUND = 2    # Рассылки, сводки, счетчики инцидентов
+
+# Полоса запросов текущей задачи (явный rate_limit_args важнее)
+current_send_lane: contextvars.ContextVar = contextvars.ContextVar('current_send_lane', default=SendLane.INTERACTIVE)
+
+SEND_QUEUE_WAIT = metrics.histogram(
+    "send_queue_wait_seconds", "Ожидание исходящего запроса в очереди планировщика", ("lane",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+SEND_RETRIES = metrics.counter("send_retries_total", "Повторы исходящих запросов после 429", ("lane",))
+
+@contextmanager
+def send_lane(lane: SendLane):
+    """🚦 Отправлять запросы внутри блока через указанную полосу"""
+    token = current_send_lane.set(lane)
+    try:
+        yield
+    finally:
+        current_send_lane.reset(token)
+
+class PrioritySendScheduler(BaseRateLimiter):
+    """🚦 Планировщик исходящих запросов: общий бюджет и полосы приоритета.
+    
+    Каждый запрос (кроме getUpdates) берет жетон из одного ведра на rate
+    запросов в секунду. Освободившийся жетон получает самая приоритетная
+    непустая полоса, но каждый fair_every-й - самая давно ждущая из младших,
+    поэтому фоновые рассылки получают не меньше 1/fair_every пропускной
+    способности и не голодают. После 429 ведро замирает на retry_after,
+    и запрос повторяется.
+    """
+    
+    def __init__(self, rate: float, burst: int = 5, fair_every: int = 5, max_retries: int = 2):
+        self.rate = rate
+        self.burst = burst
+        self.fair_every = fair_every
+        self.max_retries = max_retries
+        self._tokens = float(burst)
+        self._updated = 0.0
+        self._paused_until = 0.0
+        self._grants = 0
+        self._queues: Dict[SendLane, deque] = {lane: deque() for lane in SendLane}
+        self._dispatcher: Optional[asyncio.Task] = None
+    
+    async def initialize(self) -> None:
+        self._updated = asyncio.get_running_loop().time()
+    
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+        for queue in self._queues.values():
+            for _, future in queue:
+                future.cancel()
+            queue.clear()
+    
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def _next_queue(self) -> deque:
+        waiting = [self._queues[lane] for lane in SendLane if self._queues[lane]]
+        self._grants += 1
+        if len(waiting) > 1 and self._grants % self.fair_every == 0:
+            # Доля младших полос: жетон самому давно ждущему из них
+            return min(waiting[1:], key=lambda queue: queue[0][0])
+        return waiting[0]
+    
+    async def _acquire(self, lane: SendLane):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._refill(now)
+        if now >= self._paused_until and self._tokens >= 1 and not any(self._queues.values()):
+            self._tokens -= 1
+            return
+        
+        future = loop.create_future()
+        self._queues[lane].append((now, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+        await future
+    
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while any(self._queues.values()):
+            now = loop.time()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            
+            _, future = self._next_queue().popleft()
+            if future.done():
+                continue  # Запрос отменен, пока ждал
+            self._tokens -= 1
+            future.set_result(None)
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        lane = rate_limit_args if isinstance(rate_limit_args, SendLane) else current_send_lane.get()
+        for attempt in range(self.max_retries + 1):
+            started = perf_counter()
+            await self._acquire(lane)
+            SEND_QUEUE_WAIT.labels(lane.name.lower()).observe(perf_counter() - started)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                SEND_RETRIES.labels(lane.name.lower()).inc()
+                pause_until = asyncio.get_running_loop().time() + e.retry_after
+                self._paused_until = max(self._paused_until, pause_until)
+                logger.warning(f"⏳ {endpoint}: лимит Telegram, отправка приостановлена на {e.retry_after} с")
+
 # ==================== УЛУЧШЕННАЯ КОНФИГУРАЦИЯ ====================
 
+class EnvSetting:
+    """⚙️ Настройка из переменной окружения, читается при первом обращении
+    
+    Так .env, загруженный в init_bot(), успевает попасть в окружение. Прочитанное
+    значение заменяет собой дескриптор и дальше это обычный атрибут класса.
+    """
+    
+    def __init__(self, name: str, default: Optional[str] = None, parse=str):
+        self.name = name
+        self.default = default
+        self.parse = parse
+    
+    def __set_name__(self, owner, attr: str):
+        self.attr = attr
+    
+    def __get__(self, instance, owner):
+        raw = os.getenv(self.name, self.default)
+        value = self.parse(raw) if raw is not None else None
+        setattr(owner, self.attr, value)
+        return value
+
 class Config:
     """⚙️ Конфигурация бота"""
-    BOT_TOKEN = os.getenv('BOT_TOKEN')
-    SUPER_ADMIN_IDS = [int(x) for x in os.getenv('SUPER_ADMIN_IDS', '5024165375').split(',')]
+    BOT_TOKEN = EnvSetting('BOT_TOKEN')
+    SUPER_ADMIN_IDS = EnvSetting('SUPER_ADMIN_IDS', '5024165375', lambda value: [int(x) for x in value.split(',')])
     
     # Настройки отделов (только IT отдел)
     ADMIN_CHAT_IDS = {
@@ -155,6 +770,75 @@ class Config:
     # Настройки ограничений
     REQUESTS_PER_HOUR = 5  # Максимум заявок в час на пользователя
     MAX_MEDIA_FILES = 10   # Максимум медиа файлов на заявку
+    PHONE_PREFILL = True   # Кнопка с телефоном из прошлой заявки при создании новой
+    
+    # Настройки мониторинга (0 - эндпоинт /metrics отключен)
+    METRICS_HOST = EnvSetting('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = EnvSetting('METRICS_PORT', '0', int)
+    # Адрес Bot API (например, локальный заменитель сервера для нагрузочных тестов)
+    BOT_API_BASE_URL = EnvSetting('BOT_API_BASE_URL')
+    BOT_API_BASE_FILE_URL = EnvSetting('BOT_API_BASE_FILE_URL')
+    # Запись входящих обновлений для воспроизведения (пусто - отключена)
+    RECORD_UPDATES_PATH = EnvSetting('RECORD_UPDATES_PATH')
+    RECORD_KEEP_TEXT = EnvSetting('RECORD_KEEP_TEXT', '0', lambda value: value == '1')
+    RECORD_SALT = EnvSetting('RECORD_SALT')
+    SEARCH_PAGE_SIZE = 8   # Результатов поиска на странице
+    SEARCH_CANDIDATES = 1000   # Сколько свежих совпадений ранжируется по релевантности
+    # Общий бюджет исходящих запросов к Bot API (0 - без планировщика)
+    SEND_RATE_PER_SECOND = EnvSetting('SEND_RATE_PER_SECOND', '25', float)
+    SEND_FAIR_EVERY = 5   # Каждый N-й жетон - младшим полосам, чтобы рассылки не голодали
+    PROFILE_DEFAULT_SECONDS = 30
+    PROFILE_MAX_SECONDS = 300
+    SLOW_QUERY_MS = EnvSetting('SLOW_QUERY_MS', '50', float)   # Порог журнала медленных запросов
+    N_PLUS_ONE_QUERIES = 20  # Столько запросов за одно обновление считается подозрительным
+    # Группировка похожих заявок в инциденты
+    ENABLE_INCIDENT_GROUPING = True
+    INCIDENT_SIMILARITY = 0.75       # Порог сходства описаний (взвешенный по IDF Жаккар по значимым словам)
+    INCIDENT_WINDOW_MINUTES = 180    # Более старые заявки не становятся родителями инцидента
+    INCIDENT_EDIT_DELAY = 2          # Секунд на накопление дубликатов перед правкой уведомления
+    # Сводка новых заявок администраторам (0 - отдельное сообщение на каждую заявку)
+    ADMIN_DIGEST_SECONDS = EnvSetting('ADMIN_DIGEST_SECONDS', '0', int)
+    DIGEST_EDIT_INTERVAL = 5         # Не чаще одной правки сводки за столько секунд
+    DIGEST_MAX_ITEMS = 20            # Заявок в одной сводке, дальше открывается новая
+    # Доска очереди (/board): закрепленное сообщение, которое бот правит при смене статусов
+    BOARD_EDIT_INTERVAL = 3          # Не чаще одной правки досок за столько секунд
+    BOARD_MAX_ITEMS = 10             # Заявок каждого статуса на доске
+    # Графики рендерятся в отдельных процессах, готовые PNG кэшируются
+    CHART_WORKERS = EnvSetting('CHART_WORKERS', '1', int)
+    CHART_CACHE_SIZE = 32
+    EXPORT_MAX_BYTES = 50 * 1024 * 1024   # Bot API не принимает документы больше 50 МБ
+    # Синхронизация реестра заявок с Google Sheets (пустой ID - отключена)
+    GOOGLE_SHEETS_ID = EnvSetting('GOOGLE_SHEETS_ID')
+    GOOGLE_CREDENTIALS_FILE = EnvSetting('GOOGLE_CREDENTIALS_FILE', 'credentials.json')
+    GOOGLE_SHEETS_BASE_URL = EnvSetting('GOOGLE_SHEETS_BASE_URL')   # Например, bot/fake_sheets_api.py
+    SHEETS_WORKSHEET = EnvSetting('SHEETS_WORKSHEET', 'Заявки')
+    SHEETS_SYNC_INTERVAL = EnvSetting('SHEETS_SYNC_INTERVAL', '60', int)
+    SHEETS_BATCH_SIZE = 500   # Строк в одном values:batchUpdate
+    # Перенос выполненных заявок старше N дней в архивные таблицы (0 - не переносить)
+    ARCHIVE_AFTER_DAYS = EnvSetting('ARCHIVE_AFTER_DAYS', '90', int)
+    ARCHIVE_INTERVAL = 6 * 3600   # Секунд между запусками архивации
+    ARCHIVE_BATCH_SIZE = 500      # Заявок в одной транзакции переноса
+    # Фоновые шаги миграций схемы: строк в одной транзакции и пауза между ними, с
+    MIGRATION_BATCH_SIZE = 2000
+    MIGRATION_BATCH_PAUSE = 0.05
+    # Кэш заявок и их медиа в EnhancedDatabase (сбрасывается при изменении заявки)
+    RECORD_CACHE_SIZE = 1024
+    RECORD_CACHE_TTL = 300
+    # Кэш отрисованных списков «Мои заявки» и админских списков (ключ - версия данных)
+    LIST_PAGE_CACHE_SIZE = 512
+    LIST_PAGE_CACHE_TTL = 3600
+    # Процессов-воркеров, между которыми делятся чаты (0 или 1 - все в одном процессе)
+    WORKERS = EnvSetting('WORKERS', '0', int)
+    LEADER_LEASE_SECONDS = 30   # Аренда лидера фоновых задач, продлевается втрое чаще
+    # Прием обновлений вебхуком вместо опроса (пустой адрес - getUpdates)
+    WEBHOOK_URL = EnvSetting('WEBHOOK_URL')
+    WEBHOOK_LISTEN = EnvSetting('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = EnvSetting('WEBHOOK_PORT', '8443', int)
+    WEBHOOK_SECRET = EnvSetting('WEBHOOK_SECRET')
+    # Локальные копии вложений заявок (пустой каталог - не скачивать)
+    MEDIA_STORE_DIR = EnvSetting('MEDIA_STORE_DIR')
+    MEDIA_STORE_MAX_MB = EnvSetting('MEDIA_STORE_MAX_MB', '1024', int)   # Давно не читанные файлы удаляются
+    MEDIA_STORE_CONCURRENCY = 2   # Одновременных загрузок на процесс
     
     @staticmethod
     def is_admin(user_id: int) -> bool:
@@ -175,13 +859,463 @@ class Config:
         # Создаем директорию для бэкапов
         os.makedirs(Config.BACKUP_DIR, exist_ok=True)
 
+# ==================== ИНСТРУМЕНТАЦИЯ SQL ====================
+
+DB_QUERIES_TOTAL = metrics.counter("db_queries_total", "Выполненные SQL-запросы")
+DB_SLOW_QUERIES_TOTAL = metrics.counter("db_slow_queries_total", "SQL-запросы дольше порога")
+DB_QUERIES_PER_UPDATE = metrics.histogram(
+    "db_queries_per_update", "Количество SQL-запросов на одно обновление",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250)
+)
+
+# Счетчик запросов текущего обновления Telegram (задается в BotApplication.process_update)
+current_update_queries: contextvars.ContextVar = contextvars.ContextVar('current_update_queries', default=None)
+
+def normalize_sql(sql: str) -> str:
+    """🧹 Сворачивает пробелы, чтобы одинаковые запросы группировались вместе"""
+    return ' '.join(sql.split())
+
+class QueryStats:
+    """🐢 Статистика SQL-запросов и журнал медленных запросов"""
+
+    def __init__(self, slow_threshold_ms: float, n_plus_one_threshold: int, keep_worst: int = 10):
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.keep_worst = keep_worst
+        self._lock = threading.Lock()
+        # sql -> [количество, суммарное время, максимальное время]
+        self.queries: Dict[str, List[float]] = {}
+        self.slow_log: List[Dict[str, Any]] = []
+        self.worst_updates: List[Dict[str, Any]] = []
+        self.total_count = 0
+        self.total_time = 0.0
+
+    def record(self, conn: sqlite3.Connection, sql: str, params, duration: float):
+        """📝 Учитывает выполненный запрос"""
+        key = normalize_sql(sql)
+        DB_QUERIES_TOTAL.inc()
+        with self._lock:
+            self.total_count += 1
+            self.total_time += duration
+            entry = self.queries.get(key)
+            if entry is None:
+                entry = self.queries[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+
+        update_queries = current_update_queries.get()
+        if update_queries is not None:
+            update_queries[key] += 1
+
+        if duration >= self.slow_threshold:
+            DB_SLOW_QUERIES_TOTAL.inc()
+            plan = self.explain(conn, sql, params)
+            logger.warning(
+                f"🐢 Медленный запрос {duration * 1000:.1f} мс: {key}\n"
+                f"   План: {' | '.join(plan) if plan else 'недоступен'}"
+            )
+            with self._lock:
+                self.slow_log.append({
+                    'sql': key, 'duration': duration, 'plan': plan,
+                    'at': datetime.now().strftime('%d.%m %H:%M:%S')
+                })
+                del self.slow_log[:-self.keep_worst]
+
+    @staticmethod
+    def explain(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+        """🔍 Получает EXPLAIN QUERY PLAN для запроса"""
+        try:
+            cursor = sqlite3.Cursor(conn)
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params or ())
+            return [row[-1] for row in cursor.fetchall()]
+        except sqlite3.Error:
+            return []
+
+    def finish_update(self, update_kind: str, update_queries: Dict[str, int]):
+        """🔢 Учитывает количество запросов за обновление и ищет паттерны N+1"""
+        total = sum(update_queries.values())
+        DB_QUERIES_PER_UPDATE.observe(total)
+        if total < self.n_plus_one_threshold:
+            return
+
+        sql, repeats = max(update_queries.items(), key=lambda item: item[1])
+        logger.warning(f"🔁 Обновление {update_kind} выполнило {total} SQL-запросов, чаще всего ({repeats}×): {sql}")
+        with self._lock:
+            self.worst_updates.append({
+                'kind': update_kind, 'total': total, 'sql': sql, 'repeats': repeats,
+                'at': datetime.now().strftime('%d.%m %H:%M:%S')
+            })
+            self.worst_updates.sort(key=lambda item: item['total'], reverse=True)
+            del self.worst_updates[self.keep_worst:]
+
+    def top_queries(self, limit: int = 10) -> List[Tuple[str, int, float, float]]:
+        """🏆 Запросы с наибольшим суммарным временем: (sql, количество, сумма, максимум)"""
+        with self._lock:
+            items = [(sql, int(count), total, worst) for sql, (count, total, worst) in self.queries.items()]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return items[:limit]
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """⏱️ Курсор с замером времени каждого запроса"""
+
+    def execute(self, sql, parameters=()):
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            query_stats.record(self.connection, sql, parameters, perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            query_stats.record(self.connection, sql, None, perf_counter() - start)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """⏱️ Соединение, все курсоры которого замеряют запросы"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+# Порог медленных запросов задается окружением - создается в init_bot()
+query_stats: Optional[QueryStats] = None
+
+# ==================== ЗАПИСЬ ВХОДЯЩИХ ОБНОВЛЕНИЙ ====================
+
+# Поля, содержащие пользователей или чаты, чьи данные нужно обезличить
+_RECORDER_PERSON_KEYS = {
+    'from', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat', 'via_bot', 'contact'
+}
+_RECORDER_PHONE_RE = re.compile(r'^[\d\s()+-]{10,20}$')
+# Разметка, которая сама несет данные (ссылка, пользователь) или указывает на них в тексте.
+# Остальная разметка сохраняется: обезличенный текст той же длины, а bot_command нужен CommandHandler
+_RECORDER_PRIVATE_ENTITIES = frozenset({'text_link', 'text_mention', 'phone_number', 'email'})
+# Кнопки меню сохраняются как есть: по ним диалоги при воспроизведении идут по тем же веткам.
+# Остальной текст, даже начинающийся с эмодзи, обезличивается
+_RECORDER_BUTTONS = frozenset({
+    "📝 Создать заявку", "📂 Мои заявки", "📊 Статистика", "👨‍💼 Контакты отдела", "🆘 Помощь",
+    "🔙 Главное меню", "🔙 Назад", "🔙 Отмена", "🔙 Назад в админку",
+    "✅ Завершить без медиа", "✅ Завершить создание", "📎 Прикрепить фото/видео", "📎 Прикрепить еще",
+    "🔥 Отметить как срочную", "💤 Снять срочность", "✅ Да, сбросить", "❌ Нет, отмена",
+    "👨‍💼 Админ панель", "📋 Все заявки", "📋 Новые заявки", "🔄 В работе", "✅ Выполненные",
+    "📊 Общая статистика", "🔄 Сброс системы", "💾 Создать бэкап", "🐢 Медленные запросы",
+    "📈 SLA-аналитика", "📉 Графики",
+})
+
+class UpdateRecorder:
+    """📼 Пишет обезличенные входящие обновления в ротируемый JSONL для воспроизведения.
+
+    ID пользователей и чатов заменяются стабильными псевдонимами (HMAC),
+    имена и телефоны убираются. Свободный текст хэшируется с сохранением
+    длины, команды и кнопки меню (_RECORDER_BUTTONS) сохраняются, чтобы при
+    воспроизведении диалоги шли по тем же веткам.
+    """
+
+    def __init__(self, path: str, keep_text: bool = False, salt: str = None,
+                 max_bytes: int = 50 * 1024 * 1024, backup_count: int = 10):
+        self.keep_text = keep_text
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self._logger = logging.getLogger('update_recorder')
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self._logger.addHandler(handler)
+
+    def _digest(self, value: Any) -> bytes:
+        return hmac.new(self.salt, str(value).encode('utf-8'), hashlib.sha256).digest()
+
+    def _map_id(self, value: int) -> int:
+        """🔀 Стабильный псевдоним ID (знак сохраняется: у групп ID отрицательные)"""
+        mapped = 1_000_000_000 + int.from_bytes(self._digest(value)[:4], 'big') % 1_000_000_000
+        return -mapped if value < 0 else mapped
+
+    def _fake_phone(self, value: str) -> str:
+        """📞 Стабильный выдуманный номер вместо настоящего (проходит проверку формата)"""
+        digest = self._digest(value).hex()
+        return '+79' + ''.join(str(int(ch, 16) % 10) for ch in digest[:9])
+    
+    def _anonymize_text(self, text: str) -> str:
+        # Команды и кнопки меню оставляем как есть
+        if self.keep_text or not text or text.startswith('/') or text in _RECORDER_BUTTONS:
+            return text
+        if _RECORDER_PHONE_RE.match(text):
+            return self._fake_phone(text)
+        return ('txt_' + self._digest(text).hex()).ljust(len(text), 'x')[:len(text)]
+
+    def _anonymize(self, value: Any, key: str = None, bot_message: bool = False) -> Any:
+        if isinstance(value, list):
+            return [self._anonymize(item, key, bot_message) for item in value]
+        if not isinstance(value, dict):
+            return value
+        result = {}
+        for field, item in value.items():
+            # Сообщение бота под кнопкой содержит чужие данные (телефон, описание) - скрываем целиком
+            if bot_message and field in ('text', 'caption'):
+                result[field] = f"[{self._digest(item).hex()[:12]}]"
+                continue
+            # У контакта ID владельца в user_id (может отсутствовать)
+            person_id = value.get('id', value.get('user_id', 0))
+            if key in _RECORDER_PERSON_KEYS and field == 'id':
+                result[field] = self._map_id(item)
+            elif key in _RECORDER_PERSON_KEYS and field in ('first_name', 'last_name', 'title'):
+                result[field] = f"User{self._map_id(person_id)}" if field != 'last_name' else None
+            elif key in _RECORDER_PERSON_KEYS and field == 'username':
+                result[field] = f"u{self._map_id(person_id)}"
+            elif key == 'contact' and field == 'phone_number':
+                # Номер обязателен в контакте - подменяем, а не удаляем
+                result[field] = self._fake_phone(item)
+            elif key == 'contact' and field == 'vcard':
+                continue
+            elif field in ('text', 'caption', 'query'):
+                result[field] = self._anonymize_text(item)
+            elif field in ('file_id', 'file_unique_id'):
+                result[field] = self._digest(item).hex()[:32]
+            elif field in ('entities', 'caption_entities'):
+                if bot_message:
+                    continue
+                entities = [entity for entity in item if entity.get('type') not in _RECORDER_PRIVATE_ENTITIES]
+                result[field] = entities or None
+            elif field in ('phone_number', 'email'):
+                continue
+            elif field == 'user_id' and isinstance(item, int):
+                result[field] = self._map_id(item)
+            else:
+                result[field] = self._anonymize(
+                    item, field, bot_message or (key == 'callback_query' and field == 'message')
+                )
+        return {field: item for field, item in result.items() if item is not None}
+
+    def record(self, update: Update) -> None:
+        """📝 Записывает одно обновление"""
+        try:
+            user = update.effective_user
+            record = {
+                'ts': round(unix_time(), 3),
+                'admin': bool(user and Config.is_admin(user.id)),
+                'update': self._anonymize(update.to_dict()),
+            }
+            self._logger.info(json.dumps(record, ensure_ascii=False))
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи обновления: {e}")
+
+# Создается в init_bot(), если задан RECORD_UPDATES_PATH
+update_recorder: Optional[UpdateRecorder] = None
+
+# ==================== ГРУППИРОВКА ИНЦИДЕНТОВ ====================
+
+INCIDENT_DUPLICATES = metrics.counter("incident_duplicates_total", "Заявки, привязанные к открытому инциденту")
+_NON_WORD_RE = re.compile(r'[\W_]+', re.UNICODE)
+
+# Служебные слова и общие фразы жалоб («не работает», «помогите»): они есть почти в каждой заявке
+INCIDENT_STOP_WORDS = frozenset("""
+    а без бы в во вот все всё вы где да для до его ее её если есть еще ещё же за и из или им их к как
+    когда ко кто ли мне мой моя мое моё мои меня мы на над нам нас не него нее неё нет ни но ну о об
+    однако он она они оно опять от очень по под после при про с со снова так также там то тоже только
+    ту у уже чего чем что чтобы эта эти это этот я
+    работает работают работать работало работала работал заработал перестал перестала перестало
+    сломался сломалась сломалось сломан сломано проблема проблемы проблемой ошибка ошибку ошибки
+    помогите помочь пожалуйста срочно просьба прошу нужно надо необходимо можно сделать подскажите
+    здравствуйте добрый день утро вечер спасибо кабинете кабинет каб
+""".split())
+_STEM_ENDINGS = 'аеёиоуыэюяйь'
+
+def text_terms(text: str) -> Set[str]:
+    """🧩 Значимые слова описания: без служебных и общих слов, с отрезанным окончанием"""
+    terms = set()
+    for word in _NON_WORD_RE.sub(' ', text.lower()).split():
+        if word in INCIDENT_STOP_WORDS:
+            continue
+        # Грубая основа: «принтера»/«принтеру» -> «принтер», «почта»/«почту» -> «почт»
+        terms.add(word.rstrip(_STEM_ENDINGS)[:8] or word)
+    return terms
+
+class IncidentIndex:
+    """🧲 Индекс свежих открытых заявок для поиска почти-дубликатов.
+    
+    Описание заявки - множество значимых слов (text_terms). Кандидаты - заявки
+    хотя бы с одним общим словом (обратный индекс), сходство - взвешенный
+    коэффициент Жаккара: вес слова - IDF по заявкам индекса, поэтому слово,
+    которое встречается во многих заявках, почти не сближает их. ID сообщений
+    с уведомлениями администраторам хранятся в базе (incident_notifications),
+    чтобы дубликаты правили их из любого воркера, а не слали новые.
+    """
+    
+    def __init__(self, threshold: float, window: timedelta):
+        self.threshold = threshold
+        self.window = window
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        # request_id -> (время создания, слова); порядок вставки = порядок создания
+        self._entries: Dict[int, Tuple[datetime, Set[str]]] = {}
+        self.pending_updates: Set[int] = set()
+        self.loaded = False
+    
+    def _expire(self):
+        deadline = datetime.now() - self.window
+        for request_id in list(self._entries):
+            if self._entries[request_id][0] >= deadline:
+                break
+            self.remove(request_id)
+    
+    def _weight(self, term: str) -> float:
+        """⚖️ IDF слова по заявкам индекса (сглаженный, не меньше 1)"""
+        return math.log((len(self._entries) + 1) / (len(self._postings.get(term, ())) + 1)) + 1
+    
+    def similarity(self, terms: Set[str], other: Set[str]) -> float:
+        """📐 Взвешенный коэффициент Жаккара двух множеств слов"""
+        union = sum(self._weight(term) for term in terms | other)
+        if not union:
+            return 0.0
+        return sum(self._weight(term) for term in terms & other) / union
+    
+    def __contains__(self, request_id: int) -> bool:
+        return request_id in self._entries
+    
+    def add(self, request_id: int, text: str, created_at: datetime = None):
+        """➕ Добавляет заявку как возможного родителя инцидента"""
+        terms = text_terms(text or '')
+        self._entries[request_id] = (created_at or datetime.now(), terms)
+        for term in terms:
+            self._postings[term].add(request_id)
+    
+    def remove(self, request_id: int):
+        """➖ Убирает заявку (выполнена или устарела)"""
+        entry = self._entries.pop(request_id, None)
+        if entry is None:
+            return
+        for term in entry[1]:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.discard(request_id)
+                if not posting:
+                    del self._postings[term]
+    
+    def find(self, text: str) -> Optional[int]:
+        """🔍 ID самой ранней похожей заявки или None"""
+        self._expire()
+        terms = text_terms(text or '')
+        candidates = set()
+        for term in terms:
+            candidates.update(self._postings.get(term, ()))
+        
+        best_id, best_similarity = None, self.threshold
+        for request_id in sorted(candidates):
+            similarity = self.similarity(terms, self._entries[request_id][1])
+            if similarity > best_similarity or (similarity == best_similarity and best_id is None):
+                best_id, best_similarity = request_id, similarity
+        return best_id
+    
+    def load(self, requests: List[Dict]):
+        """📥 Заполняет индекс открытыми заявками из базы"""
+        self._entries.clear()
+        self._postings.clear()
+        for request in requests:
+            self.add(request['id'], request['problem'], datetime.fromisoformat(request['created_at']))
+        self.loaded = True
+
+incident_index = IncidentIndex(Config.INCIDENT_SIMILARITY, timedelta(minutes=Config.INCIDENT_WINDOW_MINUTES))
+
 # ==================== УЛУЧШЕННАЯ БАЗА ДАННЫХ ====================
 
+# Рядом с текстовыми датами (для показа) - секунды Unix UTC для сортировки, фильтров и длительностей
+EPOCH_COLUMNS = {
+    'requests': (('created_at', 'created_ts'), ('assigned_at', 'assigned_ts'), ('completed_at', 'completed_ts')),
+    'requests_archive': (('created_at', 'created_ts'), ('assigned_at', 'assigned_ts'), ('completed_at', 'completed_ts')),
+    'users': (('last_activity', 'last_activity_ts'),),
+}
+# Текстовые даты хранятся в локальном времени: модификатор 'utc' переводит их в UTC.
+# Доли секунды отрезаем: SQLite округляет их до миллисекунд и .9999 дало бы следующую секунду
+EPOCH_FROM_TEXT_SQL = "CAST(strftime('%s', substr({column}, 1, 19), 'utc') AS INTEGER)"
+
+# Метаданные вложений из Telegram (у фото нет mime_type и duration)
+MEDIA_METADATA_COLUMNS = (
+    ('file_unique_id', 'TEXT'), ('file_size', 'INTEGER'), ('mime_type', 'TEXT'), ('duration', 'INTEGER'),
+)
+
+def epoch(moment: datetime) -> int:
+    """🕐 Наивное локальное время -> секунды Unix (UTC)"""
+    return int(moment.timestamp())
+
+DB_CACHE_LOOKUPS = metrics.counter("db_cache_lookups_total", "Обращения к кэшу записей базы", ("cache", "result"))
+
+class RecordCache:
+    """🧠 LRU-кэш с TTL для записей базы.
+    
+    Каждая инвалидация увеличивает поколение; результат чтения, начатого
+    до инвалидации, в кэш не попадает (иначе гонка потоков вернула бы
+    устаревшую заявку).
+    """
+    
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = DB_CACHE_LOOKUPS.labels(name, 'hit')
+        self._misses = DB_CACHE_LOOKUPS.labels(name, 'miss')
+    
+    def get(self, key) -> Tuple[bool, Any, int]:
+        """🔍 (найдено, значение, поколение для последующего put)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > perf_counter():
+                self._entries.move_to_end(key)
+                self._hits.inc()
+                return True, entry[1], self.generation
+            if entry is not None:
+                del self._entries[key]
+            self._misses.inc()
+            return False, None, self.generation
+    
+    def put(self, key, value, generation: int):
+        """💾 Запоминает значение, если с момента чтения не было инвалидаций"""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (perf_counter() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, *keys):
+        """🧹 Удаляет записи по ключам"""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+    
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """🎯 Доля попаданий с запуска (None - обращений не было)"""
+        hits, misses = self._hits.value, self._misses.value
+        return hits / (hits + misses) if hits + misses else None
+
 class EnhancedDatabase:
     """🗃️ Улучшенный класс для работы с базой данных"""
     
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # Заявки и их медиа читаются многократно подряд (кнопки, детали, уведомления)
+        self.request_cache = RecordCache('request', Config.RECORD_CACHE_SIZE, Config.RECORD_CACHE_TTL)
+        self.media_cache = RecordCache('request_media', Config.RECORD_CACHE_SIZE, Config.RECORD_CACHE_TTL)
+        # Подписчики на создание заявок и смену статусов (доски очереди)
+        self._listeners: List[Callable[[List[int]], None]] = []
         try:
             self.init_enhanced_db()
             logger.info("✅ База данных успешно инициализирована")
@@ -189,81 +1323,498 @@ class EnhancedDatabase:
             logger.error(f"❌ Ошибка инициализации БД: {e}")
             raise
     
+    def _connect(self) -> sqlite3.Connection:
+        """🔌 Открывает соединение с замером всех запросов"""
+        return sqlite3.connect(self.db_path, factory=InstrumentedConnection)
+    
+    def subscribe(self, listener: Callable[[List[int]], None]):
+        """👂 listener(ID заявок) вызывается после фиксации создания заявки или смены статуса"""
+        self._listeners.append(listener)
+    
+    def _notify(self, request_ids: List[int]):
+        for listener in self._listeners:
+            try:
+                listener(request_ids)
+            except Exception as e:
+                logger.error(f"❌ Ошибка подписчика изменений заявок: {e}")
+    
+    def migrations(self) -> List[Migration]:
+        """🧬 История схемы базы: новое изменение - новая миграция в конце списка"""
+        return [
+            Migration(1, "Базовые таблицы", self.create_base_tables),
+            Migration(2, "Связь заявок с инцидентами", self.add_incident_column),
+            Migration(3, "Полнотекстовый поиск", self.init_search_index),
+            Migration(4, "Версии данных для кэшей", self.init_cache_versions),
+            Migration(5, "Журнал изменений заявок", self.init_change_log),
+            Migration(6, "Архивные таблицы", self.init_archive),
+            Migration(7, "Секунды Unix рядом с текстовыми датами", self.add_epoch_columns, (
+                Backfill('indexes', self.build_epoch_indexes),
+                *(Backfill(table, self.epoch_backfill(table)) for table in EPOCH_COLUMNS),
+            )),
+            Migration(8, "Аренда лидера фоновых задач", self.init_leader_leases),
+            # Схемная часть пустая: меняются только данные
+            Migration(9, "Телефоны в формате E.164", lambda cursor: None, (
+                *(Backfill(table, self.phone_backfill(table)) for table in ('users', 'requests', 'requests_archive')),
+            )),
+            Migration(10, "Метаданные медиа", self.add_media_metadata, (
+                Backfill('indexes', self.build_media_indexes),
+            )),
+            Migration(11, "Доски очереди администраторов", self.init_admin_boards),
+            Migration(12, "Уведомления об инцидентах", self.init_incident_notifications),
+        ]
+    
     def init_enhanced_db(self):
-        """🎯 Инициализация улучшенной базы данных"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # Таблица заявок
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    username TEXT,
-                    phone TEXT,
-                    department TEXT DEFAULT '💻 IT отдел',
-                    problem TEXT,
-                    photo_id TEXT,
-                    status TEXT DEFAULT 'new',
-                    urgency TEXT DEFAULT '💤 НЕ СРОЧНО',
-                    created_at TEXT,
-                    assigned_at TEXT,
-                    assigned_admin TEXT,
-                    completed_at TEXT,
-                    admin_comment TEXT,
-                    user_rating INTEGER DEFAULT 0,
-                    user_feedback TEXT
-                )
+        """🎯 Инициализация улучшенной базы данных: недостающие миграции схемы
+        
+        Долгие шаги миграций выполняет фоновая задача (run_migration_backfills).
+        """
+        self.migrator = MigrationRunner(self._connect, self.migrations())
+        self.migrator.migrate()
+    
+    def create_base_tables(self, cursor: sqlite3.Cursor):
+        """🧱 Заявки, медиа, статистика и пользователи"""
+        # Таблица заявок
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                username TEXT,
+                phone TEXT,
+                department TEXT DEFAULT '💻 IT отдел',
+                problem TEXT,
+                photo_id TEXT,
+                status TEXT DEFAULT 'new',
+                urgency TEXT DEFAULT '💤 НЕ СРОЧНО',
+                created_at TEXT,
+                assigned_at TEXT,
+                assigned_admin TEXT,
+                completed_at TEXT,
+                admin_comment TEXT,
+                user_rating INTEGER DEFAULT 0,
+                user_feedback TEXT
+            )
+        ''')
+        
+        # Таблица медиа файлов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS request_media (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                request_id INTEGER,
+                file_id TEXT,
+                file_type TEXT,
+                file_name TEXT,
+                created_at TEXT,
+                FOREIGN KEY (request_id) REFERENCES requests (id)
+            )
+        ''')
+        
+        # Таблица статистики
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS statistics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT,
+                total_requests INTEGER DEFAULT 0,
+                completed_requests INTEGER DEFAULT 0,
+                avg_completion_time REAL DEFAULT 0,
+                created_at TEXT
+            )
+        ''')
+        
+        # Таблица пользователей для улучшенного управления
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                full_name TEXT,
+                phone TEXT,
+                department TEXT,
+                created_at TEXT,
+                last_activity TEXT,
+                is_blocked BOOLEAN DEFAULT FALSE,
+                block_reason TEXT
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)')
+    
+    def add_incident_column(self, cursor: sqlite3.Cursor):
+        """🧲 Связь заявки с родительской заявкой инцидента"""
+        cursor.execute('PRAGMA table_info(requests)')
+        if 'incident_id' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute('ALTER TABLE requests ADD COLUMN incident_id INTEGER')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_incident_id ON requests(incident_id)')
+    
+    def _create_trigger(self, cursor: sqlite3.Cursor, sql: str):
+        """⚡ Создает триггер, а если в базе он с другим определением - пересоздает"""
+        sql = sql.strip()
+        name = sql.split()[2]
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,))
+        row = cursor.fetchone()
+        if row and row[0] == sql:
+            return
+        if row:
+            cursor.execute(f'DROP TRIGGER {name}')
+        cursor.execute(sql)
+    
+    def _update_event(self, cursor: sqlite3.Cursor) -> str:
+        """✏️ Изменение данных заявки: любые колонки, кроме секунд Unix (их заполнение - не правка)"""
+        epoch_columns = {column for _, column in EPOCH_COLUMNS['requests']}
+        cursor.execute('PRAGMA table_info(requests)')
+        return 'UPDATE OF ' + ', '.join(row[1] for row in cursor.fetchall() if row[1] not in epoch_columns)
+    
+    def init_search_index(self, cursor: sqlite3.Cursor):
+        """🔎 Полнотекстовый индекс FTS5 по заявкам, синхронизируемый триггерами"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'requests_fts'")
+        exists = cursor.fetchone()
+        
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts USING fts5(
+                problem, admin_comment, user_feedback,
+                content='requests', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS requests_fts_insert AFTER INSERT ON requests BEGIN
+                INSERT INTO requests_fts (rowid, problem, admin_comment, user_feedback)
+                VALUES (new.id, new.problem, new.admin_comment, new.user_feedback);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS requests_fts_delete AFTER DELETE ON requests BEGIN
+                INSERT INTO requests_fts (requests_fts, rowid, problem, admin_comment, user_feedback)
+                VALUES ('delete', old.id, old.problem, old.admin_comment, old.user_feedback);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS requests_fts_update
+            AFTER UPDATE OF problem, admin_comment, user_feedback ON requests BEGIN
+                INSERT INTO requests_fts (requests_fts, rowid, problem, admin_comment, user_feedback)
+                VALUES ('delete', old.id, old.problem, old.admin_comment, old.user_feedback);
+                INSERT INTO requests_fts (rowid, problem, admin_comment, user_feedback)
+                VALUES (new.id, new.problem, new.admin_comment, new.user_feedback);
+            END
+        ''')
+        
+        if not exists:
+            # Индекс создан для уже существующих заявок - заполняем его
+            cursor.execute("INSERT INTO requests_fts (requests_fts) VALUES ('rebuild')")
+            logger.info("🔎 Построен полнотекстовый индекс заявок")
+    
+    def init_cache_versions(self, cursor: sqlite3.Cursor):
+        """🔢 Версии данных для кэшей: триггеры увеличивают версию при любом изменении заявок"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                scope TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO cache_versions (scope, version) VALUES ('requests', 0)")
+        for event in ('INSERT', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS requests_version_{event.lower()} AFTER {event} ON requests BEGIN
+                    UPDATE cache_versions SET version = version + 1 WHERE scope = 'requests';
+                END
             ''')
-            
-            # Таблица медиа файлов
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS request_media (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    request_id INTEGER,
-                    file_id TEXT,
-                    file_type TEXT,
-                    file_name TEXT,
-                    created_at TEXT,
-                    FOREIGN KEY (request_id) REFERENCES requests (id)
-                )
+        self._create_trigger(cursor, f'''
+            CREATE TRIGGER requests_version_update AFTER {self._update_event(cursor)} ON requests BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE scope = 'requests';
+            END
+        ''')
+        
+        # Версии списков: заявки пользователя (user:ID) и заявки в статусе (status:new и т.д.)
+        bump = '''
+            INSERT INTO cache_versions (scope, version) VALUES ({scope}, 1)
+            ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+        '''
+        scopes = {
+            'insert': ("'user:' || new.user_id", "'status:' || new.status"),
+            'update': ("'user:' || new.user_id", "'status:' || old.status", "'status:' || new.status"),
+            'delete': ("'user:' || old.user_id", "'status:' || old.status"),
+        }
+        events = {'insert': 'INSERT', 'update': self._update_event(cursor), 'delete': 'DELETE'}
+        for event, expressions in scopes.items():
+            self._create_trigger(cursor, f'''
+                CREATE TRIGGER requests_list_version_{event} AFTER {events[event]} ON requests BEGIN
+                    {''.join(bump.format(scope=expression) for expression in expressions)}
+                END
             ''')
-            
-            # Таблица статистики
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS statistics (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    date TEXT,
-                    total_requests INTEGER DEFAULT 0,
-                    completed_requests INTEGER DEFAULT 0,
-                    avg_completion_time REAL DEFAULT 0,
-                    created_at TEXT
-                )
+    
+    def init_change_log(self, cursor: sqlite3.Cursor):
+        """📝 Журнал изменений заявок для инкрементальных выгрузок (одна строка на заявку)"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'request_changes'")
+        exists = cursor.fetchone()
+        
+        # REPLACE удаляет прежнюю запись заявки, новая получает следующий seq
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS request_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                request_id INTEGER NOT NULL UNIQUE
+            )
+        ''')
+        for name, event in (('insert', 'INSERT'), ('update', self._update_event(cursor))):
+            self._create_trigger(cursor, f'''
+                CREATE TRIGGER requests_changes_{name} AFTER {event} ON requests BEGIN
+                    INSERT OR REPLACE INTO request_changes (request_id) VALUES (new.id);
+                END
             ''')
-            
-            # Таблица пользователей для улучшенного управления
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    full_name TEXT,
-                    phone TEXT,
-                    department TEXT,
-                    created_at TEXT,
-                    last_activity TEXT,
-                    is_blocked BOOLEAN DEFAULT FALSE,
-                    block_reason TEXT
+        
+        if not exists:
+            # Журнал появился на существующей базе - все заявки считаем измененными
+            cursor.execute('INSERT INTO request_changes (request_id) SELECT id FROM requests ORDER BY id')
+    
+    def mirror_archive_columns(self, cursor: sqlite3.Cursor):
+        """🪞 Архивные таблицы с той же структурой, что и рабочие (новые колонки дополняются)
+        
+        Миграция, добавляющая колонку в requests или request_media, вызывает его следом.
+        """
+        for table in ('requests', 'request_media'):
+            cursor.execute(f'PRAGMA table_info({table})')
+            columns = [(row[1], row[2]) for row in cursor.fetchall()]
+            cursor.execute(f'PRAGMA table_info({table}_archive)')
+            archived = {row[1] for row in cursor.fetchall()}
+            if not archived:
+                definitions = ', '.join(
+                    f'{name} INTEGER PRIMARY KEY' if name == 'id' else f'{name} {kind}' for name, kind in columns
                 )
-            ''')
-            
-            # Индексы для производительности
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_status ON requests(status)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_created_at ON requests(created_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_user_id ON requests(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)')
+                cursor.execute(f'CREATE TABLE {table}_archive ({definitions})')
+            else:
+                for name, kind in columns:
+                    if name not in archived:
+                        cursor.execute(f'ALTER TABLE {table}_archive ADD COLUMN {name} {kind}')
+    
+    def init_archive(self, cursor: sqlite3.Cursor):
+        """🗄️ Архив старых выполненных заявок и их медиа"""
+        self.mirror_archive_columns(cursor)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_archive_user_id ON requests_archive(user_id)')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS idx_request_media_archive_request_id ON request_media_archive(request_id)'
+        )
+        
+        # Итоги по архиву для статистики, чтобы не считать архив при каждом просмотре
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archive_summary (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total INTEGER NOT NULL DEFAULT 0,
+                rating_sum INTEGER NOT NULL DEFAULT 0,
+                rating_count INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO archive_summary (id) VALUES (1)')
+    
+    def add_epoch_columns(self, cursor: sqlite3.Cursor):
+        """🕐 Колонки секунд Unix (заполняются и индексируются в фоне)"""
+        for table in ('requests', 'users'):
+            cursor.execute(f'PRAGMA table_info({table})')
+            existing = {column[1] for column in cursor.fetchall()}
+            for _, column in EPOCH_COLUMNS[table]:
+                if column not in existing:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} INTEGER')
+        self.mirror_archive_columns(cursor)
+        # Триггеры UPDATE OF перечисляют колонки заявок - пересоздаем их с новым списком
+        self.init_cache_versions(cursor)
+        self.init_change_log(cursor)
+    
+    def init_leader_leases(self, cursor: sqlite3.Cursor):
+        """👑 Аренды лидерства: фоновые задачи в режиме воркеров выполняет один процесс"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS leader_leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+    
+    def add_media_metadata(self, cursor: sqlite3.Cursor):
+        """📎 Постоянный ID файла, размер, тип и длительность вложений"""
+        cursor.execute('PRAGMA table_info(request_media)')
+        existing = {column[1] for column in cursor.fetchall()}
+        for column, kind in MEDIA_METADATA_COLUMNS:
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE request_media ADD COLUMN {column} {kind}')
+        self.mirror_archive_columns(cursor)
+    
+    def build_media_indexes(self, cursor: sqlite3.Cursor, position: Optional[int], batch_size: int) -> None:
+        """📇 Индекс медиа по заявке, он же не дает приложить один файл к заявке дважды
+        
+        Старые строки без file_unique_id (NULL) уникальность не нарушают.
+        """
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_request_media_request_file
+            ON request_media(request_id, file_unique_id)
+        ''')
+        return None
+    
+    def init_admin_boards(self, cursor: sqlite3.Cursor):
+        """📌 Сообщения досок очереди: правит любой процесс, которому известен их ID"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admin_boards (
+                admin_id INTEGER PRIMARY KEY,
+                message_id INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        ''')
+    
+    def init_incident_notifications(self, cursor: sqlite3.Cursor):
+        """🔁 Сообщения с уведомлениями об инцидентах: правит любой воркер, а не только отправивший
+        
+        kind - 'incident' (отдельное уведомление) или 'digest' (заявка пришла администратору в сводке).
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS incident_notifications (
+                request_id INTEGER NOT NULL,
+                admin_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'incident',
+                PRIMARY KEY (request_id, admin_id)
+            )
+        ''')
+    
+    def enable_wal(self):
+        """📒 Журнал WAL: читатели не ждут писателя (несколько процессов на одной базе)"""
+        with self._connect() as conn:
+            mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        logger.info(f"📒 Режим журнала базы: {mode}")
+    
+    def build_epoch_indexes(self, cursor: sqlite3.Cursor, position: Optional[int], batch_size: int) -> None:
+        """📇 Индексы по секундам Unix вместо индексов по тексту (одна транзакция на все индексы)"""
+        # Списки сортируются по времени внутри статуса и пользователя
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_status_created_ts ON requests(status, created_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_user_created_ts ON requests(user_id, created_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_created_ts ON requests(created_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_archive_created_ts ON requests_archive(created_ts)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_activity_ts ON users(last_activity_ts)')
+        for index in ('idx_requests_status', 'idx_requests_created_at', 'idx_requests_user_id',
+                      'idx_requests_archive_created_at'):
+            cursor.execute(f'DROP INDEX IF EXISTS {index}')
+        return None
+    
+    def epoch_backfill(self, table: str) -> BatchFunction:
+        """🕐 Пачки заполнения секунд Unix по текстовым датам, от новых строк к старым
+        
+        Позиция - rowid, ниже которого строки еще не просмотрены. Свежие строки
+        идут первыми: их чаще показывают. Заполнение не считается правкой заявки
+        (триггеры версий и журнала изменений слушают только колонки данных).
+        """
+        pairs = EPOCH_COLUMNS[table]
+        # Первая колонка (created_ts, last_activity_ts) проиндексирована: незаполненные ищутся по индексу
+        text, column = pairs[0]
+        pending = f'{column} IS NULL AND {text} IS NOT NULL'
+        assignments = ', '.join(
+            f'{column} = COALESCE({column}, {EPOCH_FROM_TEXT_SQL.format(column=text)})' for text, column in pairs
+        )
+        
+        def batch(cursor: sqlite3.Cursor, position: Optional[int], batch_size: int) -> Optional[int]:
+            if position is None:
+                cursor.execute(f'SELECT COALESCE(MAX(rowid), 0) + 1 FROM {table}')
+                position = cursor.fetchone()[0]
+            # Пачка - batch_size незаполненных строк ниже позиции (даже если дату не разобрать)
+            cursor.execute(f'''
+                SELECT MIN(rowid) FROM (
+                    SELECT rowid FROM {table} WHERE {pending} AND rowid < ? ORDER BY rowid DESC LIMIT ?
+                )
+            ''', (position, batch_size))
+            low = cursor.fetchone()[0]
+            if low is None:
+                # Аналитика пропускает незаполненные строки - пересчитываем отчеты и графики
+                cursor.execute("UPDATE cache_versions SET version = version + 1 WHERE scope = 'requests'")
+                if table == 'requests':
+                    # Заявка могла попасть в кэш между сбросом пачки и ее COMMIT
+                    self.request_cache.clear()
+                return None
+            if table == 'requests':
+                cursor.execute(
+                    f'SELECT rowid FROM requests WHERE rowid >= ? AND rowid < ? AND {pending}', (low, position)
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(
+                f'UPDATE {table} SET {assignments} WHERE rowid >= ? AND rowid < ? AND {pending}', (low, position)
+            )
+            if table == 'requests':
+                # Заявки, закэшированные до пачки, иначе до истечения TTL показывали бы пустые *_ts
+                self.request_cache.invalidate(*ids)
+            return low
+        
+        return batch
+    
+    def phone_backfill(self, table: str) -> BatchFunction:
+        """📞 Пачки приведения сохраненных телефонов к E.164 (позиция - последний просмотренный rowid)
+        
+        Меняются только строки, где номер действительно другой: правка заявки
+        попадает в журнал изменений и уходит в Google Sheets.
+        """
+        def batch(cursor: sqlite3.Cursor, position: Optional[int], batch_size: int) -> Optional[int]:
+            cursor.execute(
+                f'SELECT rowid, phone FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?', (position or 0, batch_size)
+            )
+            rows = cursor.fetchall()
+            changed = [(renormalized(phone), rowid) for rowid, phone in rows if renormalized(phone) != phone]
+            if changed:
+                cursor.executemany(f'UPDATE {table} SET phone = ? WHERE rowid = ?', changed)
+            if len(rows) < batch_size:
+                self.request_cache.clear()
+                return None
+            return rows[-1][0]
+        
+        return batch
+    
+    def run_migration_backfills(self, stop: threading.Event = None) -> int:
+        """🐢 Фоновые шаги миграций пачками, с сохранением позиции после каждой пачки"""
+        return self.migrator.run_backfills(Config.MIGRATION_BATCH_SIZE, Config.MIGRATION_BATCH_PAUSE, stop)
+    
+    @db_timed
+    def archive_completed(self, older_than_days: int, batch_size: int = 500) -> int:
+        """🗄️ Переносит выполненные заявки старше N дней вместе с медиа в архив, пачками"""
+        cutoff = epoch(datetime.now() - timedelta(days=older_than_days))
+        archived = 0
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            columns = {}
+            for table in ('requests', 'request_media'):
+                cursor.execute(f'PRAGMA table_info({table})')
+                columns[table] = ', '.join(row[1] for row in cursor.fetchall())
             
-            conn.commit()
+            while True:
+                cursor.execute('''
+                    SELECT id FROM requests
+                    WHERE status = 'completed' AND completed_ts < ?
+                    ORDER BY id LIMIT ?
+                ''', (cutoff, batch_size))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                
+                # Одна пачка - одна транзакция: копия в архив, итоги, удаление из рабочих таблиц
+                placeholders = ','.join('?' * len(ids))
+                cursor.execute(f'''
+                    INSERT OR REPLACE INTO requests_archive ({columns['requests']})
+                    SELECT {columns['requests']} FROM requests WHERE id IN ({placeholders})
+                ''', ids)
+                cursor.execute(f'''
+                    INSERT OR REPLACE INTO request_media_archive ({columns['request_media']})
+                    SELECT {columns['request_media']} FROM request_media WHERE request_id IN ({placeholders})
+                ''', ids)
+                cursor.execute(f'''
+                    UPDATE archive_summary SET
+                        total = total + ?,
+                        rating_sum = rating_sum + (SELECT COALESCE(SUM(user_rating), 0) FROM requests
+                                                   WHERE id IN ({placeholders}) AND user_rating > 0),
+                        rating_count = rating_count + (SELECT COUNT(*) FROM requests
+                                                       WHERE id IN ({placeholders}) AND user_rating > 0)
+                    WHERE id = 1
+                ''', [len(ids)] + ids + ids)
+                cursor.execute(f'DELETE FROM request_media WHERE request_id IN ({placeholders})', ids)
+                cursor.execute(f'DELETE FROM incident_notifications WHERE request_id IN ({placeholders})', ids)
+                cursor.execute(f'DELETE FROM requests WHERE id IN ({placeholders})', ids)
+                conn.commit()
+                self.request_cache.invalidate(*ids)
+                self.media_cache.invalidate(*ids)
+                archived += len(ids)
+        
+        if archived:
+            logger.info(f"🗄️ В архив перенесено заявок: {archived}")
+        return archived
     
+    @db_timed
     def backup_database(self):
         """💾 Создает резервную копию базы данных"""
         backup_name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
@@ -271,7 +1822,7 @@ class EnhancedDatabase:
         
         try:
             # Используем SQLite backup API
-            with sqlite3.connect(self.db_path) as source:
+            with self._connect() as source:
                 with sqlite3.connect(backup_path) as target:
                     source.backup(target)
             
@@ -305,27 +1856,32 @@ class EnhancedDatabase:
         except Exception as e:
             logger.error(f"❌ Ошибка очистки бэкапов: {e}")
     
+    @db_timed
     def add_request(self, user_id: int, username: str, phone: str, problem: str, 
-                   photo_id: str = None, urgency: str = '💤 НЕ СРОЧНО') -> int:
+                   photo_id: str = None, urgency: str = '💤 НЕ СРОЧНО', incident_id: int = None) -> int:
         """📝 Добавляет новую заявку"""
-        with sqlite3.connect(self.db_path) as conn:
+        now = datetime.now()
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO requests 
-                (user_id, username, phone, problem, photo_id, urgency, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, username, phone, problem, photo_id, urgency, datetime.now().isoformat()))
+                (user_id, username, phone, problem, photo_id, urgency, created_at, created_ts, incident_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, username, phone, problem, photo_id, urgency, now.isoformat(), epoch(now), incident_id))
             request_id = cursor.lastrowid
             conn.commit()
             
             # Обновляем информацию о пользователе
             self.update_user_info(user_id, username, phone)
-            
-            return request_id
+        
+        self._notify([request_id])
+        return request_id
     
+    @db_timed
     def update_user_info(self, user_id: int, username: str, phone: str = None):
         """👤 Обновляет информацию о пользователе"""
-        with sqlite3.connect(self.db_path) as conn:
+        now = datetime.now()
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             # Проверяем существование пользователя
@@ -333,45 +1889,88 @@ class EnhancedDatabase:
             exists = cursor.fetchone()
             
             if exists:
+                # Телефон из последней заявки - его предложит следующая (PHONE_PREFILL)
                 cursor.execute('''
                     UPDATE users 
-                    SET username = ?, last_activity = ?
+                    SET username = ?, phone = COALESCE(?, phone), last_activity = ?, last_activity_ts = ?
                     WHERE user_id = ?
-                ''', (username, datetime.now().isoformat(), user_id))
+                ''', (username, phone, now.isoformat(), epoch(now), user_id))
             else:
                 cursor.execute('''
                     INSERT INTO users 
-                    (user_id, username, full_name, phone, created_at, last_activity)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (user_id, username, username, phone, datetime.now().isoformat(), datetime.now().isoformat()))
+                    (user_id, username, full_name, phone, created_at, last_activity, last_activity_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, username, username, phone, now.isoformat(), now.isoformat(), epoch(now)))
             
             conn.commit()
     
-    def add_media_to_request(self, request_id: int, file_id: str, file_type: str, file_name: str = None):
-        """📎 Добавляет медиа файл к заявке"""
-        with sqlite3.connect(self.db_path) as conn:
+    @db_timed
+    def get_user_phone(self, user_id: int) -> Optional[str]:
+        """📞 Телефон пользователя из последней заявки"""
+        with self._connect() as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO request_media (request_id, file_id, file_type, file_name, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (request_id, file_id, file_type, file_name, datetime.now().isoformat()))
+            cursor.execute('SELECT phone FROM users WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+    
+    @db_timed
+    def add_media_to_request(self, request_id: int, media_files: List[Dict]) -> int:
+        """📎 Добавляет медиа файлы к заявке одной транзакцией, возвращает число сохраненных
+        
+        Файл, уже приложенный к заявке (тот же file_unique_id), повторно не сохраняется.
+        """
+        if not media_files:
+            return 0
+        created_at = datetime.now().isoformat()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            before = conn.total_changes
+            cursor.executemany('''
+                INSERT OR IGNORE INTO request_media
+                    (request_id, file_id, file_type, file_name, file_unique_id, file_size, mime_type, duration, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (request_id, media['file_id'], media['file_type'], media.get('file_name'), media.get('file_unique_id'),
+                 media.get('file_size'), media.get('mime_type'), media.get('duration'), created_at)
+                for media in media_files
+            ])
+            stored = conn.total_changes - before
             conn.commit()
+        self.media_cache.invalidate(request_id)
+        return stored
     
+    @db_timed
     def get_request_media(self, request_id: int) -> List[Dict]:
         """📂 Получает медиа файлы заявки"""
-        with sqlite3.connect(self.db_path) as conn:
+        found, media, generation = self.media_cache.get(request_id)
+        if found:
+            return [dict(item) for item in media]
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT * FROM request_media 
                 WHERE request_id = ? 
                 ORDER BY created_at
             ''', (request_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                # Медиа заявок, перенесенных в архив
+                cursor.execute('''
+                    SELECT * FROM request_media_archive
+                    WHERE request_id = ?
+                    ORDER BY created_at
+                ''', (request_id,))
+                rows = cursor.fetchall()
             columns = [column[0] for column in cursor.description]
-            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            media = [dict(zip(columns, row)) for row in rows]
+        self.media_cache.put(request_id, media, generation)
+        return [dict(item) for item in media]
     
+    @db_timed
     def update_admin_comment(self, request_id: int, comment: str):
         """💬 Обновляет комментарий администратора"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE requests 
@@ -379,10 +1978,12 @@ class EnhancedDatabase:
                 WHERE id = ?
             ''', (comment, request_id))
             conn.commit()
+        self.request_cache.invalidate(request_id)
     
+    @db_timed
     def get_requests(self, status: str = None, limit: int = 50, user_id: int = None) -> List[Dict]:
         """📋 Получает список заявок"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             query = "SELECT * FROM requests WHERE 1=1"
             params = []
@@ -395,41 +1996,53 @@ class EnhancedDatabase:
                 query += " AND user_id = ?"
                 params.append(user_id)
             
-            query += " ORDER BY created_at DESC LIMIT ?"
+            query += " ORDER BY created_ts DESC, id DESC LIMIT ?"
             params.append(limit)
             
             cursor.execute(query, params)
             columns = [column[0] for column in cursor.description]
             return [dict(zip(columns, row)) for row in cursor.fetchall()]
     
+    @db_timed
     def get_request(self, request_id: int) -> Optional[Dict]:
         """🔍 Получает заявку по ID"""
-        with sqlite3.connect(self.db_path) as conn:
+        found, request, generation = self.request_cache.get(request_id)
+        if found:
+            return dict(request)
+        
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT * FROM requests WHERE id = ?', (request_id,))
             row = cursor.fetchone()
-            if row:
-                columns = [column[0] for column in cursor.description]
-                return dict(zip(columns, row))
-            return None
+            if row is None:
+                cursor.execute('SELECT * FROM requests_archive WHERE id = ?', (request_id,))
+                row = cursor.fetchone()
+            if not row:
+                return None
+            columns = [column[0] for column in cursor.description]
+            request = dict(zip(columns, row))
+        self.request_cache.put(request_id, request, generation)
+        return dict(request)
     
+    @db_timed
     def update_request_status(self, request_id: int, status: str, admin_name: str = None):
         """🔄 Обновляет статус заявки"""
-        with sqlite3.connect(self.db_path) as conn:
+        now = datetime.now()
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             if status == 'in_progress' and admin_name:
                 cursor.execute('''
                     UPDATE requests 
-                    SET status = ?, assigned_at = ?, assigned_admin = ?
+                    SET status = ?, assigned_at = ?, assigned_ts = ?, assigned_admin = ?
                     WHERE id = ?
-                ''', (status, datetime.now().isoformat(), admin_name, request_id))
+                ''', (status, now.isoformat(), epoch(now), admin_name, request_id))
             elif status == 'completed':
                 cursor.execute('''
                     UPDATE requests 
-                    SET status = ?, completed_at = ?
+                    SET status = ?, completed_at = ?, completed_ts = ?
                     WHERE id = ?
-                ''', (status, datetime.now().isoformat(), request_id))
+                ''', (status, now.isoformat(), epoch(now), request_id))
             else:
                 cursor.execute('''
                     UPDATE requests 
@@ -438,14 +2051,30 @@ class EnhancedDatabase:
                 ''', (status, request_id))
             
             conn.commit()
+        self.request_cache.invalidate(request_id)
+        self._notify([request_id])
     
+    @db_timed
     def get_user_requests(self, user_id: int) -> List[Dict]:
-        """📂 Получает заявки пользователя"""
-        return self.get_requests(user_id=user_id, limit=100)
+        """📂 Получает заявки пользователя (при нехватке - дополняет из архива)"""
+        limit = 100
+        requests = self.get_requests(user_id=user_id, limit=limit)
+        if len(requests) < limit:
+            with self._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM requests_archive WHERE user_id = ?
+                    ORDER BY created_ts DESC, id DESC LIMIT ?
+                ''', (user_id, limit - len(requests)))
+                columns = [column[0] for column in cursor.description]
+                requests += [dict(zip(columns, row)) for row in cursor.fetchall()]
+            requests.sort(key=lambda request: (request['created_ts'] or 0, request['id']), reverse=True)
+        return requests
     
+    @db_timed
     def get_statistics(self) -> Dict[str, Any]:
         """📊 Получает статистику"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             # Общая статистика
@@ -460,77 +2089,439 @@ class EnhancedDatabase:
             stats = cursor.fetchone()
             
             # Статистика за сегодня
-            today = datetime.now().strftime('%Y-%m-%d')
+            today = datetime.combine(datetime.now().date(), time())
             cursor.execute('''
                 SELECT COUNT(*) FROM requests 
-                WHERE DATE(created_at) = ? AND status = 'completed'
-            ''', (today,))
+                WHERE status = 'completed' AND created_ts >= ? AND created_ts < ?
+            ''', (epoch(today), epoch(today + timedelta(days=1))))
             completed_today = cursor.fetchone()[0]
             
+            # Архивные заявки все выполнены и старше сегодняшнего дня - хватает итогов
+            cursor.execute('SELECT total, rating_sum, rating_count FROM archive_summary WHERE id = 1')
+            archived, archived_rating_sum, archived_rating_count = cursor.fetchone() or (0, 0, 0)
+            stats = (stats[0] + archived, stats[1] or 0, stats[2] or 0, (stats[3] or 0) + archived)
+            
             # Средняя оценка
             cursor.execute('''
-                SELECT AVG(user_rating) FROM requests 
-                WHERE user_rating > 0
-            ''')
-            avg_rating = cursor.fetchone()[0] or 0
-            
-            # Статистика пользователей
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            # Активные пользователи (за последние 30 дней)
-            month_ago = (datetime.now() - timedelta(days=30)).isoformat()
-            cursor.execute('SELECT COUNT(*) FROM users WHERE last_activity > ?', (month_ago,))
-            active_users = cursor.fetchone()[0]
+                SELECT COALESCE(SUM(user_rating), 0), COUNT(*) FROM requests 
+                WHERE user_rating > 0
+            ''')
+            rating_sum, rating_count = cursor.fetchone()
+            rating_count += archived_rating_count
+            avg_rating = (rating_sum + archived_rating_sum) / rating_count if rating_count else 0
+            
+            # Статистика пользователей
+            cursor.execute('SELECT COUNT(*) FROM users')
+            total_users = cursor.fetchone()[0]
+            
+            # Активные пользователи (за последние 30 дней)
+            month_ago = epoch(datetime.now() - timedelta(days=30))
+            cursor.execute('SELECT COUNT(*) FROM users WHERE last_activity_ts > ?', (month_ago,))
+            active_users = cursor.fetchone()[0]
+            
+            return {
+                'total': stats[0],
+                'new': stats[1],
+                'in_progress': stats[2],
+                'completed': stats[3],
+                'completed_today': completed_today,
+                'avg_rating': round(avg_rating, 1),
+                'efficiency': round((stats[3] / stats[0] * 100), 1) if stats[0] > 0 else 0,
+                'total_users': total_users,
+                'active_users': active_users
+            }
+    
+    @db_timed
+    def add_user_feedback(self, request_id: int, rating: int, feedback: str = "") -> bool:
+        """⭐ Добавляет отзыв пользователя (заявка могла уже уйти в архив); False - заявки нет"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE requests 
+                SET user_rating = ?, user_feedback = ?
+                WHERE id = ?
+            ''', (rating, feedback, request_id))
+            if not cursor.rowcount:
+                cursor.execute('SELECT user_rating FROM requests_archive WHERE id = ?', (request_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return False
+                previous = row[0] or 0
+                cursor.execute(
+                    'UPDATE requests_archive SET user_rating = ?, user_feedback = ? WHERE id = ?',
+                    (rating, feedback, request_id)
+                )
+                # Итоги архива учитывают только оценки > 0: повторная оценка заменяет прежнюю
+                cursor.execute('''
+                    UPDATE archive_summary SET
+                        rating_sum = rating_sum + ? - ?,
+                        rating_count = rating_count + ?
+                    WHERE id = 1
+                ''', (max(rating, 0), max(previous, 0), int(rating > 0) - int(previous > 0)))
+                # Архив не покрыт триггерами - отчеты и графики пересчитываются по версии вручную
+                cursor.execute("UPDATE cache_versions SET version = version + 1 WHERE scope = 'requests'")
+            conn.commit()
+        self.request_cache.invalidate(request_id)
+        return True
+
+    @db_timed
+    def get_requests_by_ids(self, request_ids: List[int]) -> List[Dict]:
+        """📋 Заявки по списку ID (с числом привязанных дубликатов) одним запросом"""
+        if not request_ids:
+            return []
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(request_ids))
+            cursor.execute(f'''
+                SELECT r.*, (SELECT COUNT(*) FROM requests c WHERE c.incident_id = r.id) AS duplicates
+                FROM requests r
+                WHERE r.id IN ({placeholders})
+                ORDER BY r.id
+            ''', list(request_ids))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @db_timed
+    def get_change_seq(self) -> int:
+        """📝 Текущая позиция журнала изменений заявок"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM request_changes').fetchone()[0]
+    
+    @db_timed
+    def get_changes_since(self, seq: int) -> Tuple[int, List[Dict]]:
+        """📝 Заявки, измененные после позиции seq: (новая позиция, заявки)"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.seq, r.id, r.problem, r.created_at, r.created_ts, r.status, r.incident_id
+                FROM request_changes c LEFT JOIN requests r ON r.id = c.request_id
+                WHERE c.seq > ?
+                ORDER BY c.seq
+            ''', (seq,))
+            rows = cursor.fetchall()
+            if not rows:
+                return seq, []
+            columns = [column[0] for column in cursor.description[1:]]
+            # Заявки, уже перенесенные в архив, пропускаем, но позицию сдвигаем
+            return rows[-1][0], [dict(zip(columns, row[1:])) for row in rows if row[1] is not None]
+    
+    @db_timed
+    def get_queue_counts(self) -> Dict[str, int]:
+        """📊 Число новых заявок и заявок в работе"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT status, COUNT(*) FROM requests
+                WHERE status IN ('new', 'in_progress')
+                GROUP BY status
+            ''')
+            counts = {'new': 0, 'in_progress': 0}
+            counts.update(cursor.fetchall())
+            return counts
+    
+    @db_timed
+    def get_admin_boards(self) -> Dict[int, int]:
+        """📌 Доски очереди: ID администратора -> ID сообщения"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT admin_id, message_id FROM admin_boards')
+            return dict(cursor.fetchall())
+    
+    @db_timed
+    def set_admin_board(self, admin_id: int, message_id: int):
+        """📌 Запоминает сообщение доски администратора"""
+        with self._connect() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO admin_boards (admin_id, message_id, created_at) VALUES (?, ?, ?)
+            ''', (admin_id, message_id, datetime.now().isoformat()))
+            conn.commit()
+    
+    @db_timed
+    def delete_admin_board(self, admin_id: int, message_id: int = None) -> Optional[int]:
+        """🗑️ Убирает доску (если задан message_id - только это сообщение), возвращает ID сообщения"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT message_id FROM admin_boards WHERE admin_id = ?', (admin_id,))
+            row = cursor.fetchone()
+            if row is None or (message_id is not None and row[0] != message_id):
+                return None
+            cursor.execute('DELETE FROM admin_boards WHERE admin_id = ?', (admin_id,))
+            conn.commit()
+            return row[0]
+    
+    @db_timed
+    def get_incident_notifications(self, request_id: int, kind: str = 'incident') -> Dict[int, int]:
+        """🔁 Уведомления об инциденте: ID администратора -> ID сообщения"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT admin_id, message_id FROM incident_notifications WHERE request_id = ? AND kind = ?',
+                (request_id, kind)
+            )
+            return dict(cursor.fetchall())
+    
+    @db_timed
+    def add_incident_notifications(self, request_id: int, messages: Dict[int, int], kind: str = 'incident'):
+        """🔁 Запоминает сообщения с уведомлениями об инциденте"""
+        if not messages:
+            return
+        with self._connect() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO incident_notifications (request_id, admin_id, message_id, kind)
+                VALUES (?, ?, ?, ?)
+            ''', [(request_id, admin_id, message_id, kind) for admin_id, message_id in messages.items()])
+            conn.commit()
+    
+    @db_timed
+    def delete_incident_notifications(self, request_id: int):
+        """🗑️ Забывает уведомления об инциденте (он устранен)"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM incident_notifications WHERE request_id = ?', (request_id,))
+            conn.commit()
+    
+    @db_timed
+    def get_data_version(self, scope: str) -> int:
+        """🔢 Текущая версия данных (меняется при каждом изменении)"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM cache_versions WHERE scope = ?', (scope,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+    
+    @db_timed
+    def get_sla_rows(self) -> List[Tuple]:
+        """⏱️ Колонки для SLA-аналитики (время в секундах Unix)"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            from analytics import SLA_ROWS_SQL
+            cursor.execute(SLA_ROWS_SQL)
+            return cursor.fetchall()
+    
+    @db_timed
+    def get_incident_roots(self, since: datetime) -> List[Dict]:
+        """🧲 Открытые заявки, которые могут стать родителями инцидента"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            # «+» не дает выбрать индекс incident_id (NULL почти у всех заявок): окно ищется по created_ts
+            cursor.execute('''
+                SELECT id, problem, created_at FROM requests
+                WHERE created_ts >= ? AND status != 'completed' AND +incident_id IS NULL
+                ORDER BY created_ts
+            ''', (epoch(since),))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @db_timed
+    def get_incident_requests(self, incident_id: int) -> List[Dict]:
+        """🔁 Заявки, привязанные к инциденту"""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM requests WHERE incident_id = ? ORDER BY id', (incident_id,))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @db_timed
+    def take_incident(self, incident_id: int, admin_name: str) -> List[Dict]:
+        """👨‍💼 Берет в работу все новые заявки инцидента, возвращает взятые"""
+        now = datetime.now()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM requests
+                WHERE (id = ? OR incident_id = ?) AND status = 'new'
+                ORDER BY id
+            ''', (incident_id, incident_id))
+            columns = [column[0] for column in cursor.description]
+            taken = [dict(zip(columns, row)) for row in cursor.fetchall()]
             
-            return {
-                'total': stats[0],
-                'new': stats[1],
-                'in_progress': stats[2],
-                'completed': stats[3],
-                'completed_today': completed_today,
-                'avg_rating': round(avg_rating, 1),
-                'efficiency': round((stats[3] / stats[0] * 100), 1) if stats[0] > 0 else 0,
-                'total_users': total_users,
-                'active_users': active_users
-            }
+            cursor.executemany('''
+                UPDATE requests
+                SET status = 'in_progress', assigned_at = ?, assigned_ts = ?, assigned_admin = ?
+                WHERE id = ? AND status = 'new'
+            ''', [(now.isoformat(), epoch(now), admin_name, request['id']) for request in taken])
+            conn.commit()
+        self.request_cache.invalidate(*(request['id'] for request in taken))
+        if taken:
+            self._notify([request['id'] for request in taken])
+        return taken
     
-    def add_user_feedback(self, request_id: int, rating: int, feedback: str = ""):
-        """⭐ Добавляет отзыв пользователя"""
-        with sqlite3.connect(self.db_path) as conn:
+    @db_timed
+    def get_open_incident_requests(self, incident_id: int, admin_name: str) -> List[Dict]:
+        """🔁 Заявки инцидента, которые может закрыть администратор: новые и взятые им самим"""
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                UPDATE requests 
-                SET user_rating = ?, user_feedback = ?
-                WHERE id = ?
-            ''', (rating, feedback, request_id))
+                SELECT * FROM requests
+                WHERE incident_id = ? AND (status = 'new' OR (status = 'in_progress' AND assigned_admin = ?))
+                ORDER BY id
+            ''', (incident_id, admin_name))
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    @db_timed
+    def complete_incident(self, incident_id: int, comment: str, admin_name: str) -> List[Dict]:
+        """✅ Завершает заявки инцидента от имени администратора, возвращает завершенные
+        
+        Закрываются только новые заявки (исполнителем становится этот администратор)
+        и уже взятые им самим; заявки, которые взяли другие администраторы, остаются.
+        """
+        now = datetime.now()
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT * FROM requests
+                WHERE incident_id = ? AND (status = 'new' OR (status = 'in_progress' AND assigned_admin = ?))
+                ORDER BY id
+            ''', (incident_id, admin_name))
+            columns = [column[0] for column in cursor.description]
+            completed = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            
+            cursor.executemany('''
+                UPDATE requests
+                SET status = 'completed', completed_at = ?, completed_ts = ?, admin_comment = ?,
+                    assigned_admin = COALESCE(assigned_admin, ?),
+                    assigned_at = COALESCE(assigned_at, ?), assigned_ts = COALESCE(assigned_ts, ?)
+                WHERE id = ? AND (status = 'new' OR (status = 'in_progress' AND assigned_admin = ?))
+            ''', [
+                (now.isoformat(), epoch(now), comment, admin_name, now.isoformat(), epoch(now), request['id'], admin_name)
+                for request in completed
+            ])
             conn.commit()
+        self.request_cache.invalidate(*(request['id'] for request in completed))
+        if completed:
+            self._notify([request['id'] for request in completed])
+        return completed
+    
+    @db_timed
+    def search_requests(self, text: str, status: str = None, since: datetime = None,
+                        limit: int = 10, offset: int = 0) -> Tuple[List[Dict], bool, bool]:
+        """🔎 Полнотекстовый поиск: (страница заявок по релевантности, есть ли следующая,
+        ранжированы ли только SEARCH_CANDIDATES самых свежих совпадений из большего числа)"""
+        match = build_fts_query(text)
+        if not match:
+            return [], False, False
+        
+        # Ранжируем только SEARCH_CANDIDATES самых свежих совпадений: на частых словах
+        # bm25 по всей таблице стоит десятки миллисекунд, а старые заявки ищут редко
+        candidates = '''
+            SELECT f.rowid AS id, bm25(requests_fts, 3.0, 1.0, 1.0) AS score
+            FROM requests_fts f
+        '''
+        params: List[Any] = []
+        if status:
+            candidates += " JOIN requests s ON s.id = f.rowid AND s.status = ?"
+            params.append(status)
+        candidates += " WHERE requests_fts MATCH ?"
+        params.append(match)
+        
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            if since:
+                # ID растут вместе с датой создания - период превращается в диапазон rowid
+                cursor.execute('SELECT MIN(id) FROM requests WHERE created_ts >= ?', (epoch(since),))
+                min_id = cursor.fetchone()[0]
+                if min_id is None:
+                    return [], False, False
+                candidates += " AND f.rowid >= ?"
+                params.append(min_id)
+            # На одно совпадение больше лимита - чтобы знать, что более старые совпадения отброшены
+            candidates += " ORDER BY f.rowid DESC LIMIT ?"
+            params.append(Config.SEARCH_CANDIDATES + 1)
+            
+            # Совпадение в описании проблемы весит больше, чем в комментарии или отзыве
+            cursor.execute(f'''
+                WITH found AS MATERIALIZED ({candidates}),
+                     ranked AS (SELECT * FROM found ORDER BY id DESC LIMIT ?)
+                SELECT r.id, r.status, r.username, r.created_at, r.assigned_admin,
+                       r.problem, r.admin_comment, r.user_feedback,
+                       (SELECT COUNT(*) FROM found) AS found_count
+                FROM ranked c
+                JOIN requests r ON r.id = c.id
+                ORDER BY c.score
+                LIMIT ? OFFSET ?
+            ''', params + [Config.SEARCH_CANDIDATES, limit + 1, offset])
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        truncated = bool(rows) and rows[0].pop('found_count') > Config.SEARCH_CANDIDATES
+        for row in rows:
+            row.pop('found_count', None)
+        
+        # Фрагмент строим сами: snippet() FTS5 на каждую строку дороже всего запроса
+        for row in rows:
+            row['snippet'] = make_snippet(text, row['problem'], row['admin_comment'], row['user_feedback'])
+        return rows[:limit], len(rows) > limit, truncated
 
 # ==================== УТИЛИТЫ ====================
 
+_FTS_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def truncate_lines(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> str:
+    """✂️ Обрезает текст по границе строки: теги и HTML-сущности не разрываются, если каждый закрыт в своей строке"""
+    if len(text) <= limit:
+        return text
+    marker = "\n…"
+    cut = text.rfind('\n', 0, limit - len(marker) + 1)
+    return text[:max(cut, 0)] + marker
+
+def read_file_bytes(path: str) -> bytes:
+    """📄 Содержимое файла (блокирующее чтение, вызывается через asyncio.to_thread)"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def build_fts_query(text: str) -> str:
+    """🔎 Превращает ввод пользователя в безопасный запрос FTS5 (все слова, поиск по префиксу)"""
+    tokens = _FTS_TOKEN_RE.findall(text.lower())
+    return ' '.join(f'"{token}"*' for token in tokens[:10])
+
+SEARCH_PERIODS = {
+    'день': timedelta(days=1), 'сегодня': timedelta(days=1),
+    'неделя': timedelta(days=7), 'месяц': timedelta(days=31), 'год': timedelta(days=365),
+}
+SEARCH_STATUSES = {
+    'новые': 'new', 'new': 'new',
+    'вработе': 'in_progress', 'in_progress': 'in_progress',
+    'выполненные': 'completed', 'completed': 'completed',
+}
+
+def parse_search_query(raw: str) -> Tuple[str, Optional[str], Optional[datetime]]:
+    """🧩 Разбирает фильтры период:месяц и статус:новые, остальное - текст поиска"""
+    words, status, since = [], None, None
+    for word in raw.split():
+        key, _, value = word.partition(':')
+        if key.lower() == 'период' and value.lower() in SEARCH_PERIODS:
+            since = datetime.now() - SEARCH_PERIODS[value.lower()]
+        elif key.lower() == 'статус' and value.lower() in SEARCH_STATUSES:
+            status = SEARCH_STATUSES[value.lower()]
+        else:
+            words.append(word)
+    return ' '.join(words), status, since
+
+def make_snippet(text: str, *fields: Optional[str], width: int = 12) -> str:
+    """✂️ Фрагмент первого поля с совпадением: найденные слова в маркерах \\x02...\\x03"""
+    tokens = _FTS_TOKEN_RE.findall(text.lower())[:10]
+    
+    def is_hit(word: str) -> bool:
+        return any(part.startswith(token) for part in _FTS_TOKEN_RE.findall(word.lower()) for token in tokens)
+    
+    for field in fields:
+        words = (field or '').split()
+        hit = next((i for i, word in enumerate(words) if is_hit(word)), None)
+        if hit is None:
+            continue
+        start = max(0, hit - width // 3)
+        window = [f'\x02{word}\x03' if is_hit(word) else word for word in words[start:start + width]]
+        return ('…' if start else '') + ' '.join(window) + ('…' if start + width < len(words) else '')
+    
+    words = (fields[0] or '').split() if fields else []
+    return ' '.join(words[:width]) + ('…' if len(words) > width else '')
+
+def format_snippet(snippet: str) -> str:
+    """✂️ Экранирует фрагмент для HTML и выделяет найденные слова"""
+    return html.escape(snippet or '').replace('\x02', '<b>').replace('\x03', '</b>')
+
 def validate_phone_number(phone: str) -> Tuple[bool, str]:
-    """📞 Валидация номера телефона"""
-    try:
-        # Пробуем использовать библиотеку phonenumbers для российских номеров
-        parsed = phonenumbers.parse(phone, "RU")
-        if phonenumbers.is_valid_number(parsed):
-            formatted = phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
-            return True, formatted
-        return False, "Неверный номер телефона"
-    except NumberParseException:
-        # Простая валидация для российских номеров
-        cleaned = re.sub(r'[^\d+]', '', phone)
-        
-        if cleaned.startswith('+7') and len(cleaned) == 12:
-            return True, cleaned
-        elif cleaned.startswith('8') and len(cleaned) == 11:
-            return True, '+7' + cleaned[1:]
-        elif len(cleaned) == 10:
-            return True, '+7' + cleaned
-        elif len(cleaned) == 11 and cleaned.startswith('7'):
-            return True, '+' + cleaned
-        
-        return False, "Неверный формат номера. Используйте российский номер"
+    """📞 Валидация номера телефона: (True, номер в E.164) или (False, текст ошибки)"""
+    return normalize_phone(phone)
 
 def signal_handler(signum, frame):
     """🛑 Обработчик сигналов для graceful shutdown"""
@@ -540,8 +2531,73 @@ def signal_handler(signum, frame):
 
 # ==================== ИНИЦИАЛИЗАЦИЯ ====================
 
-# Инициализация базы данных
-db = EnhancedDatabase(Config.DB_PATH)
+# База, журнал запросов и запись обновлений создаются в init_bot()
+db: Optional[EnhancedDatabase] = None
+media_store: Optional[MediaStore] = None
+
+def init_bot(record_updates: bool = True) -> None:
+    """🚀 Инициализация при запуске, а не при импорте: .env, логи, база с миграциями
+    
+    Импорт модуля ничего не создает и не читает окружение, поэтому быстр
+    (в том числе для процессов-воркеров и инструментов). Повторный вызов
+    ничего не делает.
+    """
+    global db, query_stats, update_recorder, media_store
+    if db is not None:
+        return
+    load_dotenv()
+    setup_logging()
+    query_stats = QueryStats(Config.SLOW_QUERY_MS, Config.N_PLUS_ONE_QUERIES)
+    if record_updates and Config.RECORD_UPDATES_PATH:
+        update_recorder = UpdateRecorder(
+            Config.RECORD_UPDATES_PATH, keep_text=Config.RECORD_KEEP_TEXT, salt=Config.RECORD_SALT
+        )
+    db = EnhancedDatabase(Config.DB_PATH)
+    if Config.MEDIA_STORE_DIR:
+        media_store = MediaStore(
+            Config.MEDIA_STORE_DIR, Config.MEDIA_STORE_MAX_MB * 1024 * 1024,
+            concurrency=Config.MEDIA_STORE_CONCURRENCY, verify=tls_context()
+        )
+
+# SLA-аналитика и графики создаются при первом обращении (тянут NumPy и matplotlib)
+sla_analytics = None
+chart_service = None
+
+# Готовые тексты списков заявок по ключу (вид, фильтр, версия данных)
+list_page_cache = RecordCache('list_page', Config.LIST_PAGE_CACHE_SIZE, Config.LIST_PAGE_CACHE_TTL)
+
+class SharedStateSync:
+    """🔄 Режим воркеров: изменения заявок, сделанные другими процессами
+    
+    Кэши заявок и индекс инцидентов живут в памяти процесса. Перед каждым
+    обновлением воркер дочитывает журнал request_changes с прошлой позиции
+    (запрос по первичному ключу, обычно пустой): сбрасывает кэш измененных
+    заявок и дополняет индекс инцидентов заявками из других чатов.
+    """
+    
+    def __init__(self):
+        self.seq = db.get_change_seq()
+    
+    def sync(self):
+        self.seq, changed = db.get_changes_since(self.seq)
+        if not changed:
+            return
+        ids = [request['id'] for request in changed]
+        db.request_cache.invalidate(*ids)
+        db.media_cache.invalidate(*ids)
+        if not incident_index.loaded:
+            return
+        
+        deadline = epoch(datetime.now() - incident_index.window)
+        for request in changed:
+            if request['status'] == 'completed' or request['incident_id'] is not None:
+                incident_index.remove(request['id'])
+            elif request['id'] not in incident_index and (request['created_ts'] or 0) >= deadline:
+                incident_index.add(request['id'], request['problem'], datetime.fromisoformat(request['created_at']))
+
+# Номер воркера и синхронизация состояния (задаются в worker_main, в одном процессе - None)
+worker_index = None
+shared_state = None
 
 # ==================== УЛУЧШЕННЫЕ КОМАНДЫ БОТА ====================
 
@@ -632,12 +2688,17 @@ async def new_request_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     }
     
     keyboard = [["🔙 Главное меню"]]
+    hint = "💡 *Пример:* +7 (XXX) XXX-XX-XX или 8 (XXX) XXX-XX-XX"
+    phone = db.get_user_phone(user.id) if Config.PHONE_PREFILL else None
+    if phone:
+        keyboard.insert(0, [phone])
+        hint = f"💡 Или нажмите кнопку с номером из прошлой заявки: {phone}"
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
     await update.message.reply_text(
         "📋 *Создание новой заявки*\n\n"
         "📞 Пожалуйста, введите ваш номер телефона для связи:\n\n"
-        "💡 *Пример:* +7 (XXX) XXX-XX-XX или 8 (XXX) XXX-XX-XX",
+        f"{hint}",
         reply_markup=reply_markup,
         parse_mode=ParseMode.MARKDOWN
     )
@@ -721,11 +2782,7 @@ async def request_problem(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     context.user_data['request']['problem'] = problem
     
-    keyboard = [
-        ["📎 Прикрепить фото/видео", "✅ Завершить без медиа"],
-        ["🔙 Назад", "🔙 Главное меню"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    reply_markup = media_step_keyboard(context.user_data['request'])
     
     await update.message.reply_text(
         "📎 *Хотите прикрепить фото или видео к заявке?*\n\n"
@@ -741,6 +2798,19 @@ async def request_problem(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     return REQUEST_MEDIA
 
+URGENCY_URGENT = '🔥 СРОЧНО'
+URGENCY_NORMAL = '💤 НЕ СРОЧНО'
+
+def media_step_keyboard(request_data: Dict) -> ReplyKeyboardMarkup:
+    """⌨️ Клавиатура шага вложений с переключателем срочности"""
+    if request_data.get('media_files'):
+        first_row = ["📎 Прикрепить еще", "✅ Завершить создание"]
+    else:
+        first_row = ["📎 Прикрепить фото/видео", "✅ Завершить без медиа"]
+    urgency_button = "💤 Снять срочность" if request_data.get('urgency') == URGENCY_URGENT else "🔥 Отметить как срочную"
+    keyboard = [first_row, [urgency_button], ["🔙 Назад", "🔙 Главное меню"]]
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """📎 Обрабатывает медиа файлы"""
     message = update.message
@@ -760,9 +2830,18 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
             parse_mode=ParseMode.MARKDOWN
         )
         return REQUEST_PROBLEM
-    elif text == "✅ Завершить без медиа":
+    elif text in ("✅ Завершить без медиа", "✅ Завершить создание"):
         return await create_request_final(update, context)
-    elif text == "📎 Прикрепить фото/видео":
+    elif text in ("🔥 Отметить как срочную", "💤 Снять срочность"):
+        urgent = text == "🔥 Отметить как срочную"
+        context.user_data['request']['urgency'] = URGENCY_URGENT if urgent else URGENCY_NORMAL
+        await update.message.reply_text(
+            "🔥 Заявка будет отмечена как срочная - администраторы получат уведомление в первую очередь."
+            if urgent else "💤 Срочность снята.",
+            reply_markup=media_step_keyboard(context.user_data['request'])
+        )
+        return REQUEST_MEDIA
+    elif text in ("📎 Прикрепить фото/видео", "📎 Прикрепить еще"):
         await update.message.reply_text(
             "📎 Отправьте фото, видео, документ или голосовое сообщение:"
         )
@@ -797,8 +2876,16 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         return REQUEST_MEDIA
     
     if file_info:
-        # Проверяем лимит медиа файлов
         media_files = context.user_data['request'].get('media_files', [])
+        # Повторно отправленный файл (тот же скриншот) не занимает место в лимите
+        if any(media.get('file_unique_id') == file_info.file_unique_id for media in media_files):
+            await message.reply_text(
+                "ℹ️ Этот файл уже прикреплен к заявке.",
+                reply_markup=media_step_keyboard(context.user_data['request'])
+            )
+            return REQUEST_MEDIA
+        
+        # Проверяем лимит медиа файлов
         if len(media_files) >= Config.MAX_MEDIA_FILES:
             await message.reply_text(
                 f"❌ Достигнут лимит медиа файлов ({Config.MAX_MEDIA_FILES}). "
@@ -810,16 +2897,16 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         context.user_data['request']['media_files'].append({
             'file_id': file_info.file_id,
             'file_type': file_type,
-            'file_name': file_name
+            'file_name': file_name,
+            'file_unique_id': file_info.file_unique_id,
+            'file_size': file_info.file_size,
+            'mime_type': getattr(file_info, 'mime_type', None),
+            'duration': getattr(file_info, 'duration', None)
         })
         
         media_count = len(context.user_data['request']['media_files'])
         
-        keyboard = [
-            ["📎 Прикрепить еще", "✅ Завершить создание"],
-            ["🔙 Назад", "🔙 Главное меню"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup = media_step_keyboard(context.user_data['request'])
         
         media_type_emoji = {
             'photo': '📸',
@@ -845,29 +2932,42 @@ async def create_request_final(update: Update, context: ContextTypes.DEFAULT_TYP
     try:
         request_data = context.user_data['request']
         
+        # Ищем открытый инцидент с похожим описанием
+        incident = find_incident(request_data['problem'])
+        
         # Создаем заявку в базе данных
         request_id = db.add_request(
             user_id=request_data['user_id'],
             username=request_data['username'],
             phone=request_data['phone'],
-            problem=request_data['problem']
+            problem=request_data['problem'],
+            urgency=request_data.get('urgency', URGENCY_NORMAL),
+            incident_id=incident['id'] if incident else None
         )
         
         # Сохраняем медиа файлы
-        for media_file in request_data.get('media_files', []):
-            db.add_media_to_request(
-                request_id, 
-                media_file['file_id'], 
-                media_file['file_type'],
-                media_file.get('file_name')
-            )
+        db.add_media_to_request(request_id, request_data.get('media_files', []))
+        if media_store is not None:
+            # Копии скачиваются в фоне, ответ пользователю их не ждет
+            media_store.schedule(context.bot, request_data.get('media_files', []))
         
-        # Отправляем уведомление администраторам
-        await notify_admins_new_request(context, request_id, request_data)
+        # Отправляем уведомление администраторам (дубликат лишь обновляет уведомление инцидента)
+        if incident:
+            INCIDENT_DUPLICATES.inc()
+            schedule_incident_update(context, incident['id'])
+        else:
+            if Config.ENABLE_INCIDENT_GROUPING:
+                incident_index.add(request_id, request_data['problem'])
+            await notify_admins_new_request(context, request_id, request_data)
         
         # Форматируем дату создания
         created_time = datetime.now().strftime('%d.%m.%Y в %H:%M')
         
+        status_text = "🆕 Новая"
+        incident_text = ""
+        if incident:
+            incident_text = f"🔁 *Похожая проблема уже зарегистрирована (заявка #{incident['id']}), специалисты в курсе*\n\n"
+        
         success_text = (
             f"🎉 *Заявка #{request_id} успешно создана!*\n\n"
             f"🏢 *Отдел:* {Config.IT_DEPARTMENT_NAME}\n"
@@ -876,7 +2976,8 @@ async def create_request_final(update: Update, context: ContextTypes.DEFAULT_TYP
             f"📎 *Медиа файлов:* {len(request_data.get('media_files', []))}\n\n"
             f"🔧 *Описание проблемы:*\n{request_data['problem']}\n\n"
             f"⏰ *Создана:* {created_time}\n\n"
-            f"📊 *Статус:* 🆕 Новая\n\n"
+            f"{incident_text}"
+            f"📊 *Статус:* {status_text}\n\n"
             f"💬 *Мы свяжемся с вами в ближайшее время!*\n"
             f"📂 Отслеживать статус можно в разделе \"Мои заявки\""
         )
@@ -905,8 +3006,10 @@ async def create_request_final(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def notify_admins_new_request(context: ContextTypes.DEFAULT_TYPE, request_id: int, request_data: Dict):
     """👥 Уведомляет администраторов о новой заявке"""
+    urgent = request_data.get('urgency') == URGENCY_URGENT
+    header = f"🔥 *СРОЧНАЯ ЗАЯВКА #{request_id}*" if urgent else f"🆕 *НОВАЯ ЗАЯВКА #{request_id}*"
     message = (
-        f"🆕 *НОВАЯ ЗАЯВКА #{request_id}*\n\n"
+        f"{header}\n\n"
         f"👤 *Пользователь:* {request_data['username']}\n"
         f"📞 *Телефон:* {request_data['phone']}\n"
         f"🔧 *Проблема:* {request_data['problem'][:200]}...\n"
@@ -916,25 +3019,401 @@ async def notify_admins_new_request(context: ContextTypes.DEFAULT_TYPE, request_
     
     # Отправляем уведомление всем администраторам IT отдела
     admin_ids = Config.ADMIN_CHAT_IDS.get('💻 IT отдел', [])
-    for admin_id in admin_ids:
-        try:
-            # Создаем клавиатуру с кнопками действий
-            keyboard = [
-                [
-                    InlineKeyboardButton("👨‍💼 Взять в работу", callback_data=f"take_{request_id}"),
-                    InlineKeyboardButton("📋 Подробнее", callback_data=f"details_{request_id}")
+    if Config.ADMIN_DIGEST_SECONDS and not urgent:
+        # Режим сводки: заявка добавляется в живое сообщение вместо нового
+        digested = {}
+        for admin_id in admin_ids:
+            try:
+                digest = await add_to_digest(context, admin_id, request_id)
+                digested[admin_id] = digest.message_id
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления сводки администратора {admin_id}: {e}")
+        if request_id in incident_index:
+            # Дубликаты перерисуют сводку (счетчик 🔁), а не пришлют отдельное уведомление
+            db.add_incident_notifications(request_id, digested, kind='digest')
+        return
+    
+    # Срочные заявки обгоняют в очереди отправки все остальное
+    notifications = {}
+    with send_lane(SendLane.URGENT if urgent else SendLane.INTERACTIVE):
+        for admin_id in admin_ids:
+            try:
+                # Создаем клавиатуру с кнопками действий
+                keyboard = [
+                    [
+                        InlineKeyboardButton("👨‍💼 Взять в работу", callback_data=f"take_{request_id}"),
+                        InlineKeyboardButton("📋 Подробнее", callback_data=f"details_{request_id}")
+                    ]
                 ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=message,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
+                reply_markup = InlineKeyboardMarkup(keyboard)
+                
+                sent = await context.bot.send_message(
+                    chat_id=admin_id,
+                    text=message,
+                    reply_markup=reply_markup,
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                notifications[admin_id] = sent.message_id
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления администратора {admin_id}: {e}")
+    if request_id in incident_index:
+        # Дубликат может прийти в другой воркер - ID сообщений должны быть видны всем
+        db.add_incident_notifications(request_id, notifications)
+
+class AdminDigest:
+    """📥 Живое сообщение администратору со списком новых заявок"""
+    
+    def __init__(self, admin_id: int, opened_at: float):
+        self.admin_id = admin_id
+        self.opened_at = opened_at
+        self.message_id: Optional[int] = None
+        self.request_ids: List[int] = []
+        self.last_edit = 0.0
+        self.edit_pending = False
+
+class AdminDigests:
+    """📥 Открытые сводки по администраторам и недавние сводки по ID сообщений"""
+    
+    def __init__(self, keep_closed: int = 200):
+        self.keep_closed = keep_closed
+        self.open: Dict[int, AdminDigest] = {}
+        self.recent: Dict[Tuple[int, int], AdminDigest] = {}
+    
+    def current(self, admin_id: int, now: float) -> Optional[AdminDigest]:
+        """📬 Сводка, в которую еще можно добавить заявку"""
+        digest = self.open.get(admin_id)
+        if digest is None or digest.message_id is None:
+            return None
+        if now - digest.opened_at > Config.ADMIN_DIGEST_SECONDS or len(digest.request_ids) >= Config.DIGEST_MAX_ITEMS:
+            return None
+        return digest
+    
+    def opened(self, digest: AdminDigest):
+        """📨 Регистрирует отправленную сводку"""
+        self.open[digest.admin_id] = digest
+        self.recent[(digest.admin_id, digest.message_id)] = digest
+        while len(self.recent) > self.keep_closed:
+            del self.recent[next(iter(self.recent))]
+    
+    def by_message(self, chat_id: int, message_id: int) -> Optional[AdminDigest]:
+        return self.recent.get((chat_id, message_id))
+    
+    def containing(self, request_id: int) -> List[AdminDigest]:
+        return [digest for digest in self.recent.values() if request_id in digest.request_ids]
+
+admin_digests = AdminDigests()
+
+def render_digest(digest: AdminDigest) -> Tuple[str, InlineKeyboardMarkup]:
+    """📥 Текст и кнопки сводки по текущему состоянию заявок"""
+    requests = db.get_requests_by_ids(digest.request_ids)
+    new_count = sum(1 for request in requests if request['status'] == 'new')
+    icons = {'new': '🆕', 'in_progress': '🔄', 'completed': '✅'}
+    
+    lines = [f"📥 <b>НОВЫЕ ЗАЯВКИ</b>: {len(requests)}, ждут исполнителя: {new_count}\n"]
+    keyboard = []
+    for request in requests:
+        created = datetime.fromisoformat(request['created_at']).strftime('%H:%M')
+        line = (
+            f"{icons.get(request['status'], '📋')} <b>#{request['id']}</b> {created} "
+            f"{html.escape(request['username'] or '')}: {html.escape((request['problem'] or '')[:80])}"
+        )
+        if request['duplicates']:
+            line += f" (🔁 +{request['duplicates']})"
+        if request['status'] != 'new' and request['assigned_admin']:
+            line += f"\n   👨‍💼 {html.escape(request['assigned_admin'])}"
+        lines.append(line)
+        
+        if request['status'] == 'new':
+            action = InlineKeyboardButton(f"👨‍💼 Взять #{request['id']}", callback_data=f"take_{request['id']}")
+        elif request['status'] == 'in_progress':
+            action = InlineKeyboardButton(f"✅ Выполнена #{request['id']}", callback_data=f"complete_{request['id']}")
+        else:
+            continue
+        keyboard.append([action, InlineKeyboardButton("📋 Подробнее", callback_data=f"details_{request['id']}")])
+    return '\n'.join(lines), InlineKeyboardMarkup(keyboard)
+
+async def add_to_digest(context: ContextTypes.DEFAULT_TYPE, admin_id: int, request_id: int) -> AdminDigest:
+    """📥 Добавляет заявку в сводку администратора (новая сводка - одно сообщение, дальше правки)"""
+    now = unix_time()
+    digest = admin_digests.current(admin_id, now)
+    if digest is not None:
+        digest.request_ids.append(request_id)
+        schedule_digest_edit(context.application, digest)
+        return digest
+    
+    digest = AdminDigest(admin_id, now)
+    digest.request_ids.append(request_id)
+    message, reply_markup = render_digest(digest)
+    with send_lane(SendLane.BACKGROUND):
+        sent = await context.bot.send_message(
+            chat_id=admin_id, text=message, reply_markup=reply_markup, parse_mode=ParseMode.HTML
+        )
+    digest.message_id = sent.message_id
+    digest.last_edit = now
+    admin_digests.opened(digest)
+    return digest
+
+async def refresh_digest(bot, digest: AdminDigest):
+    """✏️ Перерисовывает сводку на месте"""
+    digest.last_edit = unix_time()
+    message, reply_markup = render_digest(digest)
+    try:
+        await bot.edit_message_text(
+            chat_id=digest.admin_id, message_id=digest.message_id, text=message,
+            reply_markup=reply_markup, parse_mode=ParseMode.HTML
+        )
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            logger.error(f"❌ Ошибка обновления сводки администратора {digest.admin_id}: {e}")
+
+def schedule_digest_edit(application: Application, digest: AdminDigest):
+    """⏳ Правка сводки не чаще DIGEST_EDIT_INTERVAL: все изменения за интервал - одна правка"""
+    if digest.edit_pending:
+        return
+    digest.edit_pending = True
+    delay = max(0.0, digest.last_edit + Config.DIGEST_EDIT_INTERVAL - unix_time())
+    
+    async def edit_later():
+        current_send_lane.set(SendLane.BACKGROUND)  # У задачи своя копия контекста
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            digest.edit_pending = False
+        await refresh_digest(application.bot, digest)
+    
+    application.create_task(edit_later())
+
+def schedule_digest_refresh(application: Application, request_id: int):
+    """🔄 Обновляет все сводки, где есть заявка (сменился статус)"""
+    for digest in admin_digests.containing(request_id):
+        schedule_digest_edit(application, digest)
+
+def render_queue_board() -> Tuple[str, InlineKeyboardMarkup]:
+    """📌 Текст и кнопки доски очереди (одинаковые для всех администраторов)"""
+    counts = db.get_queue_counts()
+    lines = [f"📌 <b>ОЧЕРЕДЬ ЗАЯВОК</b>: 🆕 новых {counts['new']}, 🔄 в работе {counts['in_progress']}"]
+    keyboard = []
+    for status, title in (('new', "🆕 <b>Ждут исполнителя</b>"), ('in_progress', "🔄 <b>В работе</b>")):
+        requests = db.get_requests(status=status, limit=Config.BOARD_MAX_ITEMS)
+        if not requests:
+            continue
+        lines.append(f"\n{title}")
+        for request in requests:
+            created = datetime.fromisoformat(request['created_at']).strftime('%d.%m %H:%M')
+            urgent = "🔥 " if request['urgency'] == URGENCY_URGENT else ""
+            line = (
+                f"{urgent}<b>#{request['id']}</b> {created} "
+                f"{html.escape(request['username'] or '')}: {html.escape((request['problem'] or '')[:60])}"
+            )
+            if status == 'in_progress' and request['assigned_admin']:
+                line += f" — 👨‍💼 {html.escape(request['assigned_admin'])}"
+            lines.append(line)
+        hidden = counts[status] - len(requests)
+        if hidden > 0:
+            lines.append(f"… и еще {hidden}")
+        if status == 'new':
+            keyboard.extend(
+                [InlineKeyboardButton(f"👨‍💼 Взять #{request['id']}", callback_data=f"take_{request['id']}")]
+                for request in requests[:3]
+            )
+    # Время последней правки - всегда последняя строка (QueueBoards.content ее отбрасывает)
+    lines.append(f"\n🕒 Обновлено: {datetime.now().strftime('%d.%m %H:%M:%S')}")
+    return '\n'.join(lines), InlineKeyboardMarkup(keyboard)
+
+class QueueBoards:
+    """📌 Живые доски очереди администраторов, которые правятся по событиям базы
+    
+    Подписчик EnhancedDatabase получает событие после каждого создания заявки
+    и смены статуса. Все события за BOARD_EDIT_INTERVAL сливаются в одну
+    перерисовку: доска рендерится один раз и правится у всех администраторов,
+    неизменившийся текст не отправляется. Список досок хранится в базе,
+    поэтому в режиме воркеров доски правит процесс, в котором была запись.
+    """
+    
+    def __init__(self):
+        self.application: Optional[Application] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.rendered: Dict[int, str] = {}
+        self.last_edit = 0.0
+        self.edit_pending = False
+    
+    @staticmethod
+    def content(message: str) -> str:
+        """📄 Текст доски без строки времени (она меняется при каждой отрисовке)"""
+        return message.rsplit('\n', 1)[0]
+    
+    def is_board(self, chat_id: int, message_id: int) -> bool:
+        return db.get_admin_boards().get(chat_id) == message_id
+    
+    def attach(self, application: Application):
+        """🔌 Подписывается на изменения заявок (вызывается из post_init)"""
+        self.application = application
+        self.loop = asyncio.get_running_loop()
+        db.subscribe(self.on_change)
+    
+    def on_change(self, request_ids: List[int]):
+        # Запись могла произойти вне event loop (фоновые задачи в потоках)
+        self.loop.call_soon_threadsafe(self.schedule_edit)
+    
+    def schedule_edit(self):
+        """⏳ Перерисовка не чаще BOARD_EDIT_INTERVAL: все события за интервал - одна правка"""
+        if self.edit_pending:
+            return
+        self.edit_pending = True
+        delay = max(0.0, self.last_edit + Config.BOARD_EDIT_INTERVAL - unix_time())
+        
+        async def edit_later():
+            current_send_lane.set(SendLane.BACKGROUND)  # У задачи своя копия контекста
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.edit_pending = False
+            await self.refresh()
+        
+        self.application.create_task(edit_later())
+    
+    async def refresh(self):
+        """✏️ Правит все доски на месте"""
+        self.last_edit = unix_time()
+        boards = db.get_admin_boards()
+        if not boards:
+            return
+        message, reply_markup = render_queue_board()
+        content = self.content(message)
+        for admin_id, message_id in boards.items():
+            # Воркеры правят доски по очереди, последняя правка могла быть чужой
+            if worker_index is None and self.rendered.get(admin_id) == content:
+                continue
+            try:
+                await self.application.bot.edit_message_text(
+                    chat_id=admin_id, message_id=message_id, text=message,
+                    reply_markup=reply_markup, parse_mode=ParseMode.HTML
+                )
+                self.rendered[admin_id] = content
+            except BadRequest as e:
+                error = str(e).lower()
+                if 'not modified' in error:
+                    self.rendered[admin_id] = content
+                elif 'not found' in error:
+                    # Администратор удалил сообщение доски
+                    db.delete_admin_board(admin_id, message_id)
+                    self.rendered.pop(admin_id, None)
+                    logger.info(f"📌 Доска администратора {admin_id} удалена из чата и отключена")
+                else:
+                    logger.error(f"❌ Ошибка обновления доски администратора {admin_id}: {e}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления доски администратора {admin_id}: {e}")
+
+queue_boards = QueueBoards()
+
+def find_incident(problem: str) -> Optional[Dict]:
+    """🧲 Открытая заявка с похожим описанием, к которой нужно привязать новую"""
+    if not Config.ENABLE_INCIDENT_GROUPING:
+        return None
+    if not incident_index.loaded:
+        incident_index.load(db.get_incident_roots(datetime.now() - incident_index.window))
+    
+    incident_id = incident_index.find(problem)
+    if incident_id is None:
+        return None
+    incident = db.get_request(incident_id)
+    if not incident or incident['status'] == 'completed':
+        incident_index.remove(incident_id)
+        return None
+    return incident
+
+def render_incident_notification(incident: Dict, children: List[Dict]) -> Tuple[str, InlineKeyboardMarkup]:
+    """🔁 Сводное уведомление администраторам об инциденте"""
+    incident_id = incident['id']
+    new_count = sum(1 for request in [incident] + children if request['status'] == 'new')
+    
+    if incident['status'] == 'new':
+        title = "🔥 *СРОЧНАЯ ЗАЯВКА" if incident['urgency'] == URGENCY_URGENT else "🆕 *НОВАЯ ЗАЯВКА"
+        header = f"{title} #{incident_id}*\n\n"
+    else:
+        header = f"🔄 *ЗАЯВКА #{incident_id} В РАБОТЕ*\n👨‍💼 *Исполнитель:* {incident['assigned_admin']}\n\n"
+    ids = ', '.join(f"#{request['id']}" for request in children[-10:])
+    message = (
+        header +
+        f"👤 *Пользователь:* {incident['username']}\n"
+        f"📞 *Телефон:* {incident['phone']}\n"
+        f"🔧 *Проблема:* {(incident['problem'] or '')[:200]}...\n"
+        f"🕒 *Создана:* {datetime.fromisoformat(incident['created_at']).strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"🔁 *Похожих заявок:* {len(children)}" + (f" ({'…, ' if len(children) > 10 else ''}{ids})" if ids else "")
+    )
+    
+    keyboard = []
+    if new_count:
+        keyboard.append([InlineKeyboardButton(
+            f"👨‍💼 Взять весь инцидент ({new_count})", callback_data=f"take_incident_{incident_id}"
+        )])
+    if incident['status'] == 'new':
+        keyboard.append([
+            InlineKeyboardButton(f"👨‍💼 Только #{incident_id}", callback_data=f"take_{incident_id}"),
+            InlineKeyboardButton("📋 Подробнее", callback_data=f"details_{incident_id}")
+        ])
+    else:
+        keyboard.append([
+            InlineKeyboardButton("✅ Инцидент устранен", callback_data=f"complete_{incident_id}"),
+            InlineKeyboardButton("📋 Подробнее", callback_data=f"details_{incident_id}")
+        ])
+    return message, InlineKeyboardMarkup(keyboard)
+
+async def refresh_incident_notifications(application: Application, incident_id: int):
+    """✏️ Перерисовывает уведомления об инциденте у всех администраторов"""
+    bot = application.bot
+    if db.get_incident_notifications(incident_id, kind='digest'):
+        # Заявка пришла в сводке: дубликаты показывает ее строка, отдельное уведомление не нужно.
+        # Сводки живут в памяти процесса, поэтому правит только процесс, который их отправил
+        schedule_digest_refresh(application, incident_id)
+        return
+    incident = db.get_request(incident_id)
+    if not incident:
+        return
+    message, reply_markup = render_incident_notification(incident, db.get_incident_requests(incident_id))
+    
+    messages = db.get_incident_notifications(incident_id)
+    if not messages:
+        # Уведомления не найдены (например, после перезапуска) - отправляем заново
+        messages = {}
+        for admin_id in Config.ADMIN_CHAT_IDS.get('💻 IT отдел', []):
+            try:
+                sent = await bot.send_message(
+                    chat_id=admin_id, text=message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN
+                )
+                messages[admin_id] = sent.message_id
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления администратора {admin_id}: {e}")
+        db.add_incident_notifications(incident_id, messages)
+        return
+    
+    for admin_id, message_id in messages.items():
+        try:
+            await bot.edit_message_text(
+                chat_id=admin_id, message_id=message_id, text=message,
+                reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN
             )
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.error(f"❌ Ошибка обновления уведомления об инциденте #{incident_id}: {e}")
         except Exception as e:
-            logger.error(f"❌ Ошибка уведомления администратора {admin_id}: {e}")
+            logger.error(f"❌ Ошибка обновления уведомления об инциденте #{incident_id}: {e}")
+
+def schedule_incident_update(context: ContextTypes.DEFAULT_TYPE, incident_id: int):
+    """⏳ Откладывает правку уведомления, чтобы волна дубликатов дала одну правку"""
+    if incident_id in incident_index.pending_updates:
+        return
+    incident_index.pending_updates.add(incident_id)
+    
+    async def update_later():
+        current_send_lane.set(SendLane.BACKGROUND)  # У задачи своя копия контекста
+        try:
+            await asyncio.sleep(Config.INCIDENT_EDIT_DELAY)
+        finally:
+            incident_index.pending_updates.discard(incident_id)
+        await refresh_incident_notifications(context.application, incident_id)
+    
+    context.application.create_task(update_later())
 
 async def cancel_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """❌ Отменяет создание заявки"""
@@ -954,19 +3433,30 @@ async def cancel_request(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_admin_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """👨‍💼 Обрабатывает нажатия кнопок администратора"""
     query = update.callback_query
-    await query.answer()
-    
     user_id = query.from_user.id
-    if not Config.is_admin(user_id):
-        await query.message.reply_text("❌ У вас нет прав администратора.")
+    data = query.data
+    
+    # Оценку ставит пользователь, остальные кнопки - только администраторы
+    if not data.startswith('feedback_') and not Config.is_admin(user_id):
+        # У сообщений, отправленных в инлайн-режиме, нет query.message - отвечаем всплывающим окном
+        await query.answer("❌ У вас нет прав администратора.", show_alert=True)
         return
+    # Детали отвечают на нажатие сами: при ошибке - всплывающим окном
+    if not data.startswith('details_'):
+        await query.answer()
     
-    data = query.data
+    if data.startswith('take_incident_'):
+        incident_id = int(data.split('_')[2])
+        await take_incident_in_work(update, context, incident_id, user_id)
     
-    if data.startswith('take_'):
+    elif data.startswith('take_'):
         request_id = int(data.split('_')[1])
         await take_request_in_work(update, context, request_id, user_id)
     
+    elif data.startswith('complete_incident_'):
+        incident_id = int(data.split('_')[2])
+        await complete_incident_children(update, context, incident_id)
+    
     elif data.startswith('details_'):
         request_id = int(data.split('_')[1])
         await show_request_details(update, context, request_id)
@@ -999,25 +3489,29 @@ async def take_request_in_work(update: Update, context: ContextTypes.DEFAULT_TYP
         admin_name = query.from_user.full_name
         db.update_request_status(request_id, 'in_progress', admin_name)
         
-        # Обновляем сообщение
-        message_text = query.message.text + f"\n\n✅ *ВЗЯТА В РАБОТУ*\n👨‍💼 Исполнитель: {admin_name}\n🕒 Время: {datetime.now().strftime('%H:%M')}"
-        
-        # Обновляем клавиатуру
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Заявка выполнена", callback_data=f"complete_{request_id}"),
-            ],
-            [
-                InlineKeyboardButton("📋 Обновить информацию", callback_data=f"details_{request_id}")
+        # Сводки и доски очереди перерисуются сами, обычное уведомление правим на месте
+        schedule_digest_refresh(context.application, request_id)
+        chat_id, message_id = query.message.chat_id, query.message.message_id
+        if not admin_digests.by_message(chat_id, message_id) and not queue_boards.is_board(chat_id, message_id):
+            # Обновляем сообщение
+            message_text = query.message.text + f"\n\n✅ *ВЗЯТА В РАБОТУ*\n👨‍💼 Исполнитель: {admin_name}\n🕒 Время: {datetime.now().strftime('%H:%M')}"
+            
+            # Обновляем клавиатуру
+            keyboard = [
+                [
+                    InlineKeyboardButton("✅ Заявка выполнена", callback_data=f"complete_{request_id}"),
+                ],
+                [
+                    InlineKeyboardButton("📋 Обновить информацию", callback_data=f"details_{request_id}")
+                ]
             ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(
-            text=message_text,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await query.edit_message_text(
+                text=message_text,
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.MARKDOWN
+            )
         
         # Уведомляем пользователя
         await context.bot.send_message(
@@ -1037,6 +3531,69 @@ async def take_request_in_work(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.error(f"❌ Ошибка взятия заявки в работу: {e}")
         await query.answer("❌ Ошибка при взятии заявки!", show_alert=True)
 
+async def take_incident_in_work(update: Update, context: ContextTypes.DEFAULT_TYPE, incident_id: int, admin_id: int):
+    """🔁 Берет в работу все новые заявки инцидента одним действием"""
+    query = update.callback_query
+    
+    try:
+        admin_name = query.from_user.full_name
+        taken = db.take_incident(incident_id, admin_name)
+        if not taken:
+            await query.answer("❌ Заявки инцидента уже в работе!", show_alert=True)
+            return
+        
+        # Нажатое сообщение тоже должно обновиться, даже если его не было в индексе
+        if incident_id in incident_index:
+            db.add_incident_notifications(incident_id, {query.message.chat_id: query.message.message_id})
+            await refresh_incident_notifications(context.application, incident_id)
+        else:
+            incident = db.get_request(incident_id)
+            message, reply_markup = render_incident_notification(incident, db.get_incident_requests(incident_id))
+            await query.edit_message_text(text=message, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        
+        # Уведомляем пользователей
+        for request in taken:
+            try:
+                await context.bot.send_message(
+                    chat_id=request['user_id'],
+                    text=(
+                        f"🔄 *Заявка #{request['id']} взята в работу*\n\n"
+                        f"👨‍💼 *Исполнитель:* {admin_name}\n"
+                        f"🕒 *Время:* {datetime.now().strftime('%H:%M')}\n\n"
+                        f"💬 *Специалист свяжется с вами для уточнения деталей*"
+                    ),
+                    parse_mode=ParseMode.MARKDOWN
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка уведомления пользователя {request['user_id']}: {e}")
+        
+        logger.info(f"🔁 Инцидент #{incident_id} ({len(taken)} заявок) взят в работу администратором {admin_name}")
+    
+    except Exception as e:
+        logger.error(f"❌ Ошибка взятия инцидента в работу: {e}")
+        await query.answer("❌ Ошибка при взятии инцидента!", show_alert=True)
+
+async def complete_incident_children(update: Update, context: ContextTypes.DEFAULT_TYPE, incident_id: int):
+    """🔁 Закрывает подтвержденные администратором похожие заявки с комментарием основной"""
+    query = update.callback_query
+    admin_name = query.from_user.full_name
+    incident = db.get_request(incident_id)
+    if not incident or incident['status'] != 'completed':
+        await query.answer("❌ Сначала завершите основную заявку!", show_alert=True)
+        return
+    
+    comment = incident['admin_comment'] or ''
+    children = db.complete_incident(incident_id, comment, admin_name)
+    for child in children:
+        try:
+            await send_completion_notice(context, child, admin_name, comment)
+        except Exception as e:
+            logger.error(f"❌ Ошибка уведомления пользователя {child['user_id']}: {e}")
+        schedule_digest_refresh(context.application, child['id'])
+    
+    await query.edit_message_text(f"🔁 Закрыто похожих заявок: {len(children)}")
+    logger.info(f"🔁 Похожие заявки инцидента #{incident_id} ({len(children)}) закрыты администратором {admin_name}")
+
 async def complete_request_with_comment(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int, admin_id: int):
     """✅ Завершает заявку с запросом комментария"""
     query = update.callback_query
@@ -1090,42 +3647,36 @@ async def handle_admin_comment(update: Update, context: ContextTypes.DEFAULT_TYP
             # Сохраняем комментарий
             db.update_admin_comment(request_id, comment)
             
+            incident_index.remove(request_id)
+            db.delete_incident_notifications(request_id)
+            
             # Отправляем уведомление пользователю
             request = db.get_request(request_id)
             if request:
-                user_message = (
-                    f"✅ *Заявка #{request_id} выполнена!*\n\n"
-                    f"👨‍💼 *Исполнитель:* {admin_name}\n"
-                    f"💬 *Комментарий:* {comment}\n\n"
-                    f"⭐ *Пожалуйста, оцените качество работы:*"
-                )
-                
-                # Создаем клавиатуру для оценки
-                rating_keyboard = []
-                for i in range(1, 6):
-                    rating_keyboard.append([
-                        InlineKeyboardButton(
-                            "★" * i + "☆" * (5 - i), 
-                            callback_data=f"feedback_{request_id}_{i}"
-                        )
-                    ])
-                reply_markup = InlineKeyboardMarkup(rating_keyboard)
-                
-                await context.bot.send_message(
-                    chat_id=request['user_id'],
-                    text=user_message,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                await send_completion_notice(context, request, admin_name, comment)
             
             keyboard = [["👨‍💼 Админ панель"]]
             reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             
+            schedule_digest_refresh(context.application, request_id)
+            
             await update.message.reply_text(
-                f"✅ Заявка #{request_id} завершена с комментарием!",
-                reply_markup=reply_markup
+                f"✅ Заявка #{request_id} завершена с комментарием!", reply_markup=reply_markup
             )
             
+            # Похожие заявки закрываются только после подтверждения администратора
+            children = db.get_open_incident_requests(request_id, admin_name)
+            if children:
+                ids = ', '.join(f"#{child['id']}" for child in children[:10])
+                await update.message.reply_text(
+                    f"🔁 К заявке привязаны похожие заявки ({len(children)}): {ids}"
+                    f"{', …' if len(children) > 10 else ''}\n"
+                    f"Проверьте, что это та же проблема, и закройте их с тем же комментарием.",
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                        f"✅ Закрыть похожие ({len(children)})", callback_data=f"complete_incident_{request_id}"
+                    )]])
+                )
+            
             logger.info(f"✅ Заявка #{request_id} завершена администратором {admin_name}")
             
             # Очищаем временные данные
@@ -1136,6 +3687,34 @@ async def handle_admin_comment(update: Update, context: ContextTypes.DEFAULT_TYP
             logger.error(f"❌ Ошибка завершения заявки: {e}")
             await update.message.reply_text("❌ Ошибка при завершении заявки.")
 
+async def send_completion_notice(context: ContextTypes.DEFAULT_TYPE, request: Dict, admin_name: str, comment: str):
+    """✅ Сообщает пользователю о выполнении заявки и просит оценку"""
+    request_id = request['id']
+    user_message = (
+        f"✅ *Заявка #{request_id} выполнена!*\n\n"
+        f"👨‍💼 *Исполнитель:* {admin_name}\n"
+        f"💬 *Комментарий:* {comment}\n\n"
+        f"⭐ *Пожалуйста, оцените качество работы:*"
+    )
+    
+    # Создаем клавиатуру для оценки
+    rating_keyboard = []
+    for i in range(1, 6):
+        rating_keyboard.append([
+            InlineKeyboardButton(
+                "★" * i + "☆" * (5 - i), 
+                callback_data=f"feedback_{request_id}_{i}"
+            )
+        ])
+    reply_markup = InlineKeyboardMarkup(rating_keyboard)
+    
+    await context.bot.send_message(
+        chat_id=request['user_id'],
+        text=user_message,
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.MARKDOWN
+    )
+
 async def handle_user_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int, rating: int):
     """⭐ Обрабатывает оценку пользователя"""
     query = update.callback_query
@@ -1147,7 +3726,9 @@ async def handle_user_feedback(update: Update, context: ContextTypes.DEFAULT_TYP
             return
         
         # Сохраняем оценку
-        db.add_user_feedback(request_id, rating)
+        if not db.add_user_feedback(request_id, rating):
+            await query.answer("❌ Заявка не найдена!", show_alert=True)
+            return
         
         # Благодарим пользователя
         thanks_message = (
@@ -1169,6 +3750,34 @@ async def handle_user_feedback(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.error(f"❌ Ошибка обработки оценки: {e}")
         await query.answer("❌ Ошибка при сохранении оценки!", show_alert=True)
 
+# Тип вложения -> (метод бота, параметр с файлом)
+MEDIA_SENDERS = {
+    'photo': ('send_photo', 'photo'),
+    'video': ('send_video', 'video'),
+    'document': ('send_document', 'document'),
+    'voice': ('send_voice', 'voice'),
+}
+
+async def send_request_media(bot, chat_id: int, media: Dict, caption: str):
+    """📎 Отправляет вложение заявки по file_id, а если Telegram его не принимает - из локальной копии"""
+    if media['file_type'] not in MEDIA_SENDERS:
+        return
+    method, field = MEDIA_SENDERS[media['file_type']]
+    send = getattr(bot, method)
+    try:
+        await send(chat_id=chat_id, caption=caption, **{field: media['file_id']})
+        return
+    except BadRequest:
+        # file_id перестает работать, например, после смены токена бота
+        path = None
+        if media_store is not None and media.get('file_unique_id'):
+            path = media_store.get(media['file_unique_id'])
+        if path is None:
+            raise
+    content = await asyncio.to_thread(path.read_bytes)
+    await send(chat_id=chat_id, caption=caption, **{field: InputFile(content, filename=media.get('file_name') or path.name)})
+    logger.info(f"📂 Вложение {media['file_unique_id']} отправлено из локальной копии")
+
 async def show_request_details(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int):
     """📋 Показывает детали заявки"""
     query = update.callback_query
@@ -1212,8 +3821,11 @@ async def show_request_details(update: Update, context: ContextTypes.DEFAULT_TYP
         
         details_text += f"📎 *Медиа файлов:* {len(media_files)}\n"
         
-        await query.message.reply_text(
-            details_text,
+        # Кнопка из инлайн-результата: сообщения нет, детали уходят администратору в личный чат
+        chat_id = query.message.chat_id if query.message else query.from_user.id
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=details_text,
             parse_mode=ParseMode.MARKDOWN
         )
         
@@ -1224,34 +3836,15 @@ async def show_request_details(update: Update, context: ContextTypes.DEFAULT_TYP
                 if media['file_name']:
                     caption += f" ({media['file_name']})"
                 
-                if media['file_type'] == 'photo':
-                    await context.bot.send_photo(
-                        chat_id=query.message.chat_id,
-                        photo=media['file_id'],
-                        caption=caption
-                    )
-                elif media['file_type'] == 'video':
-                    await context.bot.send_video(
-                        chat_id=query.message.chat_id,
-                        video=media['file_id'],
-                        caption=caption
-                    )
-                elif media['file_type'] == 'document':
-                    await context.bot.send_document(
-                        chat_id=query.message.chat_id,
-                        document=media['file_id'],
-                        caption=caption
-                    )
-                elif media['file_type'] == 'voice':
-                    await context.bot.send_voice(
-                        chat_id=query.message.chat_id,
-                        voice=media['file_id'],
-                        caption=caption
-                    )
+                await send_request_media(context.bot, chat_id, media, caption)
             except Exception as e:
                 logger.error(f"❌ Ошибка отправки медиа: {e}")
-                await query.message.reply_text(f"❌ Не удалось отправить файл: {str(e)}")
-        
+                await context.bot.send_message(chat_id=chat_id, text=f"❌ Не удалось отправить файл: {str(e)}")
+        await query.answer()
+    
+    except Forbidden:
+        # Администратор еще не открывал личный чат с ботом (кнопка нажата в чужом чате)
+        await query.answer("❌ Откройте личный чат с ботом и нажмите /start, затем повторите.", show_alert=True)
     except Exception as e:
         logger.error(f"❌ Ошибка показа деталей заявки: {e}")
         await query.answer("❌ Ошибка при загрузке деталей!", show_alert=True)
@@ -1279,6 +3872,33 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     # Сохраняем состояние для обработки ответа
     context.user_data['awaiting_reset_confirmation'] = True
 
+async def board_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """📌 Включает или выключает доску очереди: /board, /board off"""
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для этой команды.")
+        return
+    
+    previous = db.delete_admin_board(user_id)
+    queue_boards.rendered.pop(user_id, None)
+    if previous is not None:
+        try:
+            await context.bot.unpin_chat_message(chat_id=user_id, message_id=previous)
+        except Exception as e:
+            logger.debug(f"Не удалось открепить доску администратора {user_id}: {e}")
+    if context.args and context.args[0].lower() in ('off', 'выкл'):
+        await update.message.reply_text("📌 Доска очереди отключена." if previous else "📌 Доска очереди не включена.")
+        return
+    
+    message, reply_markup = render_queue_board()
+    sent = await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    db.set_admin_board(user_id, sent.message_id)
+    queue_boards.rendered[user_id] = QueueBoards.content(message)
+    try:
+        await context.bot.pin_chat_message(chat_id=user_id, message_id=sent.message_id, disable_notification=True)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось закрепить доску администратора {user_id}: {e}")
+
 async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """💾 Создание резервной копии базы данных (только для админов)"""
     user_id = update.message.from_user.id
@@ -1306,23 +3926,78 @@ async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"❌ Ошибка команды backup: {e}")
         await update.message.reply_text("❌ Ошибка при создании резервной копии.")
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🔬 Профилирование работающего бота на N секунд (только для админов)"""
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для этой команды.")
+        return
+    
+    if profiler.running:
+        await update.message.reply_text("⏳ Профилирование уже выполняется, дождитесь отчета.")
+        return
+    
+    seconds = Config.PROFILE_DEFAULT_SECONDS
+    if context.args:
+        try:
+            seconds = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Использование: /profile [секунды]")
+            return
+    seconds = max(1, min(seconds, Config.PROFILE_MAX_SECONDS))
+    
+    async def finish_profiling():
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            report = profiler.stop()
+        try:
+            await context.bot.send_document(
+                chat_id=update.message.chat_id,
+                document=InputFile(
+                    BytesIO(report.encode('utf-8')),
+                    filename=f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+                ),
+                caption=f"🔬 Профиль за {seconds} с"
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки отчета профилирования: {e}")
+    
+    # Семплируем поток event loop, в котором работают все обработчики
+    profiler.start(threading.get_ident())
+    try:
+        await update.message.reply_text(
+            f"🔬 *Профилирование запущено на {seconds} с*\n\n"
+            f"Отчет придет документом по завершении.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        context.application.create_task(finish_profiling())
+    except BaseException:
+        # Без задачи завершения профилировщик и tracemalloc работали бы до перезапуска
+        profiler.stop()
+        raise
+    logger.info(f"🔬 Администратор {user_id} запустил профилирование на {seconds} с")
+
 async def send_bulk_notification(context: ContextTypes.DEFAULT_TYPE, message: str, user_ids: List[int]):
     """📢 Массовая рассылка уведомлений"""
     success_count = 0
     fail_count = 0
     
-    for user_id in user_ids:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            success_count += 1
-            await asyncio.sleep(0.1)  # Задержка чтобы не превысить лимиты Telegram
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки уведомления пользователю {user_id}: {e}")
-            fail_count += 1
+    # Рассылка идет фоновой полосой: темп задает планировщик отправки
+    with send_lane(SendLane.BACKGROUND):
+        for user_id in user_ids:
+            try:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=message,
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                success_count += 1
+                if not Config.SEND_RATE_PER_SECOND:
+                    await asyncio.sleep(0.1)  # Задержка чтобы не превысить лимиты Telegram
+            except Exception as e:
+                logger.error(f"❌ Ошибка отправки уведомления пользователю {user_id}: {e}")
+                fail_count += 1
     
     logger.info(f"📢 Рассылка завершена: Успешно {success_count}, Ошибок {fail_count}")
     return success_count, fail_count
@@ -1358,7 +4033,8 @@ async def admin_panel_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         ["📋 Новые заявки", "🔄 В работе"],
         ["✅ Выполненные", "📊 Общая статистика"],
         ["💾 Создать бэкап", "🔄 Сброс системы"],
-        ["🔙 Главное меню"]
+        ["🐢 Медленные запросы", "📈 SLA-аналитика"],
+        ["📉 Графики", "🔙 Главное меню"]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
@@ -1392,11 +4068,30 @@ async def admin_requests_command(update: Update, context: ContextTypes.DEFAULT_T
         title = "📋 ВСЕ ЗАЯВКИ"
         emoji = "📋"
     
-    requests = db.get_requests(status=status_filter, limit=20)
-    if not requests:
+    # Текст списка пересобирается только после изменения заявок в этом статусе
+    scope = f'status:{status_filter}' if status_filter else 'requests'
+    key = ('admin', status_filter, db.get_data_version(scope))
+    found, requests_text, generation = list_page_cache.get(key)
+    if not found:
+        requests_text = render_admin_requests(db.get_requests(status=status_filter, limit=20), title, emoji)
+        list_page_cache.put(key, requests_text, generation)
+    
+    if requests_text is None:
         await update.message.reply_text(f"📭 Заявок в этой категории нет.")
         return
     
+    keyboard = [["🔙 Назад в админку", "🔙 Главное меню"]]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    
+    await update.message.reply_text(requests_text, 
+                                  reply_markup=reply_markup,
+                                  parse_mode=ParseMode.MARKDOWN)
+
+def render_admin_requests(requests: List[Dict], title: str, emoji: str) -> Optional[str]:
+    """📋 Текст админского списка заявок (None - список пуст)"""
+    if not requests:
+        return None
+    
     requests_text = f"{emoji} *{title}*\n\n"
     
     for req in requests:
@@ -1420,21 +4115,367 @@ async def admin_requests_command(update: Update, context: ContextTypes.DEFAULT_T
         
         requests_text += "\n"
     
+    return requests_text
+
+def render_search_page(raw_query: str, page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """🔎 Формирует страницу результатов поиска"""
+    text_query, status, since = parse_search_query(raw_query)
+    started = perf_counter()
+    rows, has_more, truncated = db.search_requests(
+        text_query, status=status, since=since,
+        limit=Config.SEARCH_PAGE_SIZE, offset=page * Config.SEARCH_PAGE_SIZE
+    )
+    elapsed_ms = (perf_counter() - started) * 1000
+    
+    if not rows:
+        return f"📭 По запросу «{html.escape(raw_query)}» ничего не найдено.", None
+    
+    text = f"🔎 <b>ПОИСК:</b> {html.escape(raw_query)}\n📄 Страница {page + 1} | ⏱️ {elapsed_ms:.0f} мс\n\n"
+    if truncated:
+        text += (
+            f"⚠️ Совпадений больше {Config.SEARCH_CANDIDATES}: по релевантности упорядочены только "
+            f"{Config.SEARCH_CANDIDATES} самых свежих. Уточните запрос или добавьте период.\n\n"
+        )
+    for req in rows:
+        status_emoji = {
+            'new': '🆕',
+            'in_progress': '🔄',
+            'completed': '✅'
+        }.get(req['status'], '❓')
+        created_date = datetime.fromisoformat(req['created_at']).strftime('%d.%m.%Y')
+        text += (
+            f"{status_emoji} <b>#{req['id']}</b> | {created_date} | {html.escape(req['username'] or '')}\n"
+            f"{format_snippet(req['snippet'])}\n\n"
+        )
+    
+    detail_buttons = [
+        InlineKeyboardButton(f"📋 #{req['id']}", callback_data=f"details_{req['id']}") for req in rows
+    ]
+    keyboard = [detail_buttons[i:i + 5] for i in range(0, len(detail_buttons), 5)]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("◀️ Назад", callback_data=f"search_{page - 1}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton("Вперед ▶️", callback_data=f"search_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🔎 Полнотекстовый поиск заявок (только для админов)"""
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав администратора.")
+        return
+    
+    raw_query = ' '.join(context.args or [])
+    if not raw_query:
+        await update.message.reply_text(
+            "🔎 *Поиск заявок*\n\n"
+            "Использование: `/search принтер 305 период:месяц статус:новые`\n\n"
+            "• период: день, неделя, месяц, год\n"
+            "• статус: новые, вработе, выполненные",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    context.user_data['search_query'] = raw_query
+    text, reply_markup = render_search_page(raw_query, 0)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+async def handle_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """📄 Листает страницы результатов поиска"""
+    query = update.callback_query
+    if not Config.is_admin(query.from_user.id):
+        await query.answer("❌ У вас нет прав администратора.", show_alert=True)
+        return
+    
+    raw_query = context.user_data.get('search_query')
+    if not raw_query:
+        await query.answer("⌛ Поиск устарел, повторите /search", show_alert=True)
+        return
+    
+    await query.answer()
+    page = max(0, int(query.data.split('_')[1]))
+    text, reply_markup = render_search_page(raw_query, page)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🔎 Поиск заявок в инлайн-режиме (@бот запрос)"""
+    inline_query = update.inline_query
+    if not Config.is_admin(inline_query.from_user.id) or not inline_query.query.strip():
+        await inline_query.answer([], cache_time=0, is_personal=True)
+        return
+    
+    offset = int(inline_query.offset or 0)
+    text_query, status, since = parse_search_query(inline_query.query)
+    rows, has_more, truncated = db.search_requests(
+        text_query, status=status, since=since, limit=Config.SEARCH_PAGE_SIZE, offset=offset
+    )
+    
+    results = []
+    for req in rows:
+        status_emoji = {
+            'new': '🆕',
+            'in_progress': '🔄',
+            'completed': '✅'
+        }.get(req['status'], '❓')
+        created_date = datetime.fromisoformat(req['created_at']).strftime('%d.%m.%Y')
+        plain_snippet = (req['snippet'] or '').replace('\x02', '').replace('\x03', '')
+        results.append(InlineQueryResultArticle(
+            id=str(req['id']),
+            title=f"{status_emoji} Заявка #{req['id']} от {created_date}",
+            description=plain_snippet[:200],
+            input_message_content=InputTextMessageContent(
+                f"{status_emoji} <b>Заявка #{req['id']}</b> от {created_date}\n"
+                f"👤 {html.escape(req['username'] or '')}\n"
+                f"{format_snippet(req['snippet'])}",
+                parse_mode=ParseMode.HTML
+            ),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("📋 Подробнее", callback_data=f"details_{req['id']}")
+            ]])
+        ))
+    
+    # Над результатами - предупреждение, что старые совпадения не попали в ранжирование
+    button = InlineQueryResultsButton(
+        text=f"⚠️ Только {Config.SEARCH_CANDIDATES} свежих совпадений - уточните запрос", start_parameter='search'
+    ) if truncated else None
+    await inline_query.answer(
+        results,
+        cache_time=0,
+        is_personal=True,
+        next_offset=str(offset + Config.SEARCH_PAGE_SIZE) if has_more else '',
+        button=button
+    )
+
+async def slow_queries_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🐢 Показывает самые затратные SQL-запросы"""
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав администратора.")
+        return
+    
+    text = "🐢 <b>САМЫЕ ЗАТРАТНЫЕ ЗАПРОСЫ</b>\n\n"
+    top = query_stats.top_queries(5)
+    if not top:
+        text += "📭 Запросы еще не выполнялись.\n"
+    for sql, count, total, worst in top:
+        text += (
+            f"• <code>{html.escape(sql[:150])}</code>\n"
+            f"  🔢 {count} раз | ⏱️ всего {total * 1000:.0f} мс | "
+            f"ср. {total / count * 1000:.1f} мс | макс. {worst * 1000:.1f} мс\n\n"
+        )
+    
+    if query_stats.slow_log:
+        text += f"⏰ <b>ПОСЛЕДНИЕ МЕДЛЕННЫЕ (&gt; {Config.SLOW_QUERY_MS:.0f} мс):</b>\n"
+        for entry in query_stats.slow_log[-5:]:
+            text += (
+                f"• {entry['at']} — {entry['duration'] * 1000:.0f} мс\n"
+                f"  <code>{html.escape(entry['sql'][:150])}</code>\n"
+                f"  📐 {html.escape('; '.join(entry['plan'])[:200])}\n"
+            )
+        text += "\n"
+    
+    if query_stats.worst_updates:
+        text += "🔁 <b>ОБНОВЛЕНИЯ С ИЗБЫТКОМ ЗАПРОСОВ (N+1):</b>\n"
+        for entry in query_stats.worst_updates[:5]:
+            text += (
+                f"• {entry['at']} {entry['kind']} — {entry['total']} запросов, "
+                f"повтор {entry['repeats']}×: <code>{html.escape(entry['sql'][:100])}</code>\n"
+            )
+    
+    text += "\n🧠 <b>КЭШ ЗАПИСЕЙ:</b> " + ", ".join(
+        f"{name} {cache.hit_rate:.0%}" if cache.hit_rate is not None else f"{name} —"
+        for name, cache in (("заявки", db.request_cache), ("медиа", db.media_cache))
+    ) + " попаданий\n"
+    
     keyboard = [["🔙 Назад в админку", "🔙 Главное меню"]]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    await update.message.reply_text(requests_text, 
-                                  reply_markup=reply_markup,
-                                  parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(truncate_lines(text), reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+async def sla_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """📈 Показывает SLA-аналитику: /sla [дней]"""
+    global sla_analytics
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав администратора.")
+        return
+    
+    days = None
+    if context.args and context.args[0].isdigit():
+        days = int(context.args[0]) or None
+    
+    # NumPy загружается только при первом просмотре аналитики
+    from analytics import SlaAnalytics, format_report
+    if sla_analytics is None:
+        sla_analytics = SlaAnalytics(db)
+    
+    started = perf_counter()
+    report, cached = await asyncio.to_thread(sla_analytics.report, days)
+    elapsed = (perf_counter() - started) * 1000
+    
+    keyboard = [["🔙 Назад в админку", "🔙 Главное меню"]]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    
+    await update.message.reply_text(
+        format_report(report) + f"\n\n⏱️ {elapsed:.0f} мс{' (кэш)' if cached else ''}",
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
+    )
+
+async def charts_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """📉 Меню графиков: тип графика и период"""
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав администратора.")
+        return
+    
+    from charts import CHARTS, RANGES
+    keyboard = [
+        [InlineKeyboardButton(f"{title.split()[0]} {days} дн.", callback_data=f"chart_{chart}_{days}")
+         for days in RANGES]
+        for chart, title in CHARTS.items()
+    ]
+    text = "📉 *ГРАФИКИ*\n\n" + "\n".join(CHARTS.values())
+    await update.message.reply_text(
+        text + "\n\nВыберите график и период:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def handle_chart_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🖼️ Отправляет выбранный график (рендер в пуле процессов, повтор - из кэша)"""
+    global chart_service
+    query = update.callback_query
+    if not Config.is_admin(query.from_user.id):
+        await query.answer("❌ У вас нет прав администратора.", show_alert=True)
+        return
+    
+    from charts import CHARTS, ChartService
+    _, chart, days = query.data.split('_')
+    if chart not in CHARTS or not days.isdigit():
+        await query.answer("❌ Неизвестный график", show_alert=True)
+        return
+    if chart_service is None:
+        chart_service = ChartService(db, max_workers=Config.CHART_WORKERS, cache_size=Config.CHART_CACHE_SIZE)
+    
+    await query.answer("🎨 Готовлю график...")
+    await context.bot.send_chat_action(query.message.chat_id, ChatAction.UPLOAD_PHOTO)
+    started = perf_counter()
+    try:
+        png, cached = await chart_service.render(chart, int(days))
+    except Exception as e:
+        logger.error(f"❌ Ошибка построения графика {chart}: {e}")
+        await query.message.reply_text("❌ Не удалось построить график.")
+        return
+    elapsed = (perf_counter() - started) * 1000
+    
+    await context.bot.send_photo(
+        query.message.chat_id,
+        InputFile(BytesIO(png), filename=f"{chart}_{days}d.png"),
+        caption=f"{CHARTS[chart]} за {days} дн.\n⏱️ {elapsed:.0f} мс{' (кэш)' if cached else ''}"
+    )
+
+EXPORT_USAGE = (
+    "📤 *Выгрузка заявок*\n\n"
+    "Использование: `/export xlsx месяц:2024-05 статус:выполненные`\n\n"
+    "• формат: csv (по умолчанию) или xlsx\n"
+    "• месяц:ГГГГ-ММ, с:ГГГГ-ММ-ДД, по:ГГГГ-ММ-ДД (включительно)\n"
+    "• период: день, неделя, месяц, год\n"
+    "• статус: новые, вработе, выполненные"
+)
+
+def parse_export_args(args: List[str]) -> Tuple[str, Optional[datetime], Optional[datetime], Optional[str]]:
+    """🧩 Формат и фильтры выгрузки; ValueError при непонятном аргументе"""
+    fmt, since, until, status = 'csv', None, None, None
+    for arg in args:
+        key, _, value = arg.lower().partition(':')
+        if not value and key in ('csv', 'xlsx'):
+            fmt = key
+        elif key == 'месяц' and re.fullmatch(r'\d{4}-\d{2}', value):
+            since = datetime.strptime(value, '%Y-%m')
+            until = (since + timedelta(days=32)).replace(day=1)
+        elif key == 'с':
+            since = datetime.strptime(value, '%Y-%m-%d')
+        elif key == 'по':
+            until = datetime.strptime(value, '%Y-%m-%d') + timedelta(days=1)
+        elif key == 'период' and value in SEARCH_PERIODS:
+            since = datetime.now() - SEARCH_PERIODS[value]
+        elif key == 'статус' and value in SEARCH_STATUSES:
+            status = SEARCH_STATUSES[value]
+        else:
+            raise ValueError(arg)
+    return fmt, since, until, status
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """📤 Выгрузка заявок в CSV/XLSX: /export [xlsx] [месяц:ГГГГ-ММ] [статус:...]"""
+    user_id = update.message.from_user.id
+    if not Config.is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав администратора.")
+        return
+    
+    try:
+        fmt, since, until, status = parse_export_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(EXPORT_USAGE, parse_mode=ParseMode.MARKDOWN)
+        return
+    
+    from export import export_requests
+    await context.bot.send_chat_action(update.message.chat_id, ChatAction.UPLOAD_DOCUMENT)
+    
+    # Файл пишется потоком во временный каталог, в памяти только текущая пачка строк
+    fd, path = tempfile.mkstemp(prefix='export_', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        started = perf_counter()
+        count = await asyncio.to_thread(export_requests, db.db_path, path, fmt, since, until, status)
+        elapsed = perf_counter() - started
+        if not count:
+            await update.message.reply_text("📭 Заявок по заданным условиям нет.")
+            return
+        
+        size = os.path.getsize(path)
+        if size > Config.EXPORT_MAX_BYTES:
+            hint = "сузьте период или статус" if fmt == 'xlsx' else "выберите xlsx (он сжат) или сузьте период"
+            await update.message.reply_text(
+                f"❌ Файл выгрузки - {size // (1024 * 1024)} МБ, Telegram принимает не больше "
+                f"{Config.EXPORT_MAX_BYTES // (1024 * 1024)} МБ: {hint}."
+            )
+            return
+        
+        period = (f"{since:%d.%m.%Y}" if since else "начала") + " - " + (
+            f"{until - timedelta(days=1):%d.%m.%Y}" if until else "сегодня")
+        filename = f"requests_{(since or datetime.now()):%Y%m%d}" + (f"_{until:%Y%m%d}" if until else "") + f".{fmt}"
+        # InputFile читает файл целиком - читаем в потоке, чтобы не останавливать event loop
+        content = await asyncio.to_thread(read_file_bytes, path)
+        await context.bot.send_document(
+            chat_id=update.message.chat_id,
+            document=InputFile(content, filename=filename),
+            caption=f"📤 Заявок: {count} (с {period}), {size // 1024} КБ, {elapsed:.1f} с"
+        )
+        logger.info(f"📤 Выгрузка {fmt}: {count} заявок за {elapsed:.2f} с")
+    except Exception as e:
+        logger.error(f"❌ Ошибка выгрузки заявок: {e}")
+        await update.message.reply_text("❌ Ошибка при выгрузке заявок.")
+    finally:
+        os.remove(path)
 
 # ==================== УЛУЧШЕННЫЕ ОСНОВНЫЕ ОБРАБОТЧИКИ ====================
 
 async def show_user_requests(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """📂 Показывает заявки пользователя"""
     user_id = update.message.from_user.id
-    requests = db.get_user_requests(user_id)
     
-    if not requests:
+    # Текст списка пересобирается только после изменения заявок пользователя
+    key = ('user', user_id, db.get_data_version(f'user:{user_id}'))
+    found, requests_text, generation = list_page_cache.get(key)
+    if not found:
+        requests_text = render_user_requests(db.get_user_requests(user_id))
+        list_page_cache.put(key, requests_text, generation)
+    
+    if requests_text is None:
         keyboard = [["📝 Создать заявку", "🔙 Главное меню"]]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         
@@ -1445,6 +4486,18 @@ async def show_user_requests(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     
+    keyboard = [["📝 Создать заявку", "🔙 Главное меню"]]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    
+    await update.message.reply_text(requests_text, 
+                                  reply_markup=reply_markup,
+                                  parse_mode=ParseMode.MARKDOWN)
+
+def render_user_requests(requests: List[Dict]) -> Optional[str]:
+    """📂 Текст списка заявок пользователя (None - заявок нет)"""
+    if not requests:
+        return None
+    
     requests_text = "📂 *ВАШИ ЗАЯВКИ*\n\n"
     
     for req in requests[:15]:  # Показываем последние 15 заявок
@@ -1468,12 +4521,7 @@ async def show_user_requests(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         requests_text += "\n"
     
-    keyboard = [["📝 Создать заявку", "🔙 Главное меню"]]
-    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-    
-    await update.message.reply_text(requests_text, 
-                                  reply_markup=reply_markup,
-                                  parse_mode=ParseMode.MARKDOWN)
+    return requests_text
 
 async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """📊 Показывает статистику для пользователя"""
@@ -1543,7 +4591,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         f"5. ⭐ Оценивайте качество работы\n\n"
         f"👨‍💼 *ДЛЯ АДМИНИСТРАТОРОВ:*\n"
         f"• /admin - 👨‍💼 Админ панель\n"
-        f"• /backup - 💾 Создать бэкап\n\n"
+        f"• /backup - 💾 Создать бэкап\n"
+        f"• /board [off] - 📌 Живая доска очереди\n"
+        f"• /search текст - 🔎 Поиск заявок (также @бот текст)\n"
+        f"• /profile [сек] - 🔬 Профилирование бота\n"
+        f"• /sla [дней] - 📈 SLA-аналитика\n"
+        f"• /charts - 📉 Графики заявок, очереди и SLA\n"
+        f"• /export [xlsx] [месяц:ГГГГ-ММ] - 📤 Выгрузка заявок\n"
+        f"• /slow_queries - 🐢 Медленные SQL-запросы\n\n"
         f"📞 *ЭКСТРЕННАЯ ПОМОЩЬ:*\n"
         f"Телефон: {Config.SUPPORT_PHONE}\n"
         f"Email: {Config.SUPPORT_EMAIL}\n\n"
@@ -1562,6 +4617,11 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
     text = update.message.text
     user_id = update.message.from_user.id
     
+    # Комментарий администратора к завершаемой заявке
+    if 'completing_request' in context.user_data or (text == "🔙 Отмена" and Config.is_admin(user_id)):
+        await handle_admin_comment(update, context)
+        return
+    
     # Обработка подтверждения сброса
     if context.user_data.get('awaiting_reset_confirmation'):
         if text == "✅ Да, сбросить":
@@ -1613,6 +4673,12 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
         await admin_panel_command(update, context)
     elif text == "🔙 Назад в админку" and Config.is_admin(user_id):
         await admin_panel_command(update, context)
+    elif text == "🐢 Медленные запросы" and Config.is_admin(user_id):
+        await slow_queries_command(update, context)
+    elif text == "📈 SLA-аналитика" and Config.is_admin(user_id):
+        await sla_command(update, context)
+    elif text == "📉 Графики" and Config.is_admin(user_id):
+        await charts_command(update, context)
     else:
         keyboard = [["🔙 Главное меню"]]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1649,16 +4715,295 @@ def setup_handlers(application: Application):
     application.add_handler(CommandHandler("admin", admin_panel_command))
     application.add_handler(CommandHandler("reset", reset_command))
     application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("board", board_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("slow_queries", slow_queries_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("sla", sla_command))
+    application.add_handler(CommandHandler("charts", charts_command))
+    application.add_handler(CommandHandler("export", export_command))
     application.add_handler(request_conv_handler)
     
     # Обработчики callback (кнопки администраторов)
     application.add_handler(CallbackQueryHandler(handle_admin_buttons, pattern="^(take_|details_|complete_|feedback_)"))
+    application.add_handler(CallbackQueryHandler(handle_search_page, pattern="^search_"))
+    application.add_handler(CallbackQueryHandler(handle_chart_button, pattern="^chart_"))
     
-    # Обработчик комментариев администратора
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_comment))
+    # Поиск заявок в инлайн-режиме
+    application.add_handler(InlineQueryHandler(inline_search))
     
-    # Обработчики текстовых сообщений
+    # Обработчики текстовых сообщений (включая комментарии администратора)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_messages))
+    
+    # Замер времени работы всех обработчиков
+    for group_handlers in application.handlers.values():
+        for handler in group_handlers:
+            instrument_handler(handler)
+    
+    application.add_error_handler(error_handler)
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """🚨 Логирует необработанные ошибки обработчиков"""
+    HANDLER_ERRORS.labels(type(context.error).__name__).inc()
+    if isinstance(context.error, RetryAfter):
+        logger.warning(f"⏳ Превышен лимит Telegram, повтор через {context.error.retry_after} с")
+        return
+    logger.error(f"❌ Необработанная ошибка при обработке обновления: {context.error}", exc_info=context.error)
+
+SHEETS_ROWS_SYNCED = metrics.counter("sheets_rows_synced_total", "Строки, отправленные в Google Sheets")
+SHEETS_SYNC_RETRIES = metrics.counter("sheets_sync_retries_total", "Повторы запросов к Google Sheets")
+SHEETS_SYNC_FAILURES = metrics.counter("sheets_sync_failures_total", "Неудачные циклы синхронизации с Google Sheets")
+
+async def sheets_sync_loop(application: Application) -> None:
+    """📤 Периодически отправляет изменившиеся заявки в Google Sheets"""
+    # Клиент (gspread, авторизация, запрос к таблице) создается в задаче, чтобы не задерживать начало опроса
+    from sheets_sync import SheetsSync, make_client
+    try:
+        client = await asyncio.to_thread(
+            make_client, Config.GOOGLE_SHEETS_ID, Config.GOOGLE_CREDENTIALS_FILE, Config.GOOGLE_SHEETS_BASE_URL
+        )
+    except Exception as e:
+        logger.error(f"❌ Синхронизация с Google Sheets не запущена: {e}")
+        return
+    sync = SheetsSync(db.db_path, client, sheet=Config.SHEETS_WORKSHEET, batch_size=Config.SHEETS_BATCH_SIZE)
+    application.bot_data['sheets_sync'] = sync
+    logger.info(f"📤 Синхронизация с Google Sheets каждые {Config.SHEETS_SYNC_INTERVAL} с")
+    while True:
+        retries = sync.retries
+        try:
+            # Поток не прервать отменой задачи: при отмене дожидаемся его, чтобы не закрыть клиент под batchUpdate
+            running = asyncio.ensure_future(asyncio.to_thread(sync.sync))
+            try:
+                pushed = await asyncio.shield(running)
+            except asyncio.CancelledError:
+                sync.stop()
+                await asyncio.gather(running, return_exceptions=True)
+                raise
+            if pushed:
+                SHEETS_ROWS_SYNCED.inc(pushed)
+                logger.info(f"📤 В Google Sheets отправлено строк: {pushed}")
+        except Exception as e:
+            SHEETS_SYNC_FAILURES.inc()
+            logger.error(f"❌ Ошибка синхронизации с Google Sheets: {e}")
+        SHEETS_SYNC_RETRIES.inc(sync.retries - retries)
+        await asyncio.sleep(Config.SHEETS_SYNC_INTERVAL)
+
+async def archive_loop() -> None:
+    """🗄️ Периодически переносит старые выполненные заявки в архив"""
+    while True:
+        try:
+            await asyncio.to_thread(db.archive_completed, Config.ARCHIVE_AFTER_DAYS, Config.ARCHIVE_BATCH_SIZE)
+        except Exception as e:
+            logger.error(f"❌ Ошибка архивации заявок: {e}")
+        await asyncio.sleep(Config.ARCHIVE_INTERVAL)
+
+async def migration_backfills(stop: threading.Event) -> None:
+    """🐢 Долгие шаги миграций схемы в фоне, не останавливая бота"""
+    try:
+        await asyncio.to_thread(db.run_migration_backfills, stop)
+    except Exception as e:
+        logger.error(f"❌ Ошибка фонового шага миграции: {e}")
+
+async def backup_loop() -> None:
+    """💾 Резервная копия базы раз в AUTO_BACKUP_HOURS (отсчет от последней копии в BACKUP_DIR)"""
+    interval = Config.AUTO_BACKUP_HOURS * 3600
+    while True:
+        try:
+            backups = [
+                os.path.getmtime(os.path.join(Config.BACKUP_DIR, filename))
+                for filename in os.listdir(Config.BACKUP_DIR)
+                if filename.startswith('backup_') and filename.endswith('.db')
+            ]
+            # После перезапуска или смены лидера копия не делается раньше срока
+            delay = max(backups, default=0) + interval - unix_time()
+            if delay <= 0:
+                await asyncio.to_thread(db.backup_database)
+                delay = interval
+        except Exception as e:
+            logger.error(f"❌ Ошибка автоматического резервного копирования: {e}")
+            delay = interval
+        await asyncio.sleep(delay)
+
+async def start_singleton_jobs(application: Application) -> None:
+    """🧭 Фоновые задачи, которые должны работать в одном экземпляре на базу"""
+    if Config.GOOGLE_SHEETS_ID:
+        application.bot_data['sheets_sync_task'] = asyncio.create_task(sheets_sync_loop(application))
+    if db.migrator.pending_backfills():
+        stop = application.bot_data['migrations_stop'] = threading.Event()
+        application.bot_data['migrations_task'] = asyncio.create_task(migration_backfills(stop))
+    if Config.ARCHIVE_AFTER_DAYS:
+        application.bot_data['archive_task'] = asyncio.create_task(archive_loop())
+    if Config.AUTO_BACKUP_HOURS:
+        application.bot_data['backup_task'] = asyncio.create_task(backup_loop())
+
+async def stop_singleton_jobs(application: Application) -> None:
+    """⏹️ Останавливает фоновые задачи (остановка бота или потеря лидерства)"""
+    stop = application.bot_data.pop('migrations_stop', None)
+    if stop is not None:
+        # Поток шага дописывает текущую пачку и выходит, позиция сохранена для следующего запуска
+        stop.set()
+        await application.bot_data.pop('migrations_task')
+    for name in ('archive_task', 'backup_task'):
+        task = application.bot_data.pop(name, None)
+        if task is not None:
+            task.cancel()
+    task = application.bot_data.pop('sheets_sync_task', None)
+    if task is not None:
+        # Задача завершается только после потока синхронизации - клиент закрывается после нее
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    sync = application.bot_data.pop('sheets_sync', None)
+    if sync is not None:
+        sync.client.close()
+
+async def leadership_loop(application: Application, lease: 'LeaderLease') -> None:
+    """👑 Режим воркеров: фоновые задачи запускает только держатель аренды"""
+    leader = False
+    try:
+        while True:
+            try:
+                acquired = await asyncio.to_thread(lease.acquire)
+            except Exception as e:
+                logger.error(f"❌ Ошибка продления аренды лидера: {e}")
+                acquired = False
+            if acquired and not leader:
+                logger.info(f"👑 Воркер {worker_index} стал лидером, запускаем фоновые задачи")
+                await start_singleton_jobs(application)
+            elif leader and not acquired:
+                logger.warning(f"⚠️ Воркер {worker_index} потерял лидерство, фоновые задачи остановлены")
+                await stop_singleton_jobs(application)
+            leader = acquired
+            await asyncio.sleep(Config.LEADER_LEASE_SECONDS / 3)
+    finally:
+        if leader:
+            await stop_singleton_jobs(application)
+            await asyncio.to_thread(lease.release)
+
+async def post_init(application: Application) -> None:
+    """🚀 Действия после инициализации приложения"""
+    PENDING_UPDATES.func = application.update_queue.qsize
+    queue_boards.attach(application)
+    if Config.METRICS_PORT:
+        # У каждого воркера свой порт: METRICS_PORT + номер воркера
+        application.bot_data['metrics_server'] = await start_metrics_server(
+            Config.METRICS_HOST, Config.METRICS_PORT + (worker_index or 0)
+        )
+    if worker_index is None:
+        await start_singleton_jobs(application)
+    else:
+        from sharding import LeaderLease
+        lease = LeaderLease(db._connect, 'background_jobs', Config.LEADER_LEASE_SECONDS)
+        application.bot_data['leadership_task'] = asyncio.create_task(leadership_loop(application, lease))
+
+async def post_shutdown(application: Application) -> None:
+    """🛑 Освобождение ресурсов при остановке"""
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    task = application.bot_data.pop('leadership_task', None)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await stop_singleton_jobs(application)
+    if media_store is not None:
+        await media_store.close()
+    if chart_service is not None:
+        chart_service.shutdown()
+
+def build_application(token: str, request: BaseRequest = None,
+                      get_updates_request: BaseRequest = None,
+                      base_url: str = None, base_file_url: str = None) -> Application:
+    """🏗️ Создает приложение со всеми обработчиками"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .application_class(BotApplication)
+        .request(request or InstrumentedRequest(connection_pool_size=256))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if Config.SEND_RATE_PER_SECOND:
+        # Лимит Telegram общий на бота: воркеры делят бюджет поровну
+        rate = Config.SEND_RATE_PER_SECOND / (Config.WORKERS if worker_index is not None else 1)
+        builder = builder.rate_limiter(PrioritySendScheduler(rate, fair_every=Config.SEND_FAIR_EVERY))
+    builder = builder.get_updates_request(get_updates_request or SharedTLSRequest())
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    
+    application = builder.build()
+    setup_handlers(application)
+    return application
+
+# ==================== РЕЖИМ ВОРКЕРОВ ====================
+
+def run_application(application: Application) -> None:
+    """📡 Прием обновлений: вебхук, если задан WEBHOOK_URL, иначе опрос getUpdates"""
+    if Config.WEBHOOK_URL:
+        # Нужен python-telegram-bot[webhooks]
+        application.run_webhook(
+            listen=Config.WEBHOOK_LISTEN,
+            port=Config.WEBHOOK_PORT,
+            url_path=urlsplit(Config.WEBHOOK_URL).path.lstrip('/'),
+            webhook_url=Config.WEBHOOK_URL,
+            secret_token=Config.WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
+
+def worker_main(index: int, inbox) -> None:
+    """👷 Процесс-воркер: полный набор обработчиков, обновления из очереди front-процесса"""
+    global worker_index, shared_state
+    # Ctrl+C получает вся группа процессов: воркер дорабатывает очередь и ждет пустого сообщения
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Обновления записывает front-процесс
+    init_bot(record_updates=False)
+    worker_index = index
+    shared_state = SharedStateSync()
+    if Config.ADMIN_DIGEST_SECONDS:
+        # Открытые сводки живут в памяти процесса, а кнопки сводки приходят в воркер администратора
+        logger.warning("⚠️ Сводки новых заявок не работают в режиме воркеров, уведомления приходят по одному")
+        Config.ADMIN_DIGEST_SECONDS = 0
+    
+    application = build_application(
+        Config.BOT_TOKEN,
+        base_url=Config.BOT_API_BASE_URL,
+        base_file_url=Config.BOT_API_BASE_FILE_URL
+    )
+    logger.info(f"👷 Воркер {index} запущен (PID {os.getpid()})")
+    from sharding import serve_inbox
+    asyncio.run(serve_inbox(application, inbox))
+    logger.info(f"👷 Воркер {index} остановлен")
+
+def run_sharded() -> None:
+    """🔀 Front-процесс: принимает обновления и раскладывает их по воркерам по chat_id"""
+    from sharding import ShardRouter, start_workers, stop_workers
+    # Несколько процессов пишут в одну базу: WAL, чтобы чтения не ждали записей
+    db.enable_wal()
+    workers, inboxes = start_workers(worker_main, Config.WORKERS)
+    router = ShardRouter(inboxes)
+    
+    async def route(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if update_recorder is not None:
+            update_recorder.record(update)
+        router.route(update)
+    
+    builder = Application.builder().token(Config.BOT_TOKEN).request(InstrumentedRequest())
+    if Config.BOT_API_BASE_URL:
+        builder = builder.base_url(Config.BOT_API_BASE_URL)
+    if Config.BOT_API_BASE_FILE_URL:
+        builder = builder.base_file_url(Config.BOT_API_BASE_FILE_URL)
+    front = builder.build()
+    front.add_handler(TypeHandler(Update, route))
+    logger.info(f"🔀 Обновления распределяются по {Config.WORKERS} воркерам")
+    try:
+        run_application(front)
+    finally:
+        router.close()
+        stop_workers(workers)
+        logger.info(f"🔀 Обновлений по воркерам: {router.routed}")
 
 # ==================== ГЛАВНАЯ ФУНКЦИЯ ====================
 
@@ -1671,6 +5016,9 @@ def main() -> None:
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
         
+        # Окружение, логи и база
+        init_bot()
+        
         # Проверка конфигурации
         Config.validate_config()
         print("✅ Конфигурация проверена")
@@ -1680,13 +5028,20 @@ def main() -> None:
             print("❌ Токен бота не найден!")
             return
         
-        # Создание приложения
-        print("🤖 Создание приложения...")
-        application = Application.builder().token(Config.BOT_TOKEN).build()
+        if Config.WORKERS > 1:
+            print(f"🔀 Запуск {Config.WORKERS} воркеров...")
+            run_sharded()
+            return
         
-        # Настройка обработчиков
-        print("🔧 Настройка обработчиков...")
-        setup_handlers(application)
+        # Создание приложения
+        print("🤖 Создание приложения и настройка обработчиков...")
+        application = build_application(
+            Config.BOT_TOKEN,
+            base_url=Config.BOT_API_BASE_URL,
+            base_file_url=Config.BOT_API_BASE_FILE_URL
+        )
+        if Config.BOT_API_BASE_URL:
+            logger.warning(f"⚠️ Используется нестандартный Bot API: {Config.BOT_API_BASE_URL}")
         print("✅ Все компоненты настроены")
         
         logger.info("🚀 Бот IT отдела успешно запущен!")
@@ -1706,12 +5061,13 @@ def main() -> None:
         print("   • 🔔 Умные уведомления")
         print("   • 📈 Аналитика эффективности")
         print("   • 🛑 Graceful shutdown обработка")
+        print("   • 📊 Метрики в формате Prometheus (/metrics)")
         print("   • 🎯 Профессиональные шаблоны сообщений")
         print("\n🚀 Бот готов к работе!")
         
         # Запуск бота
-        print("🔄 Запуск опроса...")
-        application.run_polling()
+        print("🔄 Запуск опроса..." if not Config.WEBHOOK_URL else f"🔄 Запуск вебхука {Config.WEBHOOK_URL}...")
+        run_application(application)
 
     except KeyboardInterrupt:
         logger.info("🛑 Бот остановлен пользователем")
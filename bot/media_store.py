@@ -0,0 +1,188 @@
+"""
+🗃️ Локальное хранилище вложений заявок с адресацией по file_unique_id
+
+В базе у вложения есть только file_id Telegram, поэтому выгрузкам,
+архивам и резервным копиям пришлось бы каждый раз скачивать файлы заново.
+После создания заявки хранилище в фоне скачивает ее вложения в каталог,
+где путь файла определяется его file_unique_id (постоянный ID одного и
+того же файла у любых чатов и ботов): повторно присланный файл не
+скачивается, а последующее чтение - обычное чтение с диска.
+
+Загрузки идут не больше чем по concurrency одновременно и пишутся на диск
+потоком через временный файл, который переименовывается по готовности.
+Объем каталога ограничен: при превышении удаляются давно не читанные
+файлы (время последнего чтения - mtime файла, поэтому учет общий для
+нескольких процессов с одним каталогом). Обход каталога, запись и удаление
+файлов идут в потоках, чтобы не останавливать event loop.
+"""
+import asyncio
+import logging
+import os
+import re
+import ssl
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import httpx
+from telegram import Bot
+
+logger = logging.getLogger(__name__)
+
+# getFile Bot API отдает файлы не больше 20 МБ
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# file_unique_id - base64url; все остальное не допускаем в путь
+_UNIQUE_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+
+class MediaStore:
+    """🗃️ Каталог root/<2 символа>/<file_unique_id> с фоновыми загрузками и LRU по объему"""
+
+    def __init__(self, root: str, max_bytes: int, concurrency: int = 2,
+                 verify: Union[bool, ssl.SSLContext] = True, timeout: float = 60.0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.verify = verify
+        self.timeout = timeout
+        self.total_bytes = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.evicted = 0
+        # file_unique_id -> размер, от давно не читанных к недавним
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._scanned = False
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def path_for(self, unique_id: str) -> Path:
+        """📁 Путь файла в хранилище (подкаталоги по первым символам, чтобы не копить тысячи файлов в одном)"""
+        if not _UNIQUE_ID_RE.fullmatch(unique_id):
+            raise ValueError(f"Недопустимый file_unique_id: {unique_id!r}")
+        return self.root / unique_id[:2] / unique_id
+
+    def _read_dir(self) -> 'OrderedDict[str, int]':
+        """🔍 Файлы каталога от давно не читанных к недавним (выполняется в потоке)"""
+        found = []
+        if self.root.is_dir():
+            for path in self.root.glob('*/*'):
+                if path.suffix == '.part' or not path.is_file():
+                    continue
+                stat = path.stat()
+                found.append((stat.st_mtime, path.name, stat.st_size))
+        found.sort()
+        return OrderedDict((unique_id, size) for _, unique_id, size in found)
+
+    async def _scan(self):
+        """🔍 Перечитывает каталог: диск - источник истины (файлы мог добавить или удалить другой процесс)"""
+        self._entries = await asyncio.to_thread(self._read_dir)
+        self.total_bytes = sum(self._entries.values())
+        self._scanned = True
+
+    def get(self, unique_id: str) -> Optional[Path]:
+        """📂 Локальная копия файла или None (чтение отмечает файл как недавно использованный)
+
+        Каталог не обходится: проверка - одно обновление mtime файла.
+        """
+        path = self.path_for(unique_id)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Еще не скачан или вытеснен другим процессом
+            self.total_bytes -= self._entries.pop(unique_id, 0)
+            return None
+        if unique_id in self._entries:
+            self._entries.move_to_end(unique_id)
+        return path
+
+    def schedule(self, bot: Bot, media_files: Iterable[Dict]) -> List[asyncio.Task]:
+        """📥 Ставит в фон загрузку вложений, которых еще нет (вызывается из event loop)"""
+        tasks = []
+        loop = asyncio.get_running_loop()
+        for media in media_files:
+            unique_id = media.get('file_unique_id')
+            if not unique_id or unique_id in self._entries or unique_id in self._pending:
+                continue
+            if (media.get('file_size') or 0) > min(MAX_DOWNLOAD_BYTES, self.max_bytes):
+                continue
+            task = loop.create_task(self.fetch(bot, media['file_id'], unique_id))
+            self._pending[unique_id] = task
+            task.add_done_callback(lambda _, unique_id=unique_id: self._pending.pop(unique_id, None))
+            tasks.append(task)
+        return tasks
+
+    async def fetch(self, bot: Bot, file_id: str, unique_id: str) -> Optional[Path]:
+        """⬇️ Скачивает файл потоком во временный файл и переносит его на место"""
+        path = self.path_for(unique_id)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if self._client is None:
+            self._client = httpx.AsyncClient(verify=self.verify, timeout=self.timeout)
+        partial = path.with_suffix('.part')
+        async with self._semaphore:
+            if not self._scanned:
+                await self._scan()
+            if unique_id in self._entries:
+                # Скачан до обхода каталога (например, другим процессом)
+                return path
+            try:
+                telegram_file = await bot.get_file(file_id)
+                await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+                size = 0
+                async with self._client.stream('GET', telegram_file.file_path) as response:
+                    response.raise_for_status()
+                    output = await asyncio.to_thread(open, partial, 'wb')
+                    try:
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            await asyncio.to_thread(output.write, chunk)
+                            size += len(chunk)
+                    finally:
+                        await asyncio.to_thread(output.close)
+                await asyncio.to_thread(os.replace, partial, path)
+            except asyncio.CancelledError:
+                partial.unlink(missing_ok=True)
+                raise
+            except Exception as e:
+                await asyncio.to_thread(partial.unlink, missing_ok=True)
+                self.failed += 1
+                # Текст ошибки httpx содержит URL файла, а в нем - токен бота
+                if isinstance(e, httpx.HTTPStatusError):
+                    reason = f"HTTP {e.response.status_code}"
+                else:
+                    reason = type(e).__name__
+                logger.warning(f"⚠️ Не удалось сохранить вложение {unique_id}: {reason}")
+                return None
+        self.downloaded += 1
+        self.total_bytes += size - self._entries.pop(unique_id, 0)
+        self._entries[unique_id] = size
+        await self._evict()
+        return path
+
+    async def _evict(self):
+        """🧹 Удаляет давно не читанные файлы, пока объем выше лимита"""
+        if self.total_bytes <= self.max_bytes:
+            return
+        await self._scan()
+        victims = []
+        while self.total_bytes > self.max_bytes and self._entries:
+            unique_id, size = self._entries.popitem(last=False)
+            victims.append(self.path_for(unique_id))
+            self.total_bytes -= size
+        self.evicted += len(victims)
+        await asyncio.to_thread(self._unlink, victims)
+
+    @staticmethod
+    def _unlink(paths: List[Path]):
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    async def close(self):
+        """🛑 Отменяет незавершенные загрузки и закрывает HTTP-клиент"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,171 @@
+"""
+🧬 Версионные миграции схемы SQLite с фоновым дозаполнением
+
+Каждая миграция - номер версии, быстрая схемная часть (таблицы, колонки,
+триггеры) и необязательные фоновые шаги. Схемная часть выполняется при
+старте в одной транзакции вместе с записью номера в PRAGMA user_version и
+в таблицу schema_migrations, поэтому миграция применяется целиком или не
+применяется вовсе, а несколько процессов не выполнят ее дважды.
+
+Долгие шаги (заполнение колонок, построение индексов) выполняются в фоне
+пачками: одна пачка - одна короткая транзакция, в которой сохраняется и
+позиция шага в schema_backfills. После перезапуска шаг продолжается с
+сохраненной позиции, бот все это время обслуживает пользователей.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пачка: (курсор, позиция после прошлой пачки или None, размер пачки) -> новая позиция, None - шаг завершен
+BatchFunction = Callable[[sqlite3.Cursor, Optional[int], int], Optional[int]]
+
+@dataclass(frozen=True)
+class Backfill:
+    """🐢 Фоновый шаг миграции, выполняемый пачками"""
+    name: str
+    batch: BatchFunction
+
+@dataclass(frozen=True)
+class Migration:
+    """🧬 Миграция: схемная часть при старте и фоновые шаги после него"""
+    version: int
+    name: str
+    apply: Callable[[sqlite3.Cursor], None]
+    backfills: Tuple[Backfill, ...] = ()
+
+class MigrationRunner:
+    """🧬 Применяет миграции по PRAGMA user_version и выполняет фоновые шаги"""
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], migrations: Sequence[Migration]):
+        versions = [migration.version for migration in migrations]
+        if versions != sorted(set(versions)):
+            raise ValueError(f"Номера миграций должны возрастать без повторов: {versions}")
+        self.connect = connect
+        self.migrations = list(migrations)
+        self._backfills = {
+            (migration.version, backfill.name): backfill for migration in migrations for backfill in migration.backfills
+        }
+
+    def _open(self) -> sqlite3.Connection:
+        conn = self.connect()
+        # Транзакциями управляем сами: DDL, данные и номер версии должны фиксироваться вместе
+        conn.isolation_level = None
+        return conn
+
+    def migrate(self) -> List[int]:
+        """⬆️ Применяет недостающие миграции, возвращает их номера"""
+        applied = []
+        conn = self._open()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_backfills (
+                    version INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    position INTEGER,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT,
+                    PRIMARY KEY (version, name)
+                )
+            ''')
+            for migration in self.migrations:
+                if migration.version <= cursor.execute('PRAGMA user_version').fetchone()[0]:
+                    continue
+                # IMMEDIATE сразу берет блокировку записи: второй процесс дождется и увидит новую версию
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    if migration.version <= cursor.execute('PRAGMA user_version').fetchone()[0]:
+                        cursor.execute('COMMIT')
+                        continue
+                    started = time.perf_counter()
+                    migration.apply(cursor)
+                    now = datetime.now().isoformat()
+                    cursor.execute(
+                        'INSERT OR REPLACE INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                        (migration.version, migration.name, now)
+                    )
+                    cursor.executemany(
+                        'INSERT OR IGNORE INTO schema_backfills (version, name, updated_at) VALUES (?, ?, ?)',
+                        [(migration.version, backfill.name, now) for backfill in migration.backfills]
+                    )
+                    cursor.execute(f'PRAGMA user_version = {int(migration.version)}')
+                    cursor.execute('COMMIT')
+                except BaseException:
+                    cursor.execute('ROLLBACK')
+                    raise
+                applied.append(migration.version)
+                logger.info(f"🧬 Миграция {migration.version} «{migration.name}» применена "
+                            f"за {(time.perf_counter() - started) * 1000:.0f} мс")
+        finally:
+            conn.close()
+        return applied
+
+    def pending_backfills(self) -> List[Tuple[int, str, Optional[int]]]:
+        """📋 Незавершенные фоновые шаги: (версия, имя, позиция)"""
+        conn = self._open()
+        try:
+            rows = conn.execute(
+                'SELECT version, name, position FROM schema_backfills WHERE done = 0 ORDER BY version, rowid'
+            ).fetchall()
+        finally:
+            conn.close()
+        return [row for row in rows if (row[0], row[1]) in self._backfills]
+
+    def run_backfills(self, batch_size: int = 1000, pause: float = 0.0,
+                      stop: Optional[threading.Event] = None) -> int:
+        """🐢 Выполняет фоновые шаги до конца (или до stop), возвращает число пачек
+
+        pause - пауза между пачками, чтобы обработчики бота успевали писать в базу.
+        """
+        batches = 0
+        conn = self._open()
+        try:
+            cursor = conn.cursor()
+            for version, name, _ in self.pending_backfills():
+                backfill = self._backfills[(version, name)]
+                started = time.perf_counter()
+                while True:
+                    if stop is not None and stop.is_set():
+                        return batches
+                    cursor.execute('BEGIN IMMEDIATE')
+                    try:
+                        # Позицию читаем под блокировкой: шаг мог продвинуть другой процесс
+                        position, done = cursor.execute(
+                            'SELECT position, done FROM schema_backfills WHERE version = ? AND name = ?', (version, name)
+                        ).fetchone()
+                        if done:
+                            cursor.execute('COMMIT')
+                            break
+                        position = backfill.batch(cursor, position, batch_size)
+                        cursor.execute(
+                            'UPDATE schema_backfills SET position = ?, done = ?, updated_at = ? '
+                            'WHERE version = ? AND name = ?',
+                            (position, int(position is None), datetime.now().isoformat(), version, name)
+                        )
+                        cursor.execute('COMMIT')
+                    except BaseException:
+                        cursor.execute('ROLLBACK')
+                        raise
+                    batches += 1
+                    if position is None:
+                        logger.info(f"🐢 Фоновый шаг миграции {version} «{name}» завершен "
+                                    f"за {time.perf_counter() - started:.1f} с")
+                        break
+                    if pause:
+                        time.sleep(pause)
+        finally:
+            conn.close()
+        return batches
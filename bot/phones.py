@@ -0,0 +1,60 @@
+"""
+📞 Нормализация телефонных номеров к виду +7XXXXXXXXXX (E.164)
+
+Почти все номера - российские мобильные в одной из привычных записей
+(+7 916 123-45-67, 8 (916) 123-45-67, 79161234567). Они разбираются
+предкомпилированным выражением без phonenumbers: для мобильных диапазонов
+9XX библиотека признает верным любой номер, результат совпадает. Остальные
+номера проверяет phonenumbers (импортируется при первой необходимости),
+а если он не разобрал строку - прежний запасной разбор.
+
+Пользователи раз за разом вводят одни и те же номера, поэтому результаты
+запоминаются в LRU по исходной строке.
+"""
+import re
+from functools import lru_cache
+from typing import Tuple
+
+MEMO_SIZE = 4096
+INVALID_NUMBER = "Неверный номер телефона"
+INVALID_FORMAT = "Неверный формат номера. Используйте российский номер"
+
+_SEPARATORS_RE = re.compile(r'[\s().-]+')
+# [0-9], а не \d: \d совпадает и с цифрами других алфавитов
+_RU_MOBILE_RE = re.compile(r'(?:\+7|8|7)?(9[0-9]{9})')
+_NOT_PHONE_CHAR_RE = re.compile(r'[^\d+]')
+
+def _parse(phone: str) -> Tuple[bool, str]:
+    """🐢 Медленный путь: phonenumbers, затем простой разбор российских номеров"""
+    import phonenumbers
+    try:
+        parsed = phonenumbers.parse(phone, "RU")
+        if phonenumbers.is_valid_number(parsed):
+            return True, phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
+        return False, INVALID_NUMBER
+    except phonenumbers.NumberParseException:
+        cleaned = _NOT_PHONE_CHAR_RE.sub('', phone)
+        if cleaned.startswith('+7') and len(cleaned) == 12:
+            return True, cleaned
+        elif cleaned.startswith('8') and len(cleaned) == 11:
+            return True, '+7' + cleaned[1:]
+        elif len(cleaned) == 10:
+            return True, '+7' + cleaned
+        elif len(cleaned) == 11 and cleaned.startswith('7'):
+            return True, '+' + cleaned
+        return False, INVALID_FORMAT
+
+@lru_cache(maxsize=MEMO_SIZE)
+def normalize_phone(phone: str) -> Tuple[bool, str]:
+    """📞 (True, номер в E.164) или (False, текст ошибки для пользователя)"""
+    match = _RU_MOBILE_RE.fullmatch(_SEPARATORS_RE.sub('', phone))
+    if match:
+        return True, '+7' + match.group(1)
+    return _parse(phone)
+
+def renormalized(phone: str) -> str:
+    """🔁 Сохраненный номер в E.164; номер, который не разобрать, остается как есть"""
+    if not phone:
+        return phone
+    is_valid, normalized = normalize_phone(phone.strip())
+    return normalized if is_valid else phone
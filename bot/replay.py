@@ -0,0 +1,143 @@
+"""
+📼 Воспроизведение записанного трафика обновлений
+
+Читает JSONL, записанный UpdateRecorder (RECORD_UPDATES_PATH), и подает
+обновления в приложение build_application() / setup_handlers() с заглушкой
+Bot API на копии снимка базы. Скорость: 1x и 10x сохраняют паузы между
+обновлениями из записи, max подает их без пауз.
+
+Запуск:
+    python bot/replay.py updates.jsonl.3 updates.jsonl.2 updates.jsonl.1 updates.jsonl \\
+        --db backups/backup_20240101_090000.db --speed 10 --json build_a.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Dict, Iterator, List
+
+from telegram import Update
+
+from benchmark import BENCH_TOKEN, RecordingRequest, ScenarioStats, load_bot, print_results
+
+def read_capture(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    """📖 Читает записи из файлов захвата в заданном порядке"""
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def scenario_name(update: Dict[str, Any]) -> str:
+    """🏷️ Группа для отчета: кнопка меню / команда / тип callback"""
+    if 'callback_query' in update:
+        return 'callback:' + str(update['callback_query'].get('data', '')).split('_')[0]
+    message = update.get('message') or update.get('edited_message') or {}
+    text = message.get('text', '')
+    if text.startswith('/'):
+        return text.split()[0]
+    if text and not text[0].isalnum() and not text.startswith('+'):
+        return text[:24]
+    if any(key in message for key in ('photo', 'video', 'document', 'voice')):
+        return 'media'
+    return 'text' if text else next((key for key in update if key != 'update_id'), 'other')
+
+async def replay(bot, records: List[Dict[str, Any]], speed: float) -> Dict[str, Any]:
+    """▶️ Подает записи в приложение и собирает замеры"""
+    request = RecordingRequest(record=False)
+    application = bot.build_application(BENCH_TOKEN, request=request, get_updates_request=RecordingRequest())
+    await application.initialize()
+
+    # Администраторы в записи обезличены - выдаем права их псевдонимам
+    for record in records:
+        if record.get('admin'):
+            user = Update.de_json(record['update'], application.bot).effective_user
+            if user and user.id not in bot.Config.SUPER_ADMIN_IDS:
+                bot.Config.SUPER_ADMIN_IDS.append(user.id)
+
+    stats: Dict[str, ScenarioStats] = {}
+    query_stats = bot.query_stats
+    max_lag = 0.0
+    started = perf_counter()
+    first_ts = records[0]['ts'] if records else 0.0
+    try:
+        for record in records:
+            if speed:
+                due = (record['ts'] - first_ts) / speed
+                delay = due - (perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    max_lag = max(max_lag, -delay)
+
+            update = Update.de_json(record['update'], application.bot)
+            scenario = stats.setdefault(scenario_name(record['update']), ScenarioStats(scenario_name(record['update'])))
+            db_time, db_count, api_calls = query_stats.total_time, query_stats.total_count, request.call_count
+            began = perf_counter()
+            await application.process_update(update)
+            elapsed = perf_counter() - began
+            scenario.latencies.append(elapsed)
+            scenario.wall_time += elapsed
+            scenario.db_time += query_stats.total_time - db_time
+            scenario.db_queries += query_stats.total_count - db_count
+            scenario.api_calls += request.call_count - api_calls
+    finally:
+        await application.shutdown()
+
+    wall = perf_counter() - started
+    results = sorted((item.summary() for item in stats.values()), key=lambda row: row['updates'], reverse=True)
+    overall = ScenarioStats("ВСЕГО")
+    for item in stats.values():
+        overall.latencies.extend(item.latencies)
+        overall.wall_time += item.wall_time
+        overall.db_time += item.db_time
+        overall.db_queries += item.db_queries
+        overall.api_calls += item.api_calls
+    results.append(overall.summary())
+    return {"results": results, "wall_seconds": wall, "max_lag_seconds": max_lag, "updates": len(records)}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных обновлений")
+    parser.add_argument('captures', nargs='+', help="файлы захвата в хронологическом порядке")
+    parser.add_argument('--db', required=True, help="снимок базы (копируется, оригинал не меняется)")
+    parser.add_argument('--speed', default='max', help="1, 10 или max")
+    parser.add_argument('--limit', type=int, default=0, help="воспроизвести только первые N обновлений")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'itsbs_replay'))
+    parser.add_argument('--json', help="сохранить результаты в JSON для сравнения сборок")
+    args = parser.parse_args()
+
+    speed = 0.0 if args.speed == 'max' else float(args.speed.rstrip('x'))
+    captures = [os.path.abspath(path) for path in args.captures]
+    snapshot = os.path.abspath(args.db)
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    bot = load_bot(os.path.abspath(args.workdir))
+    db_path = os.path.join(os.getcwd(), 'replay.db')
+    shutil.copyfile(snapshot, db_path)
+    bot.db = bot.EnhancedDatabase(db_path)
+    # Снимок мог быть снят до последних миграций - фоновые шаги выполняем до воспроизведения
+    bot.db.migrator.run_backfills(bot.Config.MIGRATION_BATCH_SIZE)
+
+    records = list(read_capture(captures))
+    if args.limit:
+        records = records[:args.limit]
+    print(f"📼 Воспроизведение {len(records)} обновлений со скоростью {args.speed}...")
+
+    report = asyncio.run(replay(bot, records, speed))
+    print_results(f"Воспроизведение: {len(records)} обновлений, скорость {args.speed}", report['results'])
+    print(f"\nВремя прогона: {report['wall_seconds']:.1f} с, макс. отставание от записи: "
+          f"{report['max_lag_seconds']:.2f} с")
+
+    if json_path:
+        report.update({"captures": captures, "snapshot": snapshot, "speed": args.speed,
+                       "started_at": datetime.now().isoformat()})
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {json_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+🔀 Многопроцессный режим: воркеры по chat_id и лидер для фоновых задач
+
+Один процесс с одним event loop упирается в одно ядро. В этом режиме
+front-процесс только принимает обновления (опросом или вебхуком) и
+раскладывает их по N процессам-воркерам по остатку от деления chat_id:
+все обновления одного чата попадают в один воркер и обрабатываются там по
+очереди, поэтому порядок диалога сохраняется, а разные чаты работают на
+разных ядрах. Каждый воркер - обычное приложение с setup_handlers.
+
+Задачи, которые должны работать в одном экземпляре (резервные копии,
+архивация, выгрузка в Google Sheets, фоновые шаги миграций), выполняет
+только лидер - воркер, который держит аренду в общей базе (leader_leases).
+Лидер продлевает аренду; если он завис или упал, аренда истекает и ее
+забирает другой воркер.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue
+import socket
+import sqlite3
+import time
+from typing import Callable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+def shard_key(update: Update) -> Optional[int]:
+    """🔑 Ключ распределения: ID чата, для инлайн-запросов - ID пользователя"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return None
+
+def shard_for(update: Update, workers: int) -> int:
+    """🎯 Номер воркера для обновления (обновления без чата и пользователя - нулевому)"""
+    key = shard_key(update)
+    return key % workers if key is not None else 0
+
+class ShardRouter:
+    """🔀 Раскладывает обновления по очередям воркеров (front-процесс)"""
+
+    def __init__(self, inboxes: List[multiprocessing.Queue]):
+        self.inboxes = inboxes
+        self.routed = [0] * len(inboxes)
+
+    def route(self, update: Update) -> int:
+        """📮 Отправляет обновление воркеру его чата, возвращает номер воркера"""
+        index = shard_for(update, len(self.inboxes))
+        self.inboxes[index].put(json.dumps(update.to_dict(), ensure_ascii=False))
+        self.routed[index] += 1
+        return index
+
+    def close(self):
+        """🛑 Пустое сообщение - сигнал воркеру дообработать очередь и завершиться"""
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+def start_workers(target: Callable, count: int) -> Tuple[List[multiprocessing.Process], List[multiprocessing.Queue]]:
+    """🚀 Запускает count воркеров target(index, inbox), возвращает процессы и их очереди
+
+    Процессы создаются через spawn: воркер получает чистый интерпретатор,
+    а не копию front-процесса с его потоками и соединениями.
+    """
+    context = multiprocessing.get_context('spawn')
+    inboxes = [context.Queue() for _ in range(count)]
+    workers = [
+        context.Process(target=target, args=(index, inbox), name=f'bot-worker-{index}', daemon=True)
+        for index, inbox in enumerate(inboxes)
+    ]
+    for process in workers:
+        process.start()
+    return workers, inboxes
+
+def stop_workers(workers: List[multiprocessing.Process], timeout: float = 30.0):
+    """⏹️ Ждет завершения воркеров после ShardRouter.close, зависшие останавливает"""
+    deadline = time.monotonic() + timeout
+    for process in workers:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning(f"⚠️ Воркер {process.name} не завершился за {timeout:.0f} с, останавливаем")
+            process.terminate()
+            process.join()
+
+async def serve_inbox(application: Application, inbox: multiprocessing.Queue, poll_interval: float = 1.0):
+    """📥 Жизненный цикл приложения воркера: обновления берутся из очереди front-процесса
+
+    Повторяет порядок run_polling (post_init, start ... stop, post_shutdown),
+    только вместо getUpdates - очередь. Обновления обрабатываются по одному,
+    в порядке поступления. Воркер завершается по пустому сообщению или если
+    front-процесс пропал.
+    """
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        while True:
+            try:
+                data = await loop.run_in_executor(None, inbox.get, True, poll_interval)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    logger.warning("⚠️ Front-процесс завершился, воркер останавливается")
+                    break
+                continue
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(json.loads(data), application.bot))
+    finally:
+        # stop() дожидается обработки уже поставленных в очередь обновлений
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+class LeaderLease:
+    """👑 Аренда лидерства в общей базе SQLite
+
+    Таблица leader_leases(name, holder, expires_at) создается миграцией.
+    Захват и продление - один UPSERT: строка переходит к новому владельцу,
+    только если аренда свободна, уже его или истекла.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], name: str, ttl: float,
+                 holder: Optional[str] = None):
+        self.connect = connect
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f"{socket.gethostname()}:{multiprocessing.current_process().pid}"
+
+    def acquire(self) -> bool:
+        """🔁 Захватывает или продлевает аренду, True - этот процесс лидер"""
+        now = time.time()
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO leader_leases (name, holder, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                    WHERE leader_leases.holder = excluded.holder OR leader_leases.expires_at < ?
+                ''', (self.name, self.holder, now + self.ttl, now))
+                row = conn.execute('SELECT holder FROM leader_leases WHERE name = ?', (self.name,)).fetchone()
+        finally:
+            conn.close()
+        return row is not None and row[0] == self.holder
+
+    def release(self):
+        """🏳️ Отдает аренду сразу, не дожидаясь ее истечения"""
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM leader_leases WHERE name = ? AND holder = ?', (self.name, self.holder))
+        finally:
+            conn.close()
@@ -0,0 +1,243 @@
+"""
+📤 Инкрементальная синхронизация реестра заявок с Google Sheets
+
+Триггеры базы пишут id каждой созданной или измененной заявки в журнал
+request_changes (одна строка на заявку, seq растет при каждом изменении).
+Фоновая задача забирает записи с seq выше сохраненного курсора, пачкой
+отправляет изменившиеся строки одним values:batchUpdate (соседние строки
+листа склеиваются в один диапазон) и только после успешного ответа
+сдвигает курсор. Ошибки 429/5xx повторяются с экспоненциальной паузой,
+за каждой заявкой закреплена своя строка листа.
+
+Клиент Sheets абстрагирован: GspreadSheetsClient работает с Google через
+gspread, HttpSheetsClient ходит в REST API по произвольному адресу,
+например в локальный bot/fake_sheets_api.py.
+"""
+import logging
+import random
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from spreadsheet import column_letter
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    ('id', "№"), ('created_at', "Создана"), ('username', "Пользователь"), ('phone', "Телефон"),
+    ('department', "Отдел"), ('problem', "Проблема"), ('urgency', "Срочность"), ('status', "Статус"),
+    ('assigned_admin', "Исполнитель"), ('assigned_at', "Взята в работу"), ('completed_at', "Выполнена"),
+    ('admin_comment', "Комментарий"), ('user_rating', "Оценка"), ('incident_id', "Инцидент"),
+)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+MAX_CELL_LENGTH = 50000   # Ограничение Google Sheets на длину ячейки
+DEFAULT_BASE_URL = 'https://sheets.googleapis.com'
+
+def sheet_range(sheet: str, first_row: int, last_row: int) -> str:
+    """📐 Диапазон строк листа во всю ширину реестра"""
+    quoted = sheet.replace("'", "''")
+    return f"'{quoted}'!A{first_row}:{column_letter(len(COLUMNS))}{last_row}"
+
+def cell(value: Any) -> Any:
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value[:MAX_CELL_LENGTH]
+    return value
+
+# ==================== КЛИЕНТЫ SHEETS ====================
+
+class SheetsApiError(Exception):
+    """❌ Ошибка API таблиц; status 0 - сетевая ошибка"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 0 or self.status in RETRYABLE_STATUSES
+
+class SheetsClient(ABC):
+    """📑 Минимальный интерфейс таблиц, нужный синхронизации"""
+
+    @abstractmethod
+    def values_batch_update(self, data: List[Dict[str, Any]]) -> None:
+        """✏️ Записывает значения в несколько диапазонов одним запросом"""
+
+    def close(self) -> None:
+        pass
+
+class HttpSheetsClient(SheetsClient):
+    """🌐 REST API Sheets v4 по произвольному адресу (локальный заменитель, эмуляторы)"""
+
+    def __init__(self, spreadsheet_id: str, base_url: str = DEFAULT_BASE_URL,
+                 token: Optional[str] = None, timeout: float = 30.0):
+        import httpx
+        self.url = f"{base_url.rstrip('/')}/v4/spreadsheets/{spreadsheet_id}/values:batchUpdate"
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self._http = httpx.Client(headers=headers, timeout=timeout)
+        self._transport_error = httpx.TransportError
+
+    def values_batch_update(self, data: List[Dict[str, Any]]) -> None:
+        try:
+            response = self._http.post(self.url, json={'valueInputOption': 'RAW', 'data': data})
+        except self._transport_error as e:
+            raise SheetsApiError(0, str(e)) from e
+        if response.status_code != 200:
+            raise SheetsApiError(response.status_code, response.text[:500])
+
+    def close(self) -> None:
+        self._http.close()
+
+class GspreadSheetsClient(SheetsClient):
+    """🔑 Google Sheets через gspread и сервисный аккаунт"""
+
+    def __init__(self, spreadsheet_id: str, credentials_file: str):
+        import gspread
+        self._errors = (gspread.exceptions.APIError,)
+        self._spreadsheet = gspread.service_account(filename=credentials_file).open_by_key(spreadsheet_id)
+
+    def values_batch_update(self, data: List[Dict[str, Any]]) -> None:
+        import requests
+        try:
+            self._spreadsheet.values_batch_update({'valueInputOption': 'RAW', 'data': data})
+        except self._errors as e:
+            raise SheetsApiError(e.response.status_code, str(e)) from e
+        except requests.exceptions.RequestException as e:
+            raise SheetsApiError(0, str(e)) from e
+
+def make_client(spreadsheet_id: str, credentials_file: str, base_url: Optional[str] = None) -> SheetsClient:
+    """🏭 Клиент по настройкам: свой адрес API - HTTP-клиент, иначе gspread"""
+    if base_url:
+        return HttpSheetsClient(spreadsheet_id, base_url)
+    return GspreadSheetsClient(spreadsheet_id, credentials_file)
+
+# ==================== СИНХРОНИЗАЦИЯ ====================
+
+class SheetsSync:
+    """📤 Отправка изменившихся заявок в лист пачками с сохранением курсора"""
+
+    def __init__(self, db_path: str, client: SheetsClient, sheet: str = "Заявки", batch_size: int = 500,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0,
+                 sleep: Optional[Callable[[float], None]] = None):
+        self.db_path = db_path
+        self.client = client
+        self.sheet = sheet
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # stop() прерывает паузы между повторами и не дает начать следующую пачку
+        self.stopped = threading.Event()
+        self.sleep = sleep or self.stopped.wait
+        self.retries = 0
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sheets_sync_state (
+                    sheet TEXT PRIMARY KEY,
+                    cursor INTEGER NOT NULL DEFAULT 0,
+                    synced_at TEXT
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sheets_rows (
+                    sheet TEXT NOT NULL,
+                    request_id INTEGER NOT NULL,
+                    row_number INTEGER NOT NULL,
+                    PRIMARY KEY (sheet, request_id)
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _with_backoff(self, data: List[Dict[str, Any]]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.values_batch_update(data)
+            except SheetsApiError as e:
+                if not e.retryable or attempt == self.max_retries or self.stopped.is_set():
+                    raise
+                # Экспоненциальная пауза с разбросом, чтобы не бить в квоту синхронно
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                self.retries += 1
+                logger.warning(f"⏳ Sheets ответил {e.status}, повтор через {delay:.1f} с")
+                self.sleep(delay)
+
+    def stop(self) -> None:
+        """⏹️ Просит текущую синхронизацию завершиться (вызывается из другого потока)"""
+        self.stopped.set()
+
+    def pending(self) -> int:
+        """📋 Сколько заявок ждут отправки"""
+        with self._connect() as conn:
+            cursor = conn.execute('SELECT cursor FROM sheets_sync_state WHERE sheet = ?', (self.sheet,))
+            row = cursor.fetchone()
+            position = row[0] if row else 0
+            return conn.execute('SELECT COUNT(*) FROM request_changes WHERE seq > ?', (position,)).fetchone()[0]
+
+    def sync_batch(self) -> int:
+        """📤 Отправляет одну пачку изменений, возвращает число строк"""
+        with self._connect() as conn:
+            state = conn.execute('SELECT cursor FROM sheets_sync_state WHERE sheet = ?', (self.sheet,)).fetchone()
+            position = state[0] if state else 0
+            names = ', '.join(f'r.{name}' for name, _ in COLUMNS)
+            changes = conn.execute(f'''
+                SELECT c.seq, s.row_number, {names}
+                FROM request_changes c
+                JOIN requests r ON r.id = c.request_id
+                LEFT JOIN sheets_rows s ON s.sheet = ? AND s.request_id = c.request_id
+                WHERE c.seq > ?
+                ORDER BY c.seq
+                LIMIT ?
+            ''', (self.sheet, position, self.batch_size)).fetchall()
+            if not changes:
+                return 0
+
+            # Новым заявкам - следующие свободные строки (строка 1 - заголовок)
+            last_row = conn.execute(
+                'SELECT COALESCE(MAX(row_number), 1) FROM sheets_rows WHERE sheet = ?', (self.sheet,)
+            ).fetchone()[0]
+            new_rows: List[Tuple[str, int, int]] = []
+            rows: Dict[int, List[Any]] = {}
+            for _, row_number, *values in changes:
+                if row_number is None:
+                    last_row += 1
+                    row_number = last_row
+                    new_rows.append((self.sheet, values[0], row_number))
+                rows[row_number] = [cell(value) for value in values]
+            if state is None:
+                rows[1] = [title for _, title in COLUMNS]
+
+            self._with_backoff(self._ranges(rows))
+
+            conn.executemany('INSERT INTO sheets_rows (sheet, request_id, row_number) VALUES (?, ?, ?)', new_rows)
+            conn.execute('''
+                INSERT INTO sheets_sync_state (sheet, cursor, synced_at) VALUES (?, ?, ?)
+                ON CONFLICT(sheet) DO UPDATE SET cursor = excluded.cursor, synced_at = excluded.synced_at
+            ''', (self.sheet, changes[-1][0], datetime.now().isoformat()))
+            return len(changes)
+
+    def _ranges(self, rows: Dict[int, List[Any]]) -> List[Dict[str, Any]]:
+        """📐 Соседние строки листа склеиваются в один диапазон"""
+        data: List[Dict[str, Any]] = []
+        for row_number in sorted(rows):
+            if data and data[-1]['last'] == row_number - 1:
+                data[-1]['values'].append(rows[row_number])
+                data[-1]['last'] = row_number
+            else:
+                data.append({'first': row_number, 'last': row_number, 'values': [rows[row_number]]})
+        return [{'range': sheet_range(self.sheet, item['first'], item['last']), 'values': item['values']}
+                for item in data]
+
+    def sync(self) -> int:
+        """🔁 Отправляет все накопившиеся изменения, возвращает число строк"""
+        total = 0
+        while True:
+            pushed = self.sync_batch()
+            total += pushed
+            if pushed < self.batch_size or self.stopped.is_set():
+                return total
@@ -0,0 +1,15 @@
+"""
+📐 Общие помощники табличных форматов
+
+Нужны и выгрузке в XLSX (export.py), и синхронизации с Google Sheets
+(sheets_sync.py); вынесены отдельно, чтобы выгрузка не зависела от модуля
+синхронизации.
+"""
+
+def column_letter(number: int) -> str:
+    """🔤 Номер колонки (с 1) в буквы A1-нотации"""
+    letters = ''
+    while number:
+        number, rest = divmod(number - 1, 26)
+        letters = chr(ord('A') + rest) + letters
+    return letters
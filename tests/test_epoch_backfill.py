@@ -0,0 +1,24 @@
+"""🕐 Фоновое заполнение секунд Unix"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bot'))
+
+import main  # noqa: E402
+
+
+def test_backfill_refreshes_cached_requests(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'query_stats', main.QueryStats(main.Config.SLOW_QUERY_MS, main.Config.N_PLUS_ONE_QUERIES))
+    db = main.EnhancedDatabase(str(tmp_path / 'requests.db'))
+    request_id = db.add_request(1, 'u1', '+79160000001', 'Не печатает принтер')
+    # Заявка из старой версии: секунд Unix еще нет, шаг миграции 7 не пройден
+    with db._connect() as conn:
+        conn.execute('UPDATE requests SET created_ts = NULL WHERE id = ?', (request_id,))
+        # Остальные шаги сбрасывают кэш сами - проверяем только этот
+        conn.execute("UPDATE schema_backfills SET done = NOT (version = 7 AND name = 'requests')")
+    db.request_cache.clear()
+    assert db.get_request(request_id)['created_ts'] is None
+
+    db.run_migration_backfills()
+
+    assert db.get_request(request_id)['created_ts'] is not None
@@ -0,0 +1,26 @@
+"""📤 Выгрузка заявок в CSV"""
+import csv
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bot'))
+
+import export  # noqa: E402
+import main  # noqa: E402
+
+
+def test_csv_escapes_formulas(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'query_stats', main.QueryStats(main.Config.SLOW_QUERY_MS, main.Config.N_PLUS_ONE_QUERIES))
+    db = main.EnhancedDatabase(str(tmp_path / 'requests.db'))
+    db.add_request(1, 'u1', '+79160000001', '=HYPERLINK("http://evil.example","Открыть")')
+    db.add_request(2, 'u2', '+79160000002', 'Не печатает принтер')
+    path = str(tmp_path / 'out.csv')
+
+    assert export.export_requests(db.db_path, path, 'csv') == 2
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.reader(f, delimiter=';'))
+    problems = {row[0]: row[6] for row in rows[1:]}
+    assert problems['1'] == '\'=HYPERLINK("http://evil.example","Открыть")'
+    assert problems['2'] == 'Не печатает принтер'
+    assert all(row[4].startswith("'+7") for row in rows[1:])
@@ -0,0 +1,29 @@
+"""⭐ Оценки заявок, в том числе уже перенесенных в архив"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bot'))
+
+import main  # noqa: E402
+
+
+def test_rating_of_archived_request_updates_summary(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'query_stats', main.QueryStats(main.Config.SLOW_QUERY_MS, main.Config.N_PLUS_ONE_QUERIES))
+    db = main.EnhancedDatabase(str(tmp_path / 'requests.db'))
+    request_id = db.add_request(1, 'u1', '+79160000001', 'Не печатает принтер')
+    db.update_request_status(request_id, 'completed', 'Админ')
+    with db._connect() as conn:
+        conn.execute('UPDATE requests SET completed_ts = ? WHERE id = ?',
+                     (main.epoch(datetime.now() - timedelta(days=10)), request_id))
+    assert db.archive_completed(older_than_days=1) == 1
+
+    assert db.add_user_feedback(request_id, 4)
+    assert db.get_request(request_id)['user_rating'] == 4
+    assert db.get_statistics()['avg_rating'] == 4
+
+    # Повторная оценка заменяет прежнюю, а не добавляется к ней
+    assert db.add_user_feedback(request_id, 2)
+    assert db.get_statistics()['avg_rating'] == 2
+
+    assert not db.add_user_feedback(request_id + 100, 5)
@@ -0,0 +1,91 @@
+"""🧲 Группировка похожих заявок в инциденты"""
+import os
+import sys
+from datetime import timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bot'))
+
+import main  # noqa: E402
+
+# Разные проблемы с общими словами «не работает», «помогите», «срочно»
+NEAR_MISSES = [
+    ('не работает интернет', 'не работает принтер'),
+    ('Не работает 1С', 'не работает ПК'),
+    ('Не работает 1С', 'не работает почта'),
+    ('Помогите, не работает телефон', 'Помогите, не работает сканер'),
+    ('Срочно! Не печатает принтер в бухгалтерии', 'Срочно! Не включается компьютер в бухгалтерии'),
+    ('Не работает интернет на 3 этаже', 'Не работает принтер на 3 этаже'),
+]
+# Одна и та же проблема, описанная разными словами
+DUPLICATES = [
+    ('Не работает интернет в 305 кабинете', 'В 305 кабинете нет интернета'),
+    ('Принтер HP на 2 этаже не печатает', 'не печатает принтер HP, 2 этаж'),
+    ('Не запускается 1С бухгалтерия', '1С бухгалтерия не запускается, ошибка'),
+    ('Не приходит почта в Outlook', 'Outlook: почта не приходит'),
+]
+
+def make_index(*texts):
+    index = main.IncidentIndex(main.Config.INCIDENT_SIMILARITY, timedelta(hours=3))
+    for request_id, text in enumerate(texts, start=1):
+        index.add(request_id, text)
+    return index
+
+@pytest.mark.parametrize('indexed, new', NEAR_MISSES)
+def test_near_miss_is_not_grouped(indexed, new):
+    assert make_index(indexed).find(new) is None
+
+@pytest.mark.parametrize('indexed, new', DUPLICATES)
+def test_duplicate_is_grouped(indexed, new):
+    assert make_index(indexed).find(new) == 1
+
+def test_generic_phrase_matches_nothing():
+    index = make_index('не работает интернет', 'Не работает 1С')
+    for text in ('не работает принтер', 'не работает ПК', 'не работает почта', 'не работает'):
+        assert index.find(text) is None
+
+def test_common_term_weighs_less():
+    index = make_index('принтер 3 этаж', 'сканер 3 этаж', 'ксерокс 3 этаж')
+    assert index.find('принтер 5 этаж') is None
+
+def test_complete_incident_respects_other_admins(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'query_stats', main.QueryStats(main.Config.SLOW_QUERY_MS, main.Config.N_PLUS_ONE_QUERIES))
+    db = main.EnhancedDatabase(str(tmp_path / 'requests.db'))
+    root = db.add_request(1, 'u1', '+79160000001', 'Не работает интернет в 305')
+    new_child = db.add_request(2, 'u2', '+79160000002', 'нет интернета в 305', incident_id=root)
+    mine = db.add_request(3, 'u3', '+79160000003', 'интернет 305', incident_id=root)
+    theirs = db.add_request(4, 'u4', '+79160000004', 'в 305 нет интернета', incident_id=root)
+    db.update_request_status(mine, 'in_progress', 'Админ А')
+    db.update_request_status(theirs, 'in_progress', 'Админ Б')
+
+    completed = db.complete_incident(root, 'Перезагрузил коммутатор', 'Админ А')
+
+    assert sorted(request['id'] for request in completed) == [new_child, mine]
+    assert db.get_request(new_child)['status'] == 'completed'
+    assert db.get_request(new_child)['assigned_admin'] == 'Админ А'
+    assert db.get_request(new_child)['assigned_ts'] is not None
+    assert db.get_request(theirs)['status'] == 'in_progress'
+    assert db.get_request(theirs)['assigned_admin'] == 'Админ Б'
+
+
+def test_incident_notifications_are_shared_between_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'query_stats', main.QueryStats(main.Config.SLOW_QUERY_MS, main.Config.N_PLUS_ONE_QUERIES))
+    path = str(tmp_path / 'requests.db')
+    sender = main.EnhancedDatabase(path)
+    root = sender.add_request(1, 'u1', '+79160000001', 'Не работает интернет в 305')
+    sender.add_incident_notifications(root, {10: 100, 20: 200})
+
+    # Другой воркер открывает ту же базу и видит отправленные сообщения
+    worker = main.EnhancedDatabase(path)
+    worker.add_incident_notifications(root, {20: 201})
+    assert worker.get_incident_notifications(root) == {10: 100, 20: 201}
+
+    # Сводка с основной заявкой учитывается отдельно от уведомлений об инциденте
+    worker.add_incident_notifications(root, {30: 300}, kind='digest')
+    assert worker.get_incident_notifications(root, kind='digest') == {30: 300}
+    assert 30 not in worker.get_incident_notifications(root)
+
+    sender.delete_incident_notifications(root)
+    assert worker.get_incident_notifications(root) == {}
+    assert worker.get_incident_notifications(root, kind='digest') == {}
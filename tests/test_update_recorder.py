@@ -0,0 +1,77 @@
+"""📼 Обезличивание записанных обновлений"""
+import json
+import os
+import sys
+
+from telegram import Bot, Update, User
+from telegram.ext import CommandHandler, filters
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'bot'))
+
+import main  # noqa: E402
+
+
+def make_recorder(tmp_path):
+    return main.UpdateRecorder(str(tmp_path / 'updates.jsonl'), salt='test')
+
+
+def test_contact_is_anonymized(tmp_path):
+    recorder = make_recorder(tmp_path)
+    update = {'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'},
+        'contact': {'phone_number': '+79161234567', 'first_name': 'Иван', 'last_name': 'Петров',
+                    'user_id': 42, 'vcard': 'BEGIN:VCARD\nFN:Иван Петров\nEND:VCARD'},
+    }}
+
+    contact = recorder._anonymize(update)['message']['contact']
+
+    assert contact['user_id'] == recorder._map_id(42)
+    assert contact['first_name'] == f"User{recorder._map_id(42)}"
+    assert 'last_name' not in contact and 'vcard' not in contact
+    assert contact['phone_number'] != '+79161234567'
+    assert main.normalize_phone(contact['phone_number'])[0]
+
+
+def test_only_menu_buttons_keep_text(tmp_path):
+    recorder = make_recorder(tmp_path)
+
+    assert recorder._anonymize_text("📝 Создать заявку") == "📝 Создать заявку"
+    assert recorder._anonymize_text("/start") == "/start"
+    problem = "🔥 Сервер упал, пароль admin123"
+    anonymized = recorder._anonymize_text(problem)
+    assert anonymized != problem and len(anonymized) == len(problem)
+
+
+def test_recorded_command_still_matches_command_handler(tmp_path):
+    recorder = make_recorder(tmp_path)
+    bot = Bot('1:test')
+    bot._bot_user = User(1, 'Бот', is_bot=True, username='test_bot')   # Как после getMe, без сети
+    update = Update.de_json({'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'},
+        'from': {'id': 42, 'is_bot': False, 'first_name': 'Иван'},
+        'text': '/cancel', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 7}],
+    }}, bot)
+
+    recorder.record(update)
+    line = (tmp_path / 'updates.jsonl').read_text(encoding='utf-8').splitlines()[-1]
+    replayed = Update.de_json(json.loads(line)['update'], bot)
+
+    assert CommandHandler('cancel', lambda *_: None).check_update(replayed)
+    assert not (filters.TEXT & ~filters.COMMAND).check_update(replayed)
+
+
+def test_entities_with_personal_data_are_dropped(tmp_path):
+    recorder = make_recorder(tmp_path)
+    message = {
+        'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'},
+        'text': 'Позвоните Ивану',
+        'entities': [
+            {'type': 'bold', 'offset': 0, 'length': 9},
+            {'type': 'text_mention', 'offset': 10, 'length': 5, 'user': {'id': 7, 'is_bot': False, 'first_name': 'Иван'}},
+            {'type': 'text_link', 'offset': 0, 'length': 9, 'url': 'https://example.com/secret'},
+        ],
+    }
+
+    entities = recorder._anonymize({'message': message})['message']['entities']
+
+    assert entities == [{'type': 'bold', 'offset': 0, 'length': 9}]